@@ -0,0 +1,376 @@
+#
+# Copyright 2024-2025 Jean-Luc.CHARLES@mailo.com
+#
+
+#
+# The acquisition pipeline of the ROTOR bench: the hardware thread (ROTOR_bench) only
+# moves the motors and reads the raw 'RD x,y,z' replies of the sensor; the DataWriter
+# thread decodes the raw values, converts them to mT, formats the lines, writes the
+# data file and displays the [DATA] lines.
+# The lines are buffered and written on the disk according to the flush policy:
+#  - 'lines': every FILE_FLUSH_EVERY_N lines,
+#  - 'time' : every FILE_FLUSH_EVERY_SEC seconds,
+#  - 'zpos' : at each Z position boundary (see DataWriter.boundary()).
+# After each flush a small journal '<data file>.journal' records the size of the
+# data file known to be on the disk: after a power cut, recover_data_file() truncates
+# the data file to this size, so at most one flush window is lost.
+# The journal also records the progress of the run (the position of the last line on
+# the disk): with the checkpoint file (Param['CHECKPOINT_FILE']) that records the
+# params and the current data file of the run, an interrupted run can be resumed.
+# Each line written is also published on the local UDP port Param['LIVE_PORT'] (see
+# LivePublisher), for the "Live" tab of the Processing app.
+#
+
+import os, json, math, socket
+import numpy as np
+from queue import Queue, Empty
+from threading import Thread
+from contextlib import nullcontext
+from time import monotonic
+
+from ROTOR_config import Param
+
+FLUSH_POLICIES = ('lines', 'time', 'zpos')
+
+# the control message sent to the writer thread at a Z position boundary:
+BOUNDARY = 'BOUNDARY'
+
+def flush_policy(params:dict = None):
+    '''
+    Returns the flush policy keyword arguments of DataWriter, the values of the
+    params (/tmp/ROTOR_LAUNCH.txt) override the default values of Param.
+    '''
+    if params is None: params = {}
+    policy = params.get('FILE_FLUSH_POLICY', Param['FILE_FLUSH_POLICY'])
+    if policy not in FLUSH_POLICIES:
+        raise ValueError(f"FILE_FLUSH_POLICY must be one of {FLUSH_POLICIES}, not <{policy}>")
+    return {'policy':    policy,
+            'every_n':   params.get('FILE_FLUSH_EVERY_N', Param['FILE_FLUSH_EVERY_N']),
+            'every_sec': params.get('FILE_FLUSH_EVERY_SEC', Param['FILE_FLUSH_EVERY_SEC'])}
+
+def journal_name(fileName:str):
+    '''Returns the name of the journal of the data file fileName.'''
+    return fileName + '.journal'
+
+def save_checkpoint(checkpoint:dict):
+    '''
+    To write the checkpoint of the current run (replaced atomically).
+    '''
+    ckptName = Param['CHECKPOINT_FILE']
+    tmpName  = ckptName + '.tmp'
+    with open(tmpName, "w", encoding="utf8") as f:
+        json.dump(checkpoint, f, indent=1)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmpName, ckptName)
+
+def load_checkpoint():
+    '''
+    Returns the checkpoint of the interrupted run (dict), or None if there is no checkpoint.
+    '''
+    ckptName = Param['CHECKPOINT_FILE']
+    if not os.path.exists(ckptName): return None
+    with open(ckptName, "r", encoding="utf8") as f:
+        return json.load(f)
+
+def remove_checkpoint():
+    '''
+    To remove the checkpoint once the run is complete.
+    '''
+    ckptName = Param['CHECKPOINT_FILE']
+    if os.path.exists(ckptName): os.remove(ckptName)
+
+def recover_data_file(fileName:str, verbose:bool = True):
+    '''
+    To truncate the data file 'fileName' to the last size recorded in its journal (the data
+    written after the last flush may be incomplete after a power cut).
+    Returns the journal (dict), or None if there is no journal.
+    '''
+    jName = journal_name(fileName)
+    if not os.path.exists(jName): return None
+    with open(jName, "r", encoding="utf8") as f:
+        journal = json.load(f)
+    size = os.path.getsize(fileName)
+    if size > journal['offset']:
+        with open(fileName, "r+b") as f:
+            f.truncate(journal['offset'])
+        if verbose:
+            print(f"[WARNING] <{fileName}> truncated from {size} to {journal['offset']} bytes ({journal['lines']} data lines)")
+    return journal
+
+def decode_frame(raw):
+    '''
+    Converts the raw values (bytes) of a 'RD x,y,z' reply of the sensor into X, Y, Z in mT.
+    '''
+    coeff = Param['SENSOR_Oe_mT']
+    X, Y, Z = (float(v) * coeff for v in raw)
+    return X, Y, Z
+
+def averaging_policy(params:dict = None):
+    '''
+    Returns the averaging parameters of the ByAngle mode (dict), the values of the
+    params (/tmp/ROTOR_LAUNCH.txt) override the default values of Param.
+    Returns None if averaging is off (AVG_MAX_READS <= 1).
+    '''
+    if params is None: params = {}
+    max_reads = params.get('AVG_MAX_READS', Param['AVG_MAX_READS'])
+    if max_reads <= 1: return None
+    return {'max_reads': max_reads,
+            'min_reads': min(max(2, params.get('AVG_MIN_READS', Param['AVG_MIN_READS'])), max_reads),
+            'sem_mT':    params.get('AVG_SEM_MT', Param['AVG_SEM_MT'])}
+
+def settle_policy(params:dict = None):
+    '''
+    Returns the parameters of the settle detection after the moves (dict), the values of the
+    params (/tmp/ROTOR_LAUNCH.txt) override the default values of Param.
+    Returns None if the settle detection is off (SETTLE_MAX_S <= 0).
+    '''
+    if params is None: params = {}
+    max_s = params.get('SETTLE_MAX_S', Param['SETTLE_MAX_S'])
+    if max_s <= 0: return None
+    return {'max_s':  max_s,
+            'tol_mT': params.get('SETTLE_TOL_MT', Param['SETTLE_TOL_MT'])}
+
+
+class RunningStats():
+    '''
+    The running mean and variance of the X, Y, Z components of the magnetic field
+    (Welford's algorithm: one pass, numerically stable).
+    '''
+    def __init__(self):
+        self.n    = 0
+        self.mean = [0., 0., 0.]
+        self.M2   = [0., 0., 0.]    # the sums of the squared deviations from the mean
+
+    def add(self, values):
+        '''To add the X, Y, Z values of a new read.'''
+        self.n += 1
+        for i, x in enumerate(values):
+            delta = x - self.mean[i]
+            self.mean[i] += delta / self.n
+            self.M2[i]   += delta * (x - self.mean[i])
+
+    def sigma(self):
+        '''Returns the standard deviations of X, Y, Z.'''
+        if self.n < 2: return [0., 0., 0.]
+        return [math.sqrt(m2 / (self.n - 1)) for m2 in self.M2]
+
+    def sem(self):
+        '''Returns the standard errors of the means of X, Y, Z.'''
+        return [s / math.sqrt(self.n) for s in self.sigma()]
+
+
+def refine_intervals(fields, coarse_step:float, grad_max:float, curv_max:float):
+    '''
+    The coarse pass of the Adaptive mode: 'fields' is a list (one item for each Z position)
+    of the arrays (nb_coarse, 3) of the X, Y, Z values [mT] measured every 'coarse_step' [°]
+    over a full rotation.
+    An interval between 2 coarse angles is refined if, for one of the Z positions, the gradient
+    of Bx or Bz is above 'grad_max' [mT/°] on the interval, or their curvature is above
+    'curv_max' [mT/°²] at one of its ends.
+    Returns the sorted list of the ranks of the intervals to refine (the same for all Z positions).
+    '''
+    flagged = set()
+    for field in fields:
+        B = np.asarray(field)[:, (0, 2)]        # Bx and Bz
+        # the field is periodic, interval i is [angle i, angle i+1]:
+        grad = np.abs(np.roll(B, -1, axis=0) - B) / coarse_step
+        curv = np.abs(np.roll(B, -1, axis=0) - 2*B + np.roll(B, 1, axis=0)) / coarse_step**2
+        steep  = (grad > grad_max).any(axis=1)
+        curved = (curv > curv_max).any(axis=1)
+        flagged.update(np.flatnonzero(steep | curved | np.roll(curved, -1)).tolist())
+    return sorted(flagged)
+
+
+def format_FreeRun(record):
+    '''record: (t_read, raw) => line of a FREE file.'''
+    t_read, raw = record
+    X, Y, Z = decode_frame(raw)
+    line = f'{t_read:5.2f};{X:12.6f};{Y:12.6f};{Z:12.6f}'
+    return line, line
+
+def format_ByZPos(record):
+    '''record: (angle, [raw for each Zpos]) => line of a "ByZPos" file.'''
+    angle, list_raw = record
+    line = f'{angle:5.1f}'
+    for raw in list_raw:
+        X, Y, Z = decode_frame(raw)
+        line += f';{X:12.6f};{Y:12.6f};{Z:12.6f}'
+    return line, line
+
+def format_ByAngle(record):
+    '''record: (n, angle, raw) => line of a "ByAngle" file.'''
+    n, angle, raw = record
+    X, Y, Z = decode_frame(raw)
+    values = f'{angle:5.1f};{X:12.6f};{Y:12.6f};{Z:12.6f}'
+    return f'{n:2d};' + values, values
+
+def format_ByAngle_avg(record):
+    '''record: (n, angle, RunningStats) => line of an averaged "ByAngle" file.'''
+    n, angle, stats = record
+    X, Y, Z = stats.mean
+    sX, sY, sZ = stats.sigma()
+    values = f'{angle:5.1f};{X:12.6f};{Y:12.6f};{Z:12.6f}'
+    line = f'{n:2d};' + values + f';{sX:10.6f};{sY:10.6f};{sZ:10.6f};{stats.n:3d}'
+    return line, values + f' ({stats.n} reads)'
+
+
+class LivePublisher():
+    '''
+    To publish the measurements on the local UDP port 'port' as JSON datagrams:
+     - {"type": "start", "MODE": ..., "file": ..., "Z_POS_MM": [...], "ROT_STEP_DEG": ...} at
+       the start of each data file,
+     - {"type": "data", "file": ..., "points": [[n, angle, X, Y, Z], ...]} for each line of the
+       data file (n: rank of the Z position, angle [°] or time [s] for the FreeRun, XYZ [mT]).
+    Publishing never blocks nor fails the run: the datagrams are lost when nobody listens.
+    '''
+    def __init__(self, port:int, host:str = '127.0.0.1'):
+        self.address = (host, port)
+        self.sock    = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        self.MODE    = None
+        self.file    = None
+
+    def send(self, message:dict):
+        try:
+            self.sock.sendto(json.dumps(message).encode(), self.address)
+        except OSError:
+            pass
+
+    def start(self, MODE:str, fileName:str, Zpos_mm:list = None, rot_step:float = None):
+        self.MODE, self.file = MODE, os.path.basename(fileName)
+        self.send({'type': 'start', 'MODE': MODE, 'file': self.file,
+                   'Z_POS_MM': Zpos_mm, 'ROT_STEP_DEG': rot_step})
+
+    def publish(self, line:str):
+        '''
+        To publish the measurements of the data file line 'line'.
+        '''
+        values = [float(v) for v in line.split(';')]
+        match self.MODE:
+            case 'ByZPos':
+                # angle; X1; Y1; Z1; X2; Y2; Z2...
+                points = [[n, values[0]] + values[1+3*n:4+3*n] for n in range((len(values) - 1) // 3)]
+            case 'FreeRun':
+                points = [[0] + values[:4]]
+            case _:
+                # the "ByAngle" layout: n; angle; X; Y; Z [; sX; sY; sZ; nb_read]
+                points = [[int(values[0])] + values[1:5]]
+        self.send({'type': 'data', 'file': self.file, 'points': points})
+
+class DataWriter(Thread):
+    '''
+    The consumer thread of the acquisition pipeline: the records put in the bounded queue
+    are formatted by the function 'format_record' (record => (file line, console line)),
+    written in the file 'fOut' and displayed.
+    When the queue is full, put() blocks the hardware thread until the writer catches up.
+    The file is flushed (and synced on the disk) according to 'policy', see flush_policy().
+    'progress' is the position of the run of the last line already in the file (resumed run).
+    'live' is the LivePublisher of the lines written, if any.
+    'telemetry' is the Telemetry of the run, if any: the 'decode' and 'file_write' phases are recorded.
+    '''
+    def __init__(self, fOut, format_record, maxsize:int = 256, verbose:bool = True,
+                 policy:str = 'lines', every_n:int = 10, every_sec:float = 5., progress:dict = None,
+                 live:LivePublisher = None, telemetry = None):
+        super().__init__(daemon=True)
+        self.fOut          = fOut
+        self.format_record = format_record
+        self.verbose       = verbose
+        self.policy        = policy
+        self.every_n       = max(1, every_n)
+        self.every_sec     = every_sec
+        self.queue         = Queue(maxsize)
+        self.error         = None     # the exception raised in the writer thread, if any
+        self.nb_record     = 0
+        self.nb_pending    = 0        # the number of lines written since the last flush
+        self.t_flush       = monotonic()
+        self.progress      = progress # the position of the run of the last line written
+        self.live          = live
+        self.phase         = nullcontext if telemetry is None else telemetry.phase
+        self.journal       = journal_name(fOut.name)
+        # the journal exists as long as the data file is not complete:
+        self.flush()
+        self.start()
+
+    def put(self, record, progress:dict = None):
+        '''
+        To send a record to the writer thread, 'progress' is the position of the run
+        (see the run_by_... methods of ROTOR_bench) recorded in the journal with the record.
+        '''
+        if self.error is not None: raise self.error
+        self.queue.put((record, progress))
+
+    def boundary(self):
+        '''
+        To tell the writer thread that the measurements of a Z position are complete.
+        '''
+        self.put(BOUNDARY)
+
+    def close(self):
+        '''
+        To wait until all the records are written and to close the data file.
+        '''
+        self.queue.put(None)
+        self.join()
+        if self.error is None: self.flush()
+        self.fOut.close()
+        if self.error is not None: raise self.error
+        # the data file is complete, the journal is no longer needed:
+        if os.path.exists(self.journal): os.remove(self.journal)
+
+    def flush(self):
+        '''
+        To write the buffered lines on the disk, then to update the journal.
+        '''
+        self.fOut.flush()
+        os.fsync(self.fOut.fileno())
+        self.nb_pending = 0
+        self.t_flush = monotonic()
+
+        # the journal is replaced atomically, it is never found half written:
+        journal = {'offset': os.fstat(self.fOut.fileno()).st_size, 'lines': self.nb_record,
+                   'progress': self.progress}
+        tmpName = self.journal + '.tmp'
+        with open(tmpName, "w", encoding="utf8") as f:
+            json.dump(journal, f)
+        os.replace(tmpName, self.journal)
+
+    def flush_required(self, record):
+        '''
+        Returns True if the lines must be flushed after 'record', according to the flush policy.
+        '''
+        if self.nb_pending == 0: return False
+        match self.policy:
+            case 'lines': return self.nb_pending >= self.every_n
+            case 'time':  return monotonic() - self.t_flush >= self.every_sec
+            case 'zpos':  return record is BOUNDARY
+        return True
+
+    def run(self):
+        # with the 'time' policy, the writer thread must wake up even if no record arrives:
+        timeout = self.every_sec if self.policy == 'time' else None
+        while True:
+            try:
+                item = self.queue.get(timeout=timeout)
+            except Empty:
+                item = (BOUNDARY, None)
+            if item is None: break
+            record, progress = item
+            # after an error, keep emptying the queue so that the hardware thread is never blocked:
+            if self.error is not None: continue
+            try:
+                if record is not BOUNDARY:
+                    with self.phase('decode'):
+                        line, console_line = self.format_record(record)
+                    with self.phase('file_write'):
+                        self.fOut.write(line + '\n')
+                    self.nb_record  += 1
+                    self.nb_pending += 1
+                    if progress is not None: self.progress = progress
+                    if self.verbose: print("[DATA] " + console_line)
+                    if self.live is not None: self.live.publish(line)
+                if self.flush_required(record):
+                    with self.phase('file_write'): self.flush()
+            except Exception as err:
+                print(f"[ERROR] DataWriter: {err}")
+                self.error = err
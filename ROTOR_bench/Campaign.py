@@ -0,0 +1,331 @@
+#
+# Copyright 2024-2025 Jean-Luc.CHARLES@mailo.com
+#
+
+#
+# The campaign scheduler: runs back-to-back the jobs of a campaign file, unattended.
+#
+# The campaign file is a JSON file, either a list of param dicts (the strike.py schema),
+# or a dict {"name": "...", "defaults": {...}, "jobs": [...]} where the "defaults" params
+# are used for all the jobs.
+#
+# The scheduler:
+#  1/ validates all the jobs before moving anything,
+#  2/ orders the jobs: the 'Free' jobs (motors released) first, then the jobs grouped by
+#     WORK_DIST (set by hand on the bench, the operator is asked to change it between the
+#     groups), sorted by their final Z position (the longest move back to the limit switch
+#     is done by the last job of the group),
+#  3/ predicts the duration of each job with a timing model of ROTOR_bench (motion profiles
+#     of the stepper motors + duration of the sensor reads, updated with the measured reads),
+#  4/ runs the jobs with the same ROTOR_bench object (serial link kept open, motors torques
+#     kept between the jobs so that the Z position of the carriage is known), the data files
+#     go in the campaign directory TXT/CAMPAIGN_<date>_<name>/ with the manifest.json file.
+#
+# Usage: python Campaign.py campaign.json [--dry_run] [--backend rpi|sim] [--time_scale X]
+#
+
+import os, sys, json
+import numpy as np
+from datetime import datetime
+from time import time
+
+from ROTOR_config import Param, Zaxis
+from Motion import motion_profile, plan_carriage
+from Acquisition import averaging_policy, settle_policy, FLUSH_POLICIES
+
+MODES = ('ByAngle', 'ByZPos', 'Continuous', 'Adaptive', 'Free')
+
+def load_campaign(fileName:str):
+    '''
+    Returns the name and the list of the jobs (param dicts) of the campaign file 'fileName'.
+    '''
+    with open(fileName, "r", encoding="utf8") as f:
+        campaign = json.load(f)
+    name = os.path.splitext(os.path.basename(fileName))[0]
+    if isinstance(campaign, list):
+        return name, campaign
+    defaults = campaign.get('defaults', {})
+    return campaign.get('name', name), [{**defaults, **job} for job in campaign['jobs']]
+
+def validate_job(job:dict, stepper1):
+    '''
+    Returns the list of the errors (empty if the job is valid) of the param dict 'job'.
+    '''
+    errors = []
+    MODE = job.get('MODE')
+    if MODE not in MODES:
+        return [f"MODE must be one of {MODES}, not <{MODE}>"]
+
+    nb_repet = job.get('NB_REPET')
+    if not isinstance(nb_repet, int) or nb_repet < 1:
+        errors.append(f"NB_REPET must be an integer >= 1, not <{nb_repet}>")
+    if job.get('FILE_FLUSH_POLICY', Param['FILE_FLUSH_POLICY']) not in FLUSH_POLICIES:
+        errors.append(f"FILE_FLUSH_POLICY must be one of {FLUSH_POLICIES}")
+
+    if MODE == 'Free':
+        for key in ('DURATION', 'SAMPLING'):
+            if not isinstance(job.get(key), (int, float)) or job[key] <= 0:
+                errors.append(f"{key} must be a number > 0, not <{job.get(key)}>")
+        return errors
+
+    work_dist = job.get('WORK_DIST')
+    if not isinstance(work_dist, int) or work_dist < 0:
+        errors.append(f"WORK_DIST must be an integer >= 0, not <{work_dist}>")
+
+    rot_step = job.get('ROT_STEP_DEG')
+    if not isinstance(rot_step, (int, float)) or rot_step <= 0:
+        errors.append(f"ROT_STEP_DEG must be a number > 0, not <{rot_step}>")
+    else:
+        nb_step = rot_step * stepper1.RATIO / stepper1.STEPPER_ANGLE
+        if abs(nb_step - round(nb_step)) > 1e-6:
+            errors.append(f"ROT_STEP_DEG {rot_step}° is not a whole number of shaft steps")
+        if abs(360 / rot_step - round(360 / rot_step)) > 1e-6:
+            errors.append(f"ROT_STEP_DEG {rot_step}° does not divide 360°")
+
+    Zpos_mm = job.get('Z_POS_MM')
+    if not isinstance(Zpos_mm, list) or not Param['MIN_NB_ZPOS'] <= len(Zpos_mm) <= Param['MAX_NB_ZPOS']:
+        errors.append(f"Z_POS_MM must be a list of {Param['MIN_NB_ZPOS']} to {Param['MAX_NB_ZPOS']} positions")
+    elif any(not isinstance(z, int) or not Param['ZPOS_MIN'] <= z <= Param['ZPOS_MAX'] for z in Zpos_mm):
+        errors.append(f"the Z_POS_MM values must be integers in [{Param['ZPOS_MIN']}, {Param['ZPOS_MAX']}]")
+    return errors
+
+def carriage_Zpos(job:dict):
+    '''
+    Returns the positions [mm] of the sensor carriage during the job: with several probes the modes
+    'ByAngle' and 'ByZPos' measure several Z positions at each carriage position (see Motion.plan_carriage).
+    '''
+    Zpos_mm = job.get('Z_POS_MM')
+    if job['MODE'] in ('ByAngle', 'ByZPos'):
+        Zpos_mm = [carriage for carriage, _ in plan_carriage(Zpos_mm, Param['PROBE_Z_OFFSETS_MM'])]
+    return Zpos_mm
+
+def job_end_Zpos(job:dict):
+    '''
+    Returns the Z position [mm] of the sensor at the end of the job, None if unknown (motors released).
+    '''
+    if job['MODE'] == 'Free': return None
+    Zpos_mm = carriage_Zpos(job)
+    match job['MODE']:
+        case 'ByZPos':
+            # the Z scan goes downward at the even angles, upward at the odd ones:
+            nb_angle = int(round(360 / job['ROT_STEP_DEG']))
+            return Zpos_mm[-1] if (nb_angle - 1) % 2 == 0 else Zpos_mm[0]
+        case 'Adaptive':
+            # the refine pass visits the Z positions backward:
+            return Zpos_mm[0]
+        case _:
+            return Zpos_mm[-1]
+
+def order_jobs(jobs:list):
+    '''
+    Returns the list of the (rank in the campaign file, job) in the execution order.
+    '''
+    def key(item):
+        rank, job = item
+        end = job_end_Zpos(job)
+        return (job.get('WORK_DIST', -1), end is not None, end or 0, rank)
+    return sorted(enumerate(jobs), key=key)
+
+class TimingModel():
+    '''
+    The timing model of the ROTOR_bench runs: the durations of the moves are computed with
+    the motion profiles of the stepper motors, a sensor read lasts 'read_s' seconds.
+    '''
+    def __init__(self, stepper1, stepper2, read_s:float = None):
+        self.stepper1 = stepper1
+        self.stepper2 = stepper2
+        self.read_s   = Param['CAMPAIGN_READ_S'] if read_s is None else read_s
+
+    def move_time(self, stepper, nb_step:int, revol_per_sec:float = None):
+        if nb_step <= 0: return 0.
+        return float(sum(motion_profile(stepper, nb_step, revol_per_sec)))
+
+    def shaft_time(self, nb_step:int):
+        return self.move_time(self.stepper1, nb_step)
+
+    def Z_time(self, dist_mm:float, speed_mm_per_sec:float = Zaxis.Z_velocity.value):
+        # same conversions as ROTOR_bench.Z_nb_step() and ROTOR_bench.Z_revol_per_sec():
+        nb_step = int(2. * 180 * abs(dist_mm) / (self.stepper2.STEPPER_ANGLE * np.pi * self.stepper2.DIAM_MM))
+        N_Hz = 2. * speed_mm_per_sec / (np.pi * self.stepper2.DIAM_MM)
+        return self.move_time(self.stepper2, nb_step, N_Hz)
+
+    def Zref_time(self, from_mm:float):
+        '''
+        The duration of a Z referencing from 'from_mm' (None when the Z position is unknown).
+        '''
+        backoff = Zaxis.Zref_backoff.value
+        if from_mm is None: from_mm = Param['ZPOS_MAX'] / 2
+        return self.Z_time(max(0, from_mm - backoff), Zaxis.Zref_fast_velocity.value) + \
+               backoff / Zaxis.Zref_velocity.value
+
+    def job_time(self, job:dict, from_mm:float = None):
+        '''
+        Returns the predicted duration [s] of the job 'job', the sensor being at 'from_mm' before the job.
+        '''
+        if job['MODE'] == 'Free':
+            return job['NB_REPET'] * job['DURATION']
+
+        rot_step = job['ROT_STEP_DEG']
+        Zpos_mm  = carriage_Zpos(job)
+        nb_Z     = len(Zpos_mm)
+        nb_angle = int(round(360 / rot_step))
+        NBSTEP1  = round(rot_step * self.stepper1.RATIO / self.stepper1.STEPPER_ANGLE)
+        span     = Zpos_mm[-1] - Zpos_mm[0]
+        # the reads at each pose: one read, or about 3 reads with the settle detection after the moves:
+        nb_read  = 1 if settle_policy(job) is None else 3
+
+        match job['MODE']:
+            case 'ByAngle':
+                averaging = averaging_policy(job)
+                if averaging is not None: nb_read += averaging['min_reads'] - 1
+                t = nb_Z * nb_angle * (nb_read * self.read_s + self.shaft_time(NBSTEP1))
+                t += self.Z_time(Zpos_mm[0])
+
+            case 'ByZPos':
+                t_angle = nb_Z * nb_read * self.read_s + self.Z_time(span) + self.shaft_time(NBSTEP1)
+                if nb_Z == 1 and nb_read == 1: t_angle = max(t_angle, 1.)
+                t = nb_angle * t_angle + self.Z_time(Zpos_mm[0])
+                # the Z verifications:
+                nb_verif = (nb_angle - 1) // Zaxis.ZREF_EVERY_ROTSTEP.value
+                t += nb_verif * (2 * self.Z_time(Param['ZREF_PROBE_MM'], Zaxis.Zref_velocity.value)
+                                 + self.Z_time(Zpos_mm[0] - Zaxis.Zref_margin.value))
+
+            case 'Continuous':
+                revol_per_sec = job.get('ROT_REVOL_PER_SEC', self.stepper1.NB_REVOL_PER_SEC)
+                t_revol = 360 / self.stepper1.STEPPER_ANGLE * self.stepper1.RATIO / \
+                          (revol_per_sec * self.stepper1.NB_STEP_PER_REVOL)
+                t = nb_Z * t_revol + self.Z_time(Zpos_mm[-1])
+
+            case 'Adaptive':
+                # the coarse pass, and a refine pass of about 1/3 of the other angles:
+                m = max(1, round(job.get('ADAPT_COARSE_STEP_DEG', Param['ADAPT_COARSE_STEP_DEG']) / rot_step))
+                nb_read *= nb_Z * (nb_angle / m + (nb_angle - nb_angle / m) / 3)
+                t = nb_read * self.read_s + 2 * nb_Z * self.shaft_time(nb_angle * NBSTEP1)
+                t += 2 * self.Z_time(Zpos_mm[-1])
+
+        # a Z referencing at the start of each repetition:
+        return job['NB_REPET'] * t + self.Zref_time(from_mm) + \
+               (job['NB_REPET'] - 1) * self.Zref_time(job_end_Zpos(job))
+
+def format_duration(sec:float):
+    h, m = divmod(round(sec) // 60, 60)
+    return f"{h}h{m:02d}" if h else f"{m}min{round(sec) % 60:02d}"
+
+def save_manifest(campaign_dir:str, manifest:dict):
+    '''
+    To write the manifest of the campaign (written to a temporary file first, so that the
+    manifest on the disk is always complete).
+    '''
+    fileName = os.path.join(campaign_dir, 'manifest.json')
+    with open(fileName + '.tmp', "w", encoding="utf8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(fileName + '.tmp', fileName)
+
+def plan_campaign(jobs:list, model:TimingModel):
+    '''
+    Returns the execution plan: the list of the dicts {rank, job, predicted_s}.
+    '''
+    plan, from_mm = [], None
+    for rank, job in order_jobs(jobs):
+        plan.append({'rank': rank, 'job': job, 'predicted_s': round(model.job_time(job, from_mm), 1)})
+        from_mm = job_end_Zpos(job)
+    return plan
+
+def run_campaign(R, run_job, name:str, jobs:list, model:TimingModel):
+    '''
+    To run all the jobs of the campaign with the ROTOR_bench object R.
+    Returns the manifest of the campaign.
+    '''
+    plan = plan_campaign(jobs, model)
+    now  = datetime.now()
+    campaign_dir = f'TXT/CAMPAIGN_{now.strftime("%Y-%m-%d-%H-%M")}_{name}'
+    os.makedirs(campaign_dir, exist_ok=True)
+    manifest = {'name': name, 'start': now.isoformat(timespec='seconds'), 'end': None,
+                'status': 'running', 'jobs': []}
+    print(f"[INFO] campaign <{name}>: {len(plan)} jobs in <{campaign_dir}>")
+
+    # the serial link and the motor torques are kept between the jobs:
+    R.keep_open, R.keep_torque = True, True
+    work_dist = None
+    for i, step in enumerate(plan):
+        job = {**step['job'], 'DATA_DIR': campaign_dir}
+        if job['MODE'] != 'Free' and work_dist is not None and job['WORK_DIST'] != work_dist:
+            input(f"[INFO] set the working distance to {job['WORK_DIST']} mm, then press ENTER...")
+        work_dist = job.get('WORK_DIST', work_dist)
+
+        remaining = sum(s['predicted_s'] for s in plan_campaign([s['job'] for s in plan[i:]], model))
+        print(f"[INFO] job {i+1}/{len(plan)} (#{step['rank']} of the campaign file) {job['MODE']}: "
+              f"predicted {format_duration(step['predicted_s'])}, campaign ETA {format_duration(remaining)}")
+
+        record = {'rank': step['rank'], 'params': step['job'], 'predicted_s': step['predicted_s'],
+                  'start': datetime.now().isoformat(timespec='seconds'), 'files': [], 'status': 'running'}
+        manifest['jobs'].append(record)
+        save_manifest(campaign_dir, manifest)
+
+        t0 = time()
+        try:
+            record['files']  = run_job(R, job) or []
+            record['status'] = 'stopped' if R.emergencyStopRequired else 'done'
+        except KeyboardInterrupt:
+            R.EmergencyStop()
+            record['status'] = 'stopped'
+        except Exception as e:
+            print(f"[ERROR] job #{step['rank']} failed: {type(e).__name__}: {e}")
+            R.Stop_ROTOR_Bench()
+            record.update(status='failed', error=f"{type(e).__name__}: {e}")
+        record['actual_s'] = round((time() - t0) * R.time_scale, 1)
+        record['files']    = [os.path.basename(f) for f in record['files']]
+        print(f"[INFO] job #{step['rank']} {record['status']} in {format_duration(record['actual_s'])} "
+              f"(predicted {format_duration(step['predicted_s'])})")
+
+        # the timing model uses the measured duration of the sensor reads:
+        if R.read_latency: model.read_s = float(np.median(R.read_latency))
+        save_manifest(campaign_dir, manifest)
+        if record['status'] == 'stopped': break
+
+    manifest['end'] = datetime.now().isoformat(timespec='seconds')
+    manifest['status'] = 'stopped' if R.emergencyStopRequired else 'done'
+    save_manifest(campaign_dir, manifest)
+
+    R.keep_torque = False
+    R.Stop_ROTOR_Bench()
+    return manifest
+
+if __name__ == "__main__":
+    import argparse
+    from strike import Stepper1, Stepper2, run_job
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('campaign', help='the campaign file (JSON)')
+    parser.add_argument('--dry_run', action='store_true', help='only validate and display the plan')
+    parser.add_argument('--backend', choices=('rpi', 'sim'), default='rpi')
+    parser.add_argument('--time_scale', type=float, default=1, help='> 1 to run faster than real time (sim)')
+    args = parser.parse_args()
+
+    name, jobs = load_campaign(args.campaign)
+
+    # validate the whole campaign before moving anything:
+    nb_error = 0
+    for rank, job in enumerate(jobs):
+        for error in validate_job(job, Stepper1):
+            print(f"[ERROR] job #{rank}: {error}")
+            nb_error += 1
+    if nb_error: sys.exit(f"[ERROR] {nb_error} error(s) in the campaign <{args.campaign}>, tchao!")
+
+    model = TimingModel(Stepper1, Stepper2)
+    plan  = plan_campaign(jobs, model)
+    nb_wdist = len({job['WORK_DIST'] for job in jobs if 'WORK_DIST' in job})
+    print(f"[INFO] campaign <{name}>: {len(plan)} jobs, {nb_wdist} working distance(s), "
+          f"predicted duration {format_duration(sum(s['predicted_s'] for s in plan))}")
+    for i, step in enumerate(plan):
+        job = step['job']
+        print(f"[INFO] {i+1:3d}: #{step['rank']:<3d} {job['MODE']:10s} WDIST {job.get('WORK_DIST', '-')!s:>3s} "
+              f"ROTSTEP {job.get('ROT_STEP_DEG', '-')!s:>5s} Z {job.get('Z_POS_MM', '-')} "
+              f"x{job['NB_REPET']}: {format_duration(step['predicted_s'])}")
+    if args.dry_run: sys.exit()
+
+    from ROTOR_bench import ROTOR_bench
+    R = ROTOR_bench(Stepper1, Stepper2, backend=args.backend, time_scale=args.time_scale)
+    manifest = run_campaign(R, run_job, name, jobs, model)
+    R.close_Serial()
+    print(f"[INFO] campaign <{name}> {manifest['status']}")
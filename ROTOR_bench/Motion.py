@@ -0,0 +1,236 @@
+#
+# Copyright 2024-2025 Jean-Luc.CHARLES@mailo.com
+#
+
+import numpy as np
+from time import sleep, monotonic
+from collections import Counter
+from itertools import repeat
+import heapq
+
+def trapezoid_periods(nb_step:int, v_start:float, v_max:float, accel:float):
+    '''
+    Computes the periods [s] of the 'nb_step' steps of a move with a trapezoidal velocity
+    profile: acceleration from 'v_start' to 'v_max' [step/s] with 'accel' [step/s²], cruise
+    at 'v_max', then deceleration down to 'v_start' at the end of the move.
+    For short moves 'v_max' is not reached (triangular profile).
+    Returns the array of the nb_step periods.
+    '''
+    # the velocity at the middle of each step, limited by the acceleration from the start
+    # of the move and by the deceleration to its end:
+    x = np.arange(nb_step) + 0.5
+    v_acc = np.sqrt(v_start**2 + 2*accel*x)
+    v_dec = np.sqrt(v_start**2 + 2*accel*(nb_step - x))
+    v = np.minimum(np.minimum(v_acc, v_dec), v_max)
+    return 1. / v
+
+def motion_profile(stepper, nb_step:int, revol_per_sec:float = None):
+    '''
+    Returns the periods [s] of the 'nb_step' steps of a move of the stepper motor 'stepper':
+    the move starts and ends at 'revol_per_sec' (default: stepper.NB_REVOL_PER_SEC), and
+    accelerates up to stepper.MAX_REVOL_PER_SEC with stepper.ACCEL_REVOL_PER_SEC2.
+    Without these 2 fields the move is done at the constant velocity 'revol_per_sec'.
+    '''
+    if revol_per_sec is None: revol_per_sec = stepper.NB_REVOL_PER_SEC
+    v_start = revol_per_sec * stepper.NB_STEP_PER_REVOL
+
+    if stepper.MAX_REVOL_PER_SEC is None or stepper.ACCEL_REVOL_PER_SEC2 is None or \
+       stepper.MAX_REVOL_PER_SEC <= revol_per_sec:
+        return repeat(1. / v_start, nb_step)
+
+    v_max = stepper.MAX_REVOL_PER_SEC * stepper.NB_STEP_PER_REVOL
+    accel = stepper.ACCEL_REVOL_PER_SEC2 * stepper.NB_STEP_PER_REVOL
+    return trapezoid_periods(nb_step, v_start, v_max, accel)
+
+def plan_carriage(Zpos_mm:list, offsets:list, Z_min:float = 0):
+    '''
+    To plan the positions of the carriage of the probes, for the Z positions 'Zpos_mm' [mm] to be
+    measured by the probes located at the Z offsets 'offsets' [mm] below the first probe.
+    Greedy plan in the order of Zpos_mm: the first Z position not yet measured is taken by the probe
+    that also brings the other probes to the largest number of Z positions not yet measured.
+    Returns the list of (carriage position [mm], [(probe index, rank in Zpos_mm), ...]).
+    With one probe the carriage positions are Zpos_mm.
+    '''
+    todo = list(range(len(Zpos_mm)))
+    plan = []
+    while todo:
+        best = None
+        for o in offsets:
+            carriage = Zpos_mm[todo[0]] - o
+            if carriage < Z_min: continue
+            hits = []
+            for k, o_k in enumerate(offsets):
+                for n in todo:
+                    if abs(carriage + o_k - Zpos_mm[n]) < 1e-6:
+                        hits.append((k, n))
+                        break
+            if best is None or len(hits) > len(best[1]): best = (carriage, hits)
+        if best is None:
+            raise ValueError(f"Z position {Zpos_mm[todo[0]]} mm out of reach of the probes (offsets {offsets} mm)")
+        plan.append(best)
+        for _, n in best[1]: todo.remove(n)
+    return plan
+
+class PulseScheduler():
+    '''
+    To emit the STEP pulse trains of the stepper motors.
+    The pulses are emitted at absolute deadlines on the monotonic clock (so the timing
+    errors do not accumulate): the scheduler sleeps until the deadline is close, and only
+    spins during the last 'spin_time' seconds.
+    If a pulse is late, the next ones catch up but are never closer than 'min_ratio' times
+    their nominal period, so that the stepper motor cannot miss steps.
+    The errors on the pulse periods are accumulated in a histogram to monitor the jitter.
+    '''
+    def __init__(self, pulse_width:float = 20e-6, spin_time:float = 300e-6,
+                 time_scale:float = 1., bin_us:int = 20, min_ratio:float = 0.7):
+        self.pulse_width = pulse_width  # the duration [s] of the HIGH state of the STEP pulses
+        self.spin_time   = spin_time    # the scheduler spins during the last spin_time [s] before a deadline
+        self.time_scale  = time_scale   # > 1 with the emulated hardware running faster than real time
+        self.bin_us      = bin_us       # the width [µs] of the bins of the jitter histogram
+        self.min_ratio   = min_ratio    # the min ratio between the period of a pulse and its nominal value
+        self.jitter      = Counter()    # the jitter histogram: {bin: count}
+        self.nb_pulse    = 0            # the total number of pulses emitted
+        self.step_count  = 0            # the number of pulses of the current (or last) pulse train
+        self.abort       = False        # set to True to stop the pulse trains (emergency stop)
+
+    def wait_until(self, deadline:float):
+        '''
+        To wait until the monotonic clock reaches 'deadline'.
+        '''
+        remaining = deadline - monotonic()
+        if remaining > self.spin_time:
+            sleep(remaining - self.spin_time)
+        while monotonic() < deadline:
+            pass
+
+    def run(self, step_line, periods, stop=None, pulse_width:float = None):
+        '''
+        To emit a pulse train on 'step_line'.
+        Parameters:
+        - periods: iterable of the periods [s] of the pulses, one value for each step,
+        - stop: a function called after each pulse, the pulse train is stopped when it returns True,
+        - pulse_width: the duration [s] of the HIGH state of the pulses (default: self.pulse_width).
+        Returns the number of pulses emitted.
+        '''
+        if pulse_width is None: pulse_width = self.pulse_width
+        pulse_width /= self.time_scale
+
+        self.step_count = 0
+        t_next = monotonic()
+        t_prev, T_prev = None, None
+        for T in periods:
+            self.wait_until(t_next)
+            t = monotonic()
+            step_line.set_value(1)
+            self.wait_until(t + pulse_width)
+            step_line.set_value(0)
+            self.step_count += 1
+
+            if t_prev is not None:
+                self.record_jitter(t - t_prev, T_prev)
+            t_prev, T_prev = t, T / self.time_scale
+
+            # the deadline of the next pulse:
+            t_next = max(t_next + T / self.time_scale, t + self.min_ratio * T / self.time_scale)
+            if self.abort or (stop is not None and stop()): break
+
+        # wait for the end of the period of the last pulse:
+        if self.step_count: self.wait_until(t_next)
+
+        self.nb_pulse += self.step_count
+        return self.step_count
+
+    def run_bulk(self, step_lines, list_periods, pulse_width:float = None, merge_time:float = 50e-6):
+        '''
+        To emit simultaneous pulse trains on the lines of the gpiod bulk request 'step_lines'
+        (one pulse train for each line, with its own timing).
+        Parameters:
+        - list_periods: a list of iterables, one for each line, of the periods [s] of the pulses,
+        - pulse_width: the duration [s] of the HIGH state of the pulses (default: self.pulse_width),
+        - merge_time: the pulses of the different lines whose deadlines are closer than merge_time [s]
+          are emitted together with one set_values() call.
+        Returns the list of the numbers of pulses emitted on each line.
+        '''
+        if pulse_width is None: pulse_width = self.pulse_width
+        pulse_width /= self.time_scale
+        merge_time  /= self.time_scale
+
+        nb_line = len(list_periods)
+        periods = [iter(p) for p in list_periods]
+        counts  = [0] * nb_line
+        t_prev  = [None] * nb_line      # the time of the previous pulse of each line
+        T_prev  = [None] * nb_line      # the nominal period of the previous pulse of each line
+        t_end   = monotonic()           # the end of the period of the last pulse
+
+        # the queue of the (deadline, line index, period) of the next pulse of each line:
+        t0 = monotonic()
+        queue = []
+        for i, p in enumerate(periods):
+            T = next(p, None)
+            if T is not None: queue.append((t0, i, T / self.time_scale))
+        heapq.heapify(queue)
+
+        while queue and not self.abort:
+            # the pulses to emit together:
+            deadline = queue[0][0]
+            pulses = []
+            while queue and queue[0][0] <= deadline + merge_time:
+                pulses.append(heapq.heappop(queue))
+
+            self.wait_until(deadline)
+            t = monotonic()
+            values = [0] * nb_line
+            for _, i, _ in pulses: values[i] = 1
+            step_lines.set_values(values)
+            self.wait_until(t + pulse_width)
+            step_lines.set_values([0] * nb_line)
+
+            for t_deadline, i, T in pulses:
+                counts[i] += 1
+                if t_prev[i] is not None:
+                    self.record_jitter(t - t_prev[i], T_prev[i])
+                t_prev[i], T_prev[i] = t, T
+                t_next = max(t_deadline + T, t + self.min_ratio * T)
+                t_end  = max(t_end, t_next)
+                T_next = next(periods[i], None)
+                if T_next is not None:
+                    heapq.heappush(queue, (t_next, i, T_next / self.time_scale))
+
+        # wait for the end of the period of the last pulse:
+        self.wait_until(t_end)
+
+        self.step_count = sum(counts)
+        self.nb_pulse  += self.step_count
+        return counts
+
+    def record_jitter(self, period:float, nominal:float):
+        '''
+        To add the error [µs] between the measured and the nominal periods to the histogram.
+        '''
+        self.jitter[round((period - nominal)*1e6 / self.bin_us)] += 1
+
+    def jitter_histogram(self):
+        '''
+        Returns the jitter histogram as a list of (period error [µs], count), sorted by period error.
+        '''
+        return [(b*self.bin_us, count) for b, count in sorted(self.jitter.items())]
+
+    def print_jitter(self, nb_bin:int = 10, width:int = 50):
+        '''
+        To display the jitter histogram of the pulse periods, the bins beyond
+        +/- nb_bin are merged in the first and last lines.
+        '''
+        if not self.jitter: return
+        histo = Counter()
+        for b, count in self.jitter.items():
+            histo[min(max(b, -nb_bin), nb_bin)] += count
+        nb = sum(histo.values())
+        count_max = max(histo.values())
+        print(f"[INFO] {self.nb_pulse} STEP pulses, jitter of the pulse periods ({nb} periods):")
+        for b in range(-nb_bin, nb_bin+1):
+            if b not in histo: continue
+            label = f"{b*self.bin_us:+7d} µs"
+            if b == -nb_bin: label = "<=" + label
+            elif b == nb_bin: label = ">=" + label
+            bar = '#' * max(1, round(width * histo[b] / count_max))
+            print(f"[INFO] {label:>11s}: {histo[b]:8d} {bar}")
@@ -0,0 +1,202 @@
+#
+# Copyright 2024-2025 Jean-Luc.CHARLES@mailo.com
+#
+import json, os, sys
+import numpy as np
+
+from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QLabel, QComboBox
+from PyQt5.QtNetwork import QUdpSocket, QHostAddress
+from PyQt5.QtCore import QTimer
+from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as NavigationToolbar
+from matplotlib.figure import Figure
+
+from magnetic_canvas import MagneticPlotCanvas
+
+# The local UDP port where ROTOR_bench publishes the measurements: Param['LIVE_PORT'] of the
+# ROTOR_config.py file of the bench (the parent directory):
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ROTOR_config import Param
+LIVE_PORT = Param['LIVE_PORT']
+
+class LiveTab(QWidget):
+    '''
+    Tab for displaying the measurements of the ROTOR bench while the run is in progress:
+    the field versus angle at each Z position, and the colormap of one component versus
+    angle & Zpos, updated as the data arrive.
+    '''
+
+    # Declare attributes for memory optimization
+    __slots__ = ('main', 'socket', 'timer', 'run', 'data', 'dirty', 'lines', 'mesh', 'grid',
+                 'btn_listen', 'combo_comp', 'label_info', 'fig', 'canvas', 'toolbar')
+
+    def __init__(self, main_window):
+        '''
+        Initialize the LiveTab with a button to listen to the bench, the choice of the
+        colormap component, and a matplotlib canvas.
+        '''
+        super().__init__()
+
+        self.main   = main_window
+        self.socket = None          # the QUdpSocket receiving the measurements
+        self.timer  = QTimer(self)  # to redraw the plots at most every 500 ms
+        self.run    = None          # the 'start' message of the current data file
+        self.data   = {}            # {Zpos rank: [[angle, X, Y, Z], ...]} of the current data file
+        self.dirty  = False         # True when data arrived since the last redraw
+        self.lines  = {}            # {(Zpos rank, component): Line2D} of the field vs angle plots
+        self.mesh   = None          # the QuadMesh of the colormap
+        self.grid   = None          # the colormap values (nb_Zpos, nb_angle)
+
+        VBox = QVBoxLayout()
+        self.setLayout(VBox)
+
+        H = QHBoxLayout()
+        btn = QPushButton('Listen to the bench')
+        btn.setMinimumHeight(40)
+        btn.setMinimumWidth(120)
+        btn.setCheckable(True)
+        btn.toggled.connect(self.listen)
+        H.addWidget(btn)
+        self.btn_listen = btn
+
+        H.addWidget(QLabel('Colormap:'))
+        combo = QComboBox()
+        combo.addItems(['Radial (X)', 'Axial (Y)', 'tang. (Z)'])
+        combo.setCurrentIndex(2)
+        combo.currentIndexChanged.connect(self.new_plot)
+        H.addWidget(combo)
+        self.combo_comp = combo
+
+        self.label_info = QLabel('Not listening')
+        H.addWidget(self.label_info)
+        H.addStretch()
+        VBox.addLayout(H)
+
+        self.fig     = Figure(figsize=(5, 4), dpi=100)
+        self.canvas  = FigureCanvas(self.fig)
+        self.toolbar = NavigationToolbar(self.canvas, self)
+        VBox.addWidget(self.canvas)
+        VBox.addWidget(self.toolbar)
+
+        self.timer.timeout.connect(self.redraw)
+
+    def listen(self, state):
+        '''
+        To start/stop listening to the measurements published by the bench.
+        '''
+        if state:
+            if not LIVE_PORT:
+                self.label_info.setText("The publication of the measurements is disabled (Param['LIVE_PORT'])")
+                self.btn_listen.setChecked(False)
+                return
+            self.socket = QUdpSocket(self)
+            if not self.socket.bind(QHostAddress.LocalHost, LIVE_PORT):
+                self.label_info.setText(f'Cannot listen on UDP port {LIVE_PORT}')
+                self.btn_listen.setChecked(False)
+                return
+            self.socket.readyRead.connect(self.read_datagrams)
+            self.timer.start(500)
+            self.label_info.setText(f'Waiting for a run on UDP port {LIVE_PORT}...')
+        else:
+            self.timer.stop()
+            if self.socket is not None:
+                self.socket.close()
+                self.socket = None
+            self.label_info.setText('Not listening')
+
+    def read_datagrams(self):
+        '''
+        To read the pending datagrams: a 'start' message begins a new plot, the 'data' messages
+        add points to the current plot.
+        '''
+        while self.socket is not None and self.socket.hasPendingDatagrams():
+            datagram = self.socket.receiveDatagram()
+            try:
+                message = json.loads(bytes(datagram.data()))
+            except ValueError:
+                continue
+            if message['type'] == 'start':
+                self.run  = message
+                self.data = {}
+                self.new_plot()
+            elif message['type'] == 'data' and self.run is not None and message['file'] == self.run['file']:
+                for n, angle, X, Y, Z in message['points']:
+                    self.data.setdefault(n, []).append((angle, X, Y, Z))
+                self.dirty = True
+
+    def new_plot(self):
+        '''
+        To create the axes for the current data file.
+        '''
+        self.fig.clear()
+        self.lines, self.mesh, self.grid = {}, None, None
+        if self.run is None:
+            self.canvas.draw()
+            return
+
+        Zpos_mm = self.run['Z_POS_MM'] or [0]
+        free    = self.run['MODE'] == 'FreeRun'
+        self.fig.suptitle(f"Live: {self.run['MODE']} <{self.run['file']}>", fontsize=12)
+        self.fig.subplots_adjust(hspace=0.4)
+
+        # the field versus angle (time for the FreeRun), one color per component, one line per Zpos:
+        ax = self.fig.add_subplot(1 if free else 2, 1, 1)
+        colors = MagneticPlotCanvas.colors_B
+        alphas = np.linspace(1, 0.3, len(Zpos_mm))
+        for n, alpha in enumerate(alphas):
+            for comp, label in zip('XYZ', ('radial', 'axial', 'tang.')):
+                label = label if n == 0 else None
+                self.lines[(n, comp)], = ax.plot([], [], marker='o', markersize=1, color=colors[comp],
+                                                 alpha=alpha, label=label)
+        ax.set_xlabel("Time [s]" if free else "Rotor angle [°]")
+        ax.set_ylabel("Magnetic field [mT]")
+        ax.legend(loc='upper right', fontsize=8)
+
+        # the colormap of one component versus angle & Zpos:
+        if not free and self.run['ROT_STEP_DEG']:
+            ax = self.fig.add_subplot(2, 1, 2)
+            nb_angle = int(round(360 / self.run['ROT_STEP_DEG']))
+            angles = self.run['ROT_STEP_DEG'] * np.arange(nb_angle)
+            self.grid = np.full((len(Zpos_mm), nb_angle), np.nan)
+            self.mesh = ax.pcolormesh(angles, np.array(Zpos_mm, dtype=float), np.ma.masked_invalid(self.grid),
+                                      cmap='seismic', shading='nearest')
+            ax.set_yticks(Zpos_mm, [str(z) for z in Zpos_mm])
+            ax.invert_yaxis()
+            ax.set_xlabel("Rotor angle [°]")
+            ax.set_ylabel("Z pos. from top [mm]")
+            ax.set_title(f"Magnetic field - {self.combo_comp.currentText()}", loc='left', fontsize=9)
+            self.fig.colorbar(self.mesh, ax=ax)
+
+        self.dirty = True
+        self.redraw()
+
+    def redraw(self):
+        '''
+        To update the plots with the data arrived since the last redraw.
+        '''
+        if not self.dirty or self.run is None: return
+        self.dirty = False
+
+        comp = self.combo_comp.currentIndex()
+        nb_point = 0
+        for n, points in self.data.items():
+            points = np.array(points)
+            nb_point += len(points)
+            for k, c in enumerate('XYZ'):
+                if (n, c) in self.lines: self.lines[(n, c)].set_data(points[:, 0], points[:, k+1])
+            if self.grid is not None and n < len(self.grid):
+                k = np.rint(points[:, 0] / self.run['ROT_STEP_DEG']).astype(int) % self.grid.shape[1]
+                self.grid[n, k] = points[:, comp+1]
+
+        ax = self.fig.axes[0]
+        ax.relim()
+        ax.autoscale_view()
+        if self.mesh is not None and not np.all(np.isnan(self.grid)):
+            self.mesh.set_array(np.ma.masked_invalid(self.grid))
+            vmax = np.nanmax(np.abs(self.grid))
+            self.mesh.set_clim(-vmax, vmax)
+
+        if nb_point:
+            B = np.concatenate([np.array(p)[:, 1:] for p in self.data.values()])
+            self.label_info.setText(f"{nb_point} points, B in [{B.min():.2f}, {B.max():.2f}] mT")
+        self.canvas.draw_idle()
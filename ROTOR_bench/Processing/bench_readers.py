@@ -0,0 +1,178 @@
+#
+# Copyright 2024-2025 Jean-Luc.CHARLES@mailo.com
+#
+
+#
+# Benchmark of the readers of the data files of tools.py (header split off once, numeric block
+# parsed in bulk) against the former line by line readers (readlines, float() for each token),
+# on synthetic files of 10^3 to 10^7 rows written like the ROTOR_bench data files.
+# For each size and each kind of file, the data of the 2 readers are checked to be equal.
+# The new readers are timed without their cache (see data_cache.py), the last column gives the
+# duration of a read from the memory cache.
+#
+# Usage:  python bench_readers.py --max_rows 1e6
+#         (10^7 rows: about 500 MB for each file and several GB of memory for the former readers)
+#
+
+import os, tempfile
+import numpy as np
+from pathlib import Path
+from time import perf_counter
+
+from tools import read_file_ROTOR, read_file_FREE, read_file_SIMUL_ROTOR, read_file_ROTOR_L
+from data_cache import cache
+
+
+def old_read_file_ROTOR(file_path):
+    '''The former line by line reader of the ROTOR files (DATA only).'''
+    with open(file_path, 'r', encoding='utf8') as F:
+        lines = F.readlines()
+    DATA = []
+    for line in lines:
+        if line[0] == "#" or line == '\n':
+            continue
+        data = [float(x) for x in line.strip().split(';')]
+        DATA.append(data)
+    DATA = np.array(DATA)
+    if DATA.ndim == 2 and DATA.shape[1] == 9:
+        DATA = DATA[:, :5]
+    return DATA
+
+def old_read_file_FREE(file_path):
+    '''The former line by line reader of the FREE files.'''
+    with open(file_path, 'r', encoding='utf8') as F:
+        lines = F.readlines()
+    DATA = []
+    for line in lines:
+        if line == '\n' or line[0] == "#":
+            continue
+        data = [float(x) for x in line.strip().split(';')]
+        DATA.append(data)
+    return np.array(DATA)
+
+def old_read_file_SIMUL_ROTOR(file_path):
+    '''The former line by line reader of the simulation files (DATA only).'''
+    with open(file_path, 'r', encoding='utf8') as F:
+        lines = F.readlines()
+    DATA = []
+    for line in lines:
+        if line[0] == "#":
+            continue
+        data = [float(x) for x in line.strip().split()]
+        DATA.append(data)
+    return np.array(DATA)
+
+def old_read_file_ROTOR_L(file_path):
+    '''The former line by line reader of the Lille CSV files.'''
+    for code in ('utf8', 'cp1252'):
+        try:
+            with open(file_path, 'r', encoding=code) as F:
+                lines = F.readlines()
+            break
+        except:
+            pass
+    DATA = []
+    for line in lines:
+        if line[0] == "#":
+            continue
+        line = line.replace(',','.')
+        try:
+            r, phi, z, Bradial, Btang, Baxial = map(float, line.split(';'))
+            DATA. append([r, phi, z, Bradial, Btang, Baxial])
+        except:
+            continue
+    return np.array(DATA)
+
+
+HEADER = """# *CALIBRATION************
+# Sensor ID:   USB25103-BENCH
+# ************************
+#
+# SENSOR_NB_SAMPLE: 10
+# SENSOR_GAIN: 1
+# working dist: 1 mm
+# Rotation step angle: 1.2°
+# sensor pos #1: 0 mm
+# ByAngle
+# ZPos#; a[°]; X1_magn[mT]; Y1_magn[mT]; Z1_magn[mT]
+"""
+
+def write_files(directory, nb_row:int, rng):
+    '''
+    To write the 4 kinds of synthetic data files of 'nb_row' rows in 'directory'.
+    Returns {kind: (file path, new reader, former reader)}.
+    '''
+    X, Y, Z = rng.normal(0, 50, (3, nb_row))
+    angle = np.arange(nb_row) % 300 * 1.2
+    files = {}
+
+    path = Path(directory, f'ROTOR_2025-01-01-00-00_WDIST-01_ROTSTEP-001.2_000_1of1-a.txt')
+    with open(path, 'w', encoding='utf8') as f:
+        f.write(HEADER)
+        f.writelines(f"{1 + n // 300:2d}; {a:5.1f}; {x:11.6f}; {y:11.6f}; {z:11.6f}\n"
+                     for n, (a, x, y, z) in enumerate(zip(angle, X, Y, Z)))
+    files['ROTOR'] = (path, lambda p: read_file_ROTOR(p)[0], old_read_file_ROTOR)
+
+    path = Path(directory, 'FREE_2025-01-01-00-00_1of1.txt')
+    with open(path, 'w', encoding='utf8') as f:
+        f.write(HEADER.split('# SENSOR_GAIN')[0] + '\n# Time[s]; Xmagn [mT]; Ymagn [mT]; Zmagn [mT];\n')
+        f.writelines(f"{0.3*n:8.2f}; {x:11.6f}; {y:11.6f}; {z:11.6f}\n" for n, (x, y, z) in enumerate(zip(X, Y, Z)))
+    files['FREE'] = (path, read_file_FREE, old_read_file_FREE)
+
+    path = Path(directory, 'Bsimul_r-71_d-1.txt')
+    with open(path, 'w', encoding='utf8') as f:
+        f.write('# angle Bx By Bz\n')
+        f.writelines(f"{a:.1f} {x:.8e} {y:.8e} {z:.8e}\n" for a, x, y, z in zip(angle, X, Y, Z))
+    files['SIMUL'] = (path, lambda p: read_file_SIMUL_ROTOR(p)[0], old_read_file_SIMUL_ROTOR)
+
+    path = Path(directory, 'ROTOR_L.csv')
+    with open(path, 'w', encoding='cp1252') as f:
+        f.write('# Lille rotor bench\n')
+        f.writelines(f"71;{a:.1f};0;{x*1e-3:.9f};{y*1e-3:.9f};{z*1e-3:.9f}\n".replace('.', ',')
+                     for a, x, y, z in zip(angle, X, Y, Z))
+    files['ROTOR_L'] = (path, read_file_ROTOR_L, old_read_file_ROTOR_L)
+    return files
+
+def timing(reader, path, nb_run:int, cached:bool=False):
+    '''
+    Returns the best duration [s] of 'nb_run' reads of the file 'path', and the data read
+    (with 'cached' the file is read from the memory cache).
+    '''
+    best = None
+    for _ in range(nb_run):
+        if not cached: cache.clear()
+        t0 = perf_counter()
+        DATA = reader(path)
+        t = perf_counter() - t0
+        best = t if best is None else min(best, t)
+    return best, DATA
+
+
+if __name__ == "__main__":
+
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmark of the readers of the data files")
+    parser.add_argument('--max_rows', type=float, default=1e6, help='the max number of rows of the files (1e3 to 1e7)')
+    parser.add_argument('--kinds', nargs='+', default=['ROTOR', 'FREE', 'SIMUL', 'ROTOR_L'], help='the kinds of files')
+    args = parser.parse_args()
+
+    cache.use_disk = False
+    rng = np.random.default_rng(1234)
+    print(f"[INFO] {'kind':>8s} {'rows':>9s} {'MB':>7s} {'former [s]':>11s} {'new [s]':>9s} {'speedup':>8s} equal "
+          f"{'cached [µs]':>11s}")
+    nb_row = 1000
+    while nb_row <= args.max_rows:
+        with tempfile.TemporaryDirectory() as directory:
+            files = write_files(directory, nb_row, rng)
+            nb_run = 3 if nb_row <= 100000 else 1
+            for kind in args.kinds:
+                path, new_reader, old_reader = files[kind]
+                t_old, DATA_old = timing(old_reader, path, nb_run)
+                t_new, DATA_new = timing(new_reader, path, nb_run)
+                t_cached, _ = timing(new_reader, path, 10, cached=True)
+                equal = np.array_equal(DATA_old, DATA_new)
+                print(f"[INFO] {kind:>8s} {nb_row:9d} {os.path.getsize(path)/1e6:7.1f} {t_old:11.4f} "
+                      f"{t_new:9.4f} {t_old/t_new:7.1f}x {str(equal):5s} {t_cached*1e6:11.1f}")
+                if not equal: print(f"[ERROR] {kind}: the data of the 2 readers are different")
+                del DATA_old, DATA_new
+        nb_row *= 10
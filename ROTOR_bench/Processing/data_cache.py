@@ -0,0 +1,179 @@
+#
+# Copyright 2024-2025 Jean-Luc.CHARLES@mailo.com
+#
+
+#
+# The cache of the data files read by the tools.read_file_* functions, so that a file selected
+# again in the FilesTab is not read and parsed again:
+#  - on the disk: an uncompressed '.npz' file in the '.cache' directory next to the data file,
+#    with the arrays of the file (parsed and reshaped) and its metadata (the parsed header, and
+#    the size, mtime and hash of the data file when the cache file was written),
+#    The large arrays (MEMMAP: the magnetic field in the canonical layout (nb_Zpos, nb_angle, 3)
+#    and its angles) have their own '.npy' file, memory mapped when loaded (np.load(mmap_mode='r')):
+#    only the parts of the arrays used are read from the disk,
+#  - in memory: the last MAX_ENTRIES files read, in a LRU dictionary in front of the disk cache.
+# A cache entry is valid if the size and the mtime of the data file are unchanged; when only the
+# mtime is changed (file copied or touched), the hash of the content of the file decides.
+# The arrays given by the cache are read-only: they are shared by all the users of the file.
+# When the '.cache' directory cannot be written (read-only data directory) only the memory cache
+# is used.
+#
+
+import os, json, hashlib
+import numpy as np
+from pathlib import Path
+from collections import OrderedDict
+
+CACHE_DIR   = '.cache'      # the name of the cache directory, next to the data files
+MAX_ENTRIES = 16            # the max number of files in the memory cache
+VERSION     = 2             # the version of the cache files (the files of another version are ignored)
+MEMMAP      = ('angle', 'magn_field')   # the arrays saved in '.npy' files, memory mapped when loaded
+
+def file_hash(file_path):
+    '''
+    Returns the hash (blake2b, hex) of the content of the file 'file_path'.
+    '''
+    h = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as F:
+        while chunk := F.read(1 << 20):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class DataCache():
+    '''
+    The cache of the arrays and metadata of the data files, see the module comment.
+    '''
+    def __init__(self, max_entries:int = MAX_ENTRIES, use_disk:bool = True, memmap:tuple = MEMMAP):
+        self.max_entries = max_entries
+        self.use_disk    = use_disk
+        self.memmap      = memmap
+        self.memory      = OrderedDict()    # {(path, key): (size, mtime_ns, arrays, meta)}
+        self.stats       = {'memory': 0, 'disk': 0, 'read': 0}
+
+    @staticmethod
+    def cache_path(file_path:Path, key:str):
+        '''
+        Returns the path of the cache file of the data file 'file_path' for the reader 'key'.
+        '''
+        return file_path.parent / CACHE_DIR / f'{file_path.name}.{key}.npz'
+
+    @staticmethod
+    def npy_path(path:Path, name:str):
+        '''
+        Returns the path of the '.npy' file of the array 'name' of the cache file 'path'.
+        '''
+        return path.with_suffix(f'.{name}.npy')
+
+    def get(self, file_path, key:str, read):
+        '''
+        Returns the (arrays, meta) of the data file 'file_path' for the reader 'key': from the
+        memory cache, from the disk cache or, when the file is not in the cache (or has changed),
+        from read(file_path) which returns the dict of the arrays and the dict of the metadata
+        (JSON serializable) of the file.
+        '''
+        name = os.path.abspath(file_path)
+        st = os.stat(name)
+        size, mtime_ns = st.st_size, st.st_mtime_ns
+
+        entry = self.memory.get((name, key))
+        if entry is not None and entry[:2] == (size, mtime_ns):
+            self.memory.move_to_end((name, key))
+            self.stats['memory'] += 1
+            return entry[2], entry[3]
+
+        file_path = Path(name)
+
+        arrays = meta = None
+        if self.use_disk:
+            arrays, meta = self.load(file_path, key, size, mtime_ns)
+        if arrays is not None:
+            self.stats['disk'] += 1
+        else:
+            arrays, meta = read(file_path)
+            self.stats['read'] += 1
+            if self.use_disk and self.save(file_path, key, arrays, meta, size, mtime_ns):
+                # the large arrays are given memory mapped, rather than kept in memory:
+                path = self.cache_path(file_path, key)
+                for k in arrays.keys() & set(self.memmap):
+                    arrays[k] = np.load(self.npy_path(path, k), mmap_mode='r')
+
+        for a in arrays.values(): a.flags.writeable = False
+        self.memory[(name, key)] = (size, mtime_ns, arrays, meta)
+        self.memory.move_to_end((name, key))
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+        return arrays, meta
+
+    def load(self, file_path:Path, key:str, size:int, mtime_ns:int):
+        '''
+        To load the cache file of the data file 'file_path' of size 'size' and mtime 'mtime_ns'.
+        Returns (arrays, meta), or (None, None) when there is no valid cache file.
+        '''
+        path = self.cache_path(file_path, key)
+        if not path.exists(): return None, None
+        try:
+            with np.load(path, allow_pickle=False) as npz:
+                info = json.loads(str(npz['__cache__']))
+                if info['version'] != VERSION or info['size'] != size: return None, None
+                arrays = {name: npz[name] for name in npz.files if name != '__cache__'}
+            for name in info['memmap']:
+                arrays[name] = np.load(self.npy_path(path, name), mmap_mode='r')
+        except Exception as err:
+            print(f"[WARNING] cache file <{path}> ignored: {err}")
+            return None, None
+
+        if info['mtime_ns'] != mtime_ns:
+            # the file has been copied or touched: same content?
+            if info['hash'] != file_hash(file_path): return None, None
+            info['mtime_ns'] = mtime_ns
+            self.write(path, {name: a for name, a in arrays.items() if name not in info['memmap']}, info)
+        return arrays, info['meta']
+
+    def save(self, file_path:Path, key:str, arrays:dict, meta:dict, size:int, mtime_ns:int):
+        '''
+        To write the cache files of the data file 'file_path'.
+        Returns True if the cache files are written.
+        '''
+        path = self.cache_path(file_path, key)
+        mapped = [name for name in arrays if name in self.memmap]
+        info = {'version': VERSION, 'size': size, 'mtime_ns': mtime_ns,
+                'hash': file_hash(file_path), 'memmap': mapped, 'meta': meta}
+        try:
+            path.parent.mkdir(exist_ok=True)
+            for name in mapped:
+                tmp = self.npy_path(path, 'tmp')
+                np.save(tmp, np.ascontiguousarray(arrays[name]))
+                os.replace(tmp, self.npy_path(path, name))
+        except OSError as err:
+            print(f"[WARNING] cannot write the cache file <{path}>: {err}")
+            return False
+        # the '.npz' file is written last: the '.npy' files are valid when it is valid:
+        return self.write(path, {name: a for name, a in arrays.items() if name not in mapped}, info)
+
+    @staticmethod
+    def write(path:Path, arrays:dict, info:dict):
+        '''
+        To write the arrays 'arrays' and the cache information 'info' in the cache file 'path'
+        (written in a temporary file, then renamed: a cache file is never partially written).
+        Returns True if the file is written.
+        '''
+        try:
+            path.parent.mkdir(exist_ok=True)
+            tmp = path.with_suffix('.tmp.npz')
+            np.savez(tmp, __cache__=np.array(json.dumps(info)), **arrays)
+            os.replace(tmp, path)
+            return True
+        except OSError as err:
+            print(f"[WARNING] cannot write the cache file <{path}>: {err}")
+            return False
+
+    def clear(self):
+        '''
+        To empty the memory cache.
+        '''
+        self.memory.clear()
+
+
+# the cache of the tools.read_file_* functions:
+cache = DataCache()
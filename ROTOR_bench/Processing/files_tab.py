@@ -6,7 +6,7 @@ from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QRa
                              QScrollArea, QGroupBox, QFileDialog, QMessageBox)
 
 from pathlib import Path
-from tools import read_file_ROTOR_L, read_file_SIMUL_ROTOR, read_file_ROTOR
+from tools import read_file_ROTOR_L, read_file_SIMUL_ROTOR, read_file_ROTOR, read_field_ROTOR
 
 class FilesTab(QWidget):
     '''
@@ -232,7 +232,8 @@ class FilesTab(QWidget):
 
             self.main.ROTOR_B_txt_file = filepath
             DATA, list_pos, step_angle = read_file_ROTOR(filepath)
-            DATA = self.main.ROTOR_B_reshape_magnetic_field(DATA, list_pos)   
+            # the magnetic field (nb_Zpos, nb_angles, 3), memory mapped from the cache of the file:
+            angles, magn_field = read_field_ROTOR(filepath)
             
             # set the step angle
             self.main.rotor_bdx_tab.step_angle = step_angle
@@ -244,6 +245,7 @@ class FilesTab(QWidget):
             
             # Let the data be accessible from main window fot the othet tabs
             self.main.ROTOR_B_DATA = DATA        
+            self.main.ROTOR_B_angle, self.main.ROTOR_B_field = angles, magn_field
 
             self.main.rotor_bdx_tab.activate_plotButtons()
             self.main.tabs.setCurrentIndex(1)
@@ -9,6 +9,8 @@ from matplotlib.figure import Figure
 
 from PyQt5.QtWidgets import (QMessageBox)
 
+from tools import field_views
+
 class MagneticPlotCanvas(FigureCanvas):
     '''
     A matplotlib canvas for plotting magnetic field data.
@@ -58,14 +60,13 @@ class MagneticPlotCanvas(FigureCanvas):
         self.fig.clear()
         self.subplots_adjust()
         
-        DATA = self.main.ROTOR_B_DATA
-        angles, magn_field = DATA.T[0], DATA.T[1:]
+        # the magnetic field with shape (nb_Zpos, nb_angles, 3):
+        angles, magn_field = self.main.ROTOR_B_angle, self.main.ROTOR_B_field
 
         file_name  = self.main.ROTOR_B_txt_file.name       
         list_pos   = self.main.rotor_bdx_tab.list_pos
         nb_Zpos    = len(list_pos)
-        nb_comp, _ = magn_field.shape
-        assert(nb_comp // 3 == nb_Zpos)
+        assert(len(magn_field) == nb_Zpos)
         xyz = tuple(self.main.rotor_bdx_tab.XYZ.values())
         fft = self.main.curr_plt_info_B['param'] == 'fft'
 
@@ -84,7 +85,7 @@ class MagneticPlotCanvas(FigureCanvas):
         colors = MagneticPlotCanvas.colors_B
         
         for n, (ax, Zpos) in enumerate(zip(axes, list_pos)):  
-            X, Y, Z = magn_field[3*n:3*n+3]  
+            X, Y, Z = magn_field[n].T
             title = ""
             if fft:
                 X, Y, Z = np.abs(rfft(X)), np.abs(rfft(Y)), np.abs(rfft(Z))
@@ -210,11 +211,9 @@ class MagneticPlotCanvas(FigureCanvas):
         file_name = self.main.ROTOR_B_txt_file.name       
         nb_Zpos    = len(self.main.rotor_bdx_tab.list_pos)
 
-        DATA = self.main.ROTOR_B_DATA
-        angles, magn_field = DATA[:, 0], DATA[:, 1:]
-
-        _, nb_comp = magn_field.shape
-        assert(nb_comp // 3 == nb_Zpos)
+        # the magnetic field with shape (nb_Zpos, nb_angles, 3):
+        angles, magn_field = self.main.ROTOR_B_angle, self.main.ROTOR_B_field
+        assert(len(magn_field) == nb_Zpos)
         
         xyz = tuple(self.main.rotor_bdx_tab.XYZ.values())
 
@@ -240,7 +239,7 @@ class MagneticPlotCanvas(FigureCanvas):
                 num_axe +=1
         
         mag_labels = ["radial (X)", "axial (Y)", "tang. (Z)"]
-        magnXYZ    = [magn_field[:, 0::3], magn_field[:, 1::3], magn_field[:, 2::3]]
+        magnXYZ    = [magn_field[:, :, 0], magn_field[:, :, 1], magn_field[:, :, 2]]
 
         magn_min, magn_max = magn_field.min(), magn_field.max()
 
@@ -254,7 +253,7 @@ class MagneticPlotCanvas(FigureCanvas):
         first_plot = True
         for ax, todo, magn, label in zip(list_axes, xyz, magnXYZ, mag_labels):
             if todo:
-                p = ax.pcolormesh(x, y, magn.T, cmap='seismic', shading='nearest', vmin=magn_min, vmax=magn_max)
+                p = ax.pcolormesh(x, y, magn, cmap='seismic', shading='nearest', vmin=magn_min, vmax=magn_max)
                 ax.set_title(f"Magnetic field - {label}", loc='left', fontsize=9)
                 ax.set_yticks(z_pos_values[::-1], z_pos_labels)
                 if first_plot: 
@@ -322,27 +321,18 @@ class MagneticPlotCanvas(FigureCanvas):
             title['B'] = f'ROTOR_B [Zpos={Zpos_B}mm, shift:={self.main.rotor_bdx_tab.step_angle*shift:.2f}°] '
             files += f'<{file_B_name}> '
                 
-            DATA = self.main.ROTOR_B_DATA
-            DATA = self.main.ROTOR_B_extract_magnetic_field(DATA, list_pos, Zpos_B)
+            # the magnetic field at Zpos_B, shape (nb_angles, 3) (a view, no copy):
+            angles_B, magn_field_B = self.main.ROTOR_B_extract_magnetic_field(
+                self.main.ROTOR_B_angle, self.main.ROTOR_B_field, list_pos, Zpos_B)
+            if magn_field_B is None: return
             
-            # Apply shift angle on ROTOR_B data if required:
-            nb_angle = len(DATA)
-            new_DATA = DATA.copy()
+            # Apply shift angle on ROTOR_B data if required (the field of the angle n+shift is
+            # displayed at the angle n):
+            if shift != 0:
+                magn_field_B = np.roll(magn_field_B, -shift, axis=0)
 
-            if shift > 0:
-                new_DATA[:nb_angle - shift, 1:] = DATA[shift:, 1:]
-                new_DATA[nb_angle - shift:, 1:] = DATA[:shift, 1:]
-                
-            elif shift < 0:
-                shift = -shift
-                new_DATA[shift:, 1:] = DATA[:nb_angle - shift, 1:]
-                new_DATA[:shift, 1:] = DATA[nb_angle - shift:, 1:]
-                
-            DATA = new_DATA
-
-            # transpose DATA to extract the different variables:
-            angles_B, magn_field_B = DATA.T[0], DATA.T[1:]       
-            BX, BY, BZ = magn_field_B
+            # transpose the field to extract the different components:
+            BX, BY, BZ = magn_field_B.T
         
         if ROTOR_L:            
             Zpos_L     = self.main.all_fields_tab.ROTOR_L_sel_Zpos
@@ -394,25 +384,16 @@ class MagneticPlotCanvas(FigureCanvas):
                 mess = '''SIMULATION file must have 3 magnetic components (Br, Bt, Ba)\nPlease choose another file.'''
                 QMessageBox.warning(self, 'Warning', mess)
                 return -1
-            DATA = self.main.ROTOR_B_extract_magnetic_field(DATA, list_dist, dist)
-
-            # Apply shift angle on ROTOR_B data if required:
-            nb_angle = len(DATA)
-            new_DATA = DATA.copy()
+            # the simulated field at dist, shape (nb_angles, 3) (a view, no copy):
+            angles_S, magn_field = self.main.ROTOR_B_extract_magnetic_field(*field_views(DATA), list_dist, dist)
+            if magn_field is None: return
 
-            if shift > 0:
-                new_DATA[:nb_angle - shift, 1:] = DATA[shift:, 1:]
-                new_DATA[nb_angle - shift:, 1:] = DATA[:shift, 1:]
-                
-            elif shift < 0:
-                shift = -shift
-                new_DATA[shift:, 1:] = DATA[:nb_angle - shift, 1:]
-                new_DATA[:shift, 1:] = DATA[nb_angle - shift:, 1:]
-                
-            DATA = new_DATA
+            # Apply shift angle on SIMUL data if required:
+            if shift != 0:
+                magn_field = np.roll(magn_field, -shift, axis=0)
                       
-            # Transpose DATA to extract the different variables:
-            angles_S, magn_field = DATA.T[0], DATA.T[1:]*1e3 # Simulated field is in Tesla
+            # Transpose the field to extract the different components:
+            magn_field = magn_field.T*1e3 # Simulated field is in Tesla
             
             # Number of components of the magnetic field that have been read in the file:
             nb_comp_magn_field = magn_field.shape[0]  # we expect 2 or 3 components: radial (X), possibly axial (Y) and tangential (Z)
@@ -20,6 +20,7 @@ from RotorSimulTab import RotorSimulTab
 from RotorLilleTab import RotorLilleTab
 from RotorSuperposed import RotorSuperposedTab
 from WebBrowserTab import WebBrowserTab
+from LiveTab import LiveTab
 from magnetic_canvas import MagneticPlotCanvas
 
 class MainWindow(QMainWindow):
@@ -30,11 +31,12 @@ class MainWindow(QMainWindow):
     # Declare attributes for memory optimization    
     __slots__ = ('saved_options_file', 'default_XYZ', 'dict_plot_widgets',
                  'ROTOR_B_data_dir', 'ROTOR_B_txt_file', 'ROTOR_B_DATA', 'ROTOR_B_list_pos',
+                 'ROTOR_B_angle', 'ROTOR_B_field',
                  'ROTOR_L_data_dir', 'ROTOR_L_txt_file', 'ROTOR_L_DATA',
                  'SIMUL_data_dir', 'SIMUL_txt_file', 'SIMUL_DATA',
                  'curr_plt_info_B', 'curr_plt_info_L', 'curr_plt_info_S', 'curr_plt_info_B_L_S',
                  'disp_fileName', 'dict_fileName_btn', 'dict_legend_btn', 
-                 'tabs', 'file_tab', 'rotor_bdx_tab', 'rotor_lille_tab', 'simul_tab', 'all_fields_tab')     
+                 'tabs', 'file_tab', 'rotor_bdx_tab', 'rotor_lille_tab', 'simul_tab', 'all_fields_tab', 'live_tab')     
     
     def __init__(self):
         super().__init__()
@@ -47,6 +49,8 @@ class MainWindow(QMainWindow):
         self.ROTOR_B_txt_file      = None      # the selected ROTOR_B file to plot (Path)
         self.ROTOR_B_DATA          = None      # The raw ROTOR_B magnetic field after reading file
         self.ROTOR_B_list_pos      = []        # The list of Z positions found in the ROTOR_B data file  
+        self.ROTOR_B_angle         = None      # The rotor angles of the ROTOR_B magnetic field
+        self.ROTOR_B_field         = None      # The ROTOR_B magnetic field, shape (nb_Zpos, nb_angles, 3), memory mapped
 
         self.ROTOR_L_data_dir      = Path('_') # the directory containing the LILLE ROTOR data files
         self.ROTOR_L_txt_file      = None      # the selected ROTOR_L file to plot
@@ -87,6 +91,8 @@ class MainWindow(QMainWindow):
         self.tabs.addTab(self.simul_tab, "ROTOR Simulation")
         self.all_fields_tab = RotorSuperposedTab(self)
         self.tabs.addTab(self.all_fields_tab, "Superposition of ROTOR fields")
+        self.live_tab = LiveTab(self)
+        self.tabs.addTab(self.live_tab, "Live measurement")
         self.web_tab = WebBrowserTab()
         self.tabs.addTab(self.web_tab, "Web Browser")
         
@@ -344,67 +350,21 @@ class MainWindow(QMainWindow):
             widget.setEnabled(state)
                 
 
-    def ROTOR_B_reshape_magnetic_field(self, DATA, list_pos):
+    def ROTOR_B_extract_magnetic_field(self, angles, magn_field, list_pos, Zpos):
         '''
-        Reshape the DATA of a ROTOR_B file to be a 2D array with shape (nb_angles, 1 + 3*nb_Zpos).
-        DATA is reshaped to be an array with lines formatted like:
-            "# angle[°]; X1_mag [mT]; Y1_mag [mT]; Z1_mag [mT]; X2_mag [mT]; Y2_mag [mT]; Z2_mag [mT];..."
-        instead of:
-            "# ZPos#; a[°]; X1_mag[mT]; Y1_mag[mT]; Z1_mag[mT]"
+        Extract the magnetic field data for a given Z position.
+        magn_field has the shape (nb_Zpos, nb_angles, 3) (see tools.field_tensor and tools.field_views).
+        Returns the angles and the magnetic field at Zpos with shape (nb_angles, 3), as views of
+        angles and magn_field (no copy), or (None, None) if Zpos is not in list_pos.
         '''
-        if DATA.shape[1] == 5:
-            nb_col = 1 + 3 * len(list_pos) #  angle col + (X , Y, Z) * nb_Zpo
-            nb_row = int(len(DATA)/len(list_pos))
-            newDATA = np.ndarray((nb_row, nb_col), dtype=float)
-
-            # copy angle column
-            newDATA[ :, 0] = DATA[ : nb_row, 1]
-            # copy X,Y,Z for all Zpos:
-            nb_val = 3 # the 3 components X, Y and Z
-            for n in range(len(list_pos)):
-                newDATA[:, 1+n*nb_val:1+(n+1)*nb_val] = DATA[n*nb_row:(n+1)*nb_row, 2:]
-            DATA = newDATA
-        
-        return DATA
-
-
-    def ROTOR_B_extract_magnetic_field(self, DATA, list_pos, Zpos):
-        '''
-        Reshape DATA to be a 2D array with shape (nb_angles, 1 + 3*nb_Zpos),
-        and extract the magnetic field data for a given Z position.
-        
-        DATA is already an array with lines formatted like:
-            "# angle[°]; X1_mag [mT]; Y1_mag [mT]; Z1_mag [mT]; X2_mag [mT]; Y2_mag [mT]; Z2_mag [mT];..."
-        '''
-        
-        #i_Zpos = list_pos.index(f'{Zpos:03d}')
-        i_Zpos = -1
-        for item in list_pos:
-            i_Zpos += 1
+        for i_Zpos, item in enumerate(list_pos):
             if int(item) == Zpos:
-                break
-        assert(i_Zpos >= 0)
-        
-        # copy X,Y,Z for all Zpos:
-        nb_val = 3                  # 3 components X, Y and Z
-        new_nb_col = 1 + nb_val     # the angle col + the 3 components X, Y and Z
-        nb_row = DATA.shape[0]
-        newDATA = np.ndarray((nb_row, new_nb_col), dtype=float)
-        # Extract angle column:
-        newDATA[:, 0] = DATA[:nb_row, 0].copy()
-        # Extract X, Y, Z data for position Zpos:
-        try:
-            newDATA[:, 1:1+nb_val] = DATA[:, 1+i_Zpos*nb_val:1+(i_Zpos+1)*nb_val]
-            DATA = newDATA.copy()
-        except Exception as e:
-            print(e)
-            message = f'index of {Zpos:03d} not found in the list of Zpos:\n{list_pos}. Try another value'
-            QMessageBox.warning(self, 'Warning', message)
-                       
-        return DATA
+                return angles, magn_field[i_Zpos]
 
+        message = f'index of {Zpos:03d} not found in the list of Zpos:\n{list_pos}. Try another value'
+        QMessageBox.warning(self, 'Warning', message)
+        return None, None
 
-        
     def save_options_to_json(self):
         '''
         Save the current menu Options choices to saved_options.json.
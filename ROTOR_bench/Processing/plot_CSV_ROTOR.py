@@ -3,9 +3,9 @@
 #
 
 try:
-    from .tools import read_file_ROTOR, read_file_ROTOR_L, plot_ROTOR_CSV_magField_at_positions
+    from .tools import read_file_ROTOR, read_field_ROTOR, read_file_ROTOR_L, plot_ROTOR_CSV_magField_at_positions
 except:
-    from tools import read_file_ROTOR, read_file_ROTOR_L, plot_ROTOR_CSV_magField_at_positions
+    from tools import read_file_ROTOR, read_field_ROTOR, read_file_ROTOR_L, plot_ROTOR_CSV_magField_at_positions
     
 import numpy as np
 import sys, os
@@ -34,39 +34,22 @@ def plot_CSV_ROTOR(CSV_num:int,
     ROTOR_DATA, list_pos, step_angle = read_file_ROTOR(ROT_file)
     CSVbench_DATA = read_file_ROTOR_L(CSV_file)
     
-    if ROTOR_DATA.shape[1] == 5:
-        mode="ByAngle"
-        # re-arrange DATA to be an array with lines formated like:
-        # "# angle[°]; X1_magn [mT]; Y1_magn [mT]; Z1_magn [mT]; X2_magn [mT]; Y2_magn [mT]; Z2_magn [mT];..."
-        # instead of:
-        # "# ZPos#; a[°]; X1_magn[mT]; Y1_magn[mT]; Z1_magn[mT]"
-        nb_col = 1 + 3 #  angle col + (X , Y, Z)
-        nb_row = int(len(ROTOR_DATA)/len(list_pos))
-        newDATA = np.ndarray((nb_row, nb_col), dtype=float)
+    try:
+        index_Zpos = list_pos.index(f'{Zpos:03d}')
+    except:
+        print(f'Zpos: {Zpos} not found in the list of Zpos: {list_pos}. Try anaother value')
+        return 1
 
-        # copy angle column
-        newDATA[ :, 0] = ROTOR_DATA[ : nb_row, 1]
-        # copy X,Y,Z for all Zpos:
-        nb_val = 3 # the 3 components X, Y and Z
-        try:
-            index_Zpos = list_pos.index(f'{Zpos:03d}')
-        except:
-            print(f'Zpos: {Zpos} not found in the list of Zpos: {list_pos}. Try anaother value')
-            return 1
-        
-        for n in range(len(list_pos)):
-            if n != index_Zpos: continue
-            newDATA[ : , 1 : 1 + nb_val] = ROTOR_DATA[n*nb_row : (n+1)*nb_row, 2:]
-        ROTOR_DATA = newDATA
-    else:
-        mode="ByZPos"
+    # the magnetic field with shape (nb_Zpos, nb_angles, 3) (with several probes the lines of
+    # the different Zpos are interleaved in the ByAngle files):
+    angles1, magn_field = read_field_ROTOR(ROT_file)
 
     i_range = np.where(CSVbench_DATA.T[2] == int(Zpos))
     CSVbench_DATA  = CSVbench_DATA[i_range]
 
 
     # transpose DATA to extract the different variables:
-    angles1, magnField1 = ROTOR_DATA.T[0], ROTOR_DATA.T[1:]       
+    magnField1 = magn_field[index_Zpos].T
     angles2, magnField2 = CSVbench_DATA.T[1], CSVbench_DATA.T[3:]
     
     ret = plot_ROTOR_CSV_magField_at_positions(angles1, magnField1, Zpos, ROT_file, 
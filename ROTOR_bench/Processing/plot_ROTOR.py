@@ -3,10 +3,10 @@
 #
 
 try:
-    from .tools import read_file_ROTOR, plot_magField_at_positions
+    from .tools import read_file_ROTOR, read_field_ROTOR, plot_magField_at_positions
 except Exception as e:
     print(e)
-    from tools import read_file_ROTOR, plot_magField_at_positions
+    from tools import read_file_ROTOR, read_field_ROTOR, plot_magField_at_positions
 import numpy as np
 import sys
 import os
@@ -15,28 +15,13 @@ def plot_ROTOR(file_path, xyz=(1,1,1), figsize=None, show=True, fft=False):
     
     DATA, list_pos, step_angle = read_file_ROTOR(file_path)
 
-    if DATA.shape[1] == 5:
-        mode="ByAngle"
-        # re-arrange DATA to be an array with lines formated like:
-        # "# angle[°]; X1_magn [mT]; Y1_magn [mT]; Z1_magn [mT]; X2_magn [mT]; Y2_magn [mT]; Z2_magn [mT];..."
-        # instead of:
-        # "# ZPos#; a[°]; X1_magn[mT]; Y1_magn[mT]; Z1_magn[mT]"
-        nb_col = 1 + 3 * len(list_pos) #  angle col + (X , Y, Z) * nb_Zpo
-        nb_row = int(len(DATA)/len(list_pos))
-        newDATA = np.ndarray((nb_row, nb_col), dtype=float)
+    mode = "ByAngle" if DATA.shape[1] == 5 else "ByZPos"
 
-        # copy angle columngit config pull.rebase false
-        newDATA[ :, 0] = DATA[ : nb_row, 1]
-        # copy X,Y,Z for all Zpos:
-        nb_val = 3 # the 3 components X, Y and Z
-        for n in range(len(list_pos)):
-            newDATA[ : , 1 + n*nb_val : 1 + (n+1)*nb_val] = DATA[n*nb_row : (n+1)*nb_row, 2:]
-        DATA = newDATA
-    else:
-        mode="ByZPos"
-
-    # transpose DATA to extract the different variables:
-    A, magnField = DATA.T[0], DATA.T[1:]        
+    # the magnetic field with shape (nb_Zpos, nb_angles, 3) (with several probes the lines of
+    # the different Zpos are interleaved in the ByAngle files):
+    A, magn_field = read_field_ROTOR(file_path)
+    # the lines X1, Y1, Z1, X2, Y2, Z2... expected by plot_magField_at_positions:
+    magnField = magn_field.transpose(0, 2, 1).reshape(-1, len(A))
     # plot the data
     if not figsize:
         H, nb_Zpos = 8, len(list_pos)
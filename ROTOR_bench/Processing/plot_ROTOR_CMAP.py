@@ -3,9 +3,9 @@
 #
 
 try:
-    from .tools import read_file_ROTOR, colormap_magField
+    from .tools import read_file_ROTOR, read_field_ROTOR, colormap_magField
 except:
-    from tools import read_file_ROTOR, colormap_magField
+    from tools import read_file_ROTOR, read_field_ROTOR, colormap_magField
 import numpy as np
 import sys, os
 
@@ -13,32 +13,17 @@ def colormap_ROTOR(fille_path, xyz=(1,1,1), show=True, figsize=None):
     
     DATA, list_pos, step_angle = read_file_ROTOR(fille_path)
     
-    if DATA.shape[1] == 5:
-        mode="ByAngle"
-        # re-arrange DATA to be an array with lines formated like:
-        # "# angle[°]; X1_magn [mT]; Y1_magn [mT]; Z1_magn [mT]; X2_magn [mT]; Y2_magn [mT]; Z2_magn [mT];..."
-        # instead of:
-        # "# ZPos#; a[°]; X1_magn[mT]; Y1_magn[mT]; Z1_magn[mT]"
-        nb_col = 1 + 3 * len(list_pos) #  angle col + (X , Y, Z) * nb_Zpo
-        nb_row = int(len(DATA)/len(list_pos))
-        newDATA = np.ndarray((nb_row, nb_col), dtype=float)
-
-        # copy angle column
-        newDATA[ :, 0] = DATA[ : nb_row, 1]
-        # copy X,Y,Z for all Zpos:
-        nb_val = 3 # the 3 components X, Y and Z
-        for n in range(len(list_pos)):
-            newDATA[ : , 1 + n*nb_val : 1 + (n+1)*nb_val] = DATA[n*nb_row : (n+1)*nb_row, 2:]
-        DATA = newDATA
-    else:
-        mode="ByZPos"
+    mode = "ByAngle" if DATA.shape[1] == 5 else "ByZPos"
 
     if list_pos == ['000']:
         print("Cannot draw color map with just one Z_pos = 0, sorry....")
         return 2
     
-    # Extract the different variables:
-    A, magnField = DATA[:, 0], DATA[:, 1:]  
+    # the magnetic field with shape (nb_Zpos, nb_angles, 3) (with several probes the lines of
+    # the different Zpos are interleaved in the ByAngle files):
+    A, magn_field = read_field_ROTOR(fille_path)
+    # the columns X1, Y1, Z1, X2, Y2, Z2... expected by colormap_magField:
+    magnField = magn_field.transpose(1, 0, 2).reshape(len(A), -1)
     # plot the colormap:
     if figsize is None:
         heights = (None, 4, 6, 8)
@@ -5,10 +5,17 @@
 import matplotlib.pyplot as plt
 import numpy as np
 from numpy.fft import rfft
-import os
+import os, io, re
 from os.path import join
 from pathlib import Path
 from stat import ST_CTIME
+from dataclasses import dataclass, field, fields
+from functools import partial
+
+try:
+    from .data_cache import cache
+except ImportError:
+    from data_cache import cache
 
 def build_XYZ_name_with_tuple(xyz:tuple|dict):
     labels = ("X", "Y", "Z")
@@ -27,37 +34,217 @@ def get_files_by_date(directory, PREFIX):
     files.sort()
     return  [f for s, f in files]
   
+#
+# The fast readers of the data files: the header (the leading '#' lines) is split off once, and
+# the numeric block is parsed in bulk by the C parser of np.loadtxt into one float array, instead
+# of a Python float() for each token. The parsed header comes with the data in a BenchFile record.
+# The read_file_* functions keep their return values for the tabs and the plot_* scripts.
+# The arrays and the header of the files are cached (see data_cache.py): the arrays are read-only.
+# The magnetic field of the ROTOR files has the canonical layout (nb_Zpos, nb_angle, 3), memory
+# mapped from the cache: the field at one Z position, or one component, is a view (no copy).
+# See bench_readers.py for the comparison with the former line by line readers.
+#
+
+@dataclass
+class BenchFile:
+    path: str                       # the path of the data file
+    kind: str                       # 'ROTOR', 'FREE', 'SIMUL' or 'ROTOR_L'
+    DATA: np.ndarray                # the numeric block, shape (nb_line, nb_column)
+    header: list = field(default_factory=list)      # the header lines, without the leading '#'
+    calibration: str = ''           # the calibration block(s) of the sensor(s)
+    sensor: dict = field(default_factory=dict)      # the SENSOR_* parameters: {name: value}
+    Zpos_mm: list = field(default_factory=list)     # the Z positions [mm] of the sensor
+    step_angle: float = None        # the rotation step angle [°]
+    work_dist: float = None         # the working distance [mm]
+    mode: str = None                # 'ByAngle', 'ByZPos' or 'FreeRun' (None for the old files)
+    angle: np.ndarray = None        # ROTOR files: the rotor angles [°], shape (nb_angle,)
+    magn_field: np.ndarray = None   # ROTOR files: the magnetic field [mT], shape (nb_Zpos, nb_angle, 3)
+
+def file_kind(file_path):
+    '''
+    Returns the kind of the data file 'file_path', given by its name.
+    '''
+    name = Path(file_path).name
+    if name.lower().endswith('.csv'): return 'ROTOR_L'
+    if name.lower().startswith('bsimul_'): return 'SIMUL'
+    if name.startswith('FREE'): return 'FREE'
+    return 'ROTOR'
+
+def split_header(raw:bytes, text_header:bool=False):
+    '''
+    To split the content 'raw' of a data file into its header lines (the leading '#' lines
+    and empty lines, and with 'text_header' the leading lines starting with a letter, like
+    the columns names of the CSV files) and its numeric block.
+    Returns the list of the header lines (bytes) and the numeric block (bytes).
+    '''
+    header, pos = [], 0
+    while pos < len(raw):
+        eol = raw.find(b'\n', pos)
+        if eol < 0: eol = len(raw)
+        line = raw[pos:eol].strip()
+        if line and line[:1] != b'#' and not (text_header and line[:1].isalpha()):
+            break
+        header.append(line)
+        pos = eol + 1
+    return header, raw[pos:]
+
+def parse_header(lines:list):
+    '''
+    To parse the header lines 'lines' (str, without the leading '#') of a data file written
+    by ROTOR_bench.write_header.
+    Returns a dict of the BenchFile fields found in the header.
+    '''
+    info = {'sensor': {}}
+    calibration, block = [], False
+    Zpos = {}
+    for line in lines:
+        if line.startswith('*CALIBRATION'):
+            block = True
+        if block:
+            calibration.append(line)
+            if line.startswith('****'): block = False
+        elif m := re.match(r'(SENSOR_\w+): (\S+)', line):
+            info['sensor'][m[1]] = float(m[2]) if '.' in m[2] else int(m[2])
+        elif m := re.match(r'working dist: (\S+) mm', line):
+            info['work_dist'] = float(m[1])
+        elif m := re.match(r'Rotation step angle: (\S+)°', line):
+            info['step_angle'] = float(m[1])
+        elif m := re.match(r'sensor pos #(\d+): (\S+) mm', line):
+            Zpos[int(m[1])] = float(m[2])
+        elif line in ('byPos', 'ByAngle'):
+            info['mode'] = 'ByZPos' if line == 'byPos' else 'ByAngle'
+        elif line.startswith('Time[s]'):
+            info['mode'] = 'FreeRun'
+    info['calibration'] = '\n'.join(calibration)
+    info['Zpos_mm'] = [Zpos[n] for n in sorted(Zpos)]
+    return info
+
+def parse_numeric_block(body:bytes, delimiter:str=None, skip_bad:bool=False):
+    '''
+    To parse the numeric block 'body' of a data file (the '#' lines and the empty lines are
+    skipped) into a float array (nb_line, nb_column), with one call of np.loadtxt.
+    When the block is not regular (a line that is not numeric, or with another number of
+    columns), the lines are parsed one by one: with 'skip_bad' the bad lines are skipped,
+    otherwise the numbers of the lines are given to np.array, like the former readers.
+    Returns an empty array (shape (0,)) when there is no data.
+    '''
+    if not body.strip():
+        return np.array([])
+    try:
+        return np.loadtxt(io.BytesIO(body), delimiter=delimiter, comments='#', ndmin=2)
+    except ValueError:
+        pass
+    DATA = []
+    for line in body.decode('latin1').splitlines():
+        if not line.strip() or line.lstrip()[0] == '#': continue
+        try:
+            DATA.append([float(x) for x in line.strip().split(delimiter)])
+        except ValueError:
+            if not skip_bad: raise
+    if skip_bad and DATA:
+        # keep the lines with the number of columns of the first data line:
+        DATA = [data for data in DATA if len(data) == len(DATA[0])]
+    return np.array(DATA)
+
+def field_tensor(DATA):
+    '''
+    Returns the angles [°] and the magnetic field [mT] of the DATA of a ROTOR file, in the
+    canonical layout: a contiguous array with shape (nb_Zpos, nb_angle, 3).
+    - ByAngle files 'ZPos#; a[°]; X1; Y1; Z1' (5 columns, 9 for the averaged files): the lines of
+      each Zpos are sorted by angle (with several probes the lines of the different Zpos are
+      interleaved in the file); the ZPos# are numbered from 0, or from 1 in the old files,
+    - ByZPos files 'angle; X1; Y1; Z1; X2; Y2; Z2; ...'.
+    '''
+    if DATA.shape[1] in (5, 9):
+        list_Zpos, counts = np.unique(DATA[:, 0], return_counts=True)
+        nb_angle = counts.min()
+        # the lines sorted by Zpos, then by angle (stable sort):
+        rows = DATA[np.lexsort((DATA[:, 1], DATA[:, 0]))]
+        index = np.r_[0, np.cumsum(counts)[:-1]][:, None] + np.arange(nb_angle)
+        block = rows[index]     # shape (nb_Zpos, nb_angle, nb_col)
+        return block[0, :, 1].copy(), np.ascontiguousarray(block[:, :, 2:5])
+    angle, magn_field = field_views(DATA)
+    return angle.copy(), np.ascontiguousarray(magn_field)
+
+def field_views(DATA):
+    '''
+    Returns the angles and the magnetic field of DATA with lines 'angle; X1; Y1; Z1; X2; ...'
+    (ByZPos files, simulation files), as views of DATA (no copy): the magnetic field has the
+    shape (nb_Zpos, nb_angle, 3).
+    '''
+    nb_angle = len(DATA)
+    return DATA[:, 0], DATA[:, 1:].reshape(nb_angle, -1, 3).transpose(1, 0, 2)
+
+def parse_bench_file(file_path, kind:str):
+    '''
+    To read the data file 'file_path' of kind 'kind': the header is parsed and the numeric
+    block is parsed in bulk.
+    Returns a BenchFile.
+    '''
+    with open(file_path, 'rb') as F:
+        raw = F.read()
+
+    if kind == 'ROTOR_L':
+        # the CSV files of the Lille bench may have comma decimal separators, a columns
+        # header, and be encoded in utf8 or cp1252:
+        header, body = split_header(raw, text_header=True)
+        DATA = parse_numeric_block(body.replace(b',', b'.'), delimiter=';', skip_bad=True)
+        try:
+            header = [line.decode('utf8') for line in header]
+        except UnicodeDecodeError:
+            header = [line.decode('cp1252') for line in header]
+        return BenchFile(str(file_path), kind, DATA, header)
+
+    header, body = split_header(raw)
+    DATA = parse_numeric_block(body, delimiter=None if kind == 'SIMUL' else ';')
+    header = [line.decode('utf8').lstrip('#').strip() for line in header]
+    record = BenchFile(str(file_path), kind, DATA, header, **parse_header(header))
+    if kind == 'ROTOR' and file_kind(file_path) == 'ROTOR' and DATA.ndim == 2 and \
+       (DATA.shape[1] in (5, 9) or DATA.shape[1] % 3 == 1):
+        record.angle, record.magn_field = field_tensor(DATA)
+    return record
+
+def read_arrays(file_path, kind:str):
+    '''
+    To read the data file 'file_path' of kind 'kind' for the cache.
+    Returns the dict of the arrays and the dict of the other fields of the BenchFile.
+    '''
+    record = parse_bench_file(file_path, kind)
+    arrays = {'DATA': record.DATA}
+    if record.magn_field is not None:
+        arrays.update(angle=record.angle, magn_field=record.magn_field)
+    meta = {f.name: getattr(record, f.name) for f in fields(BenchFile) if f.name not in arrays}
+    return arrays, meta
+
+def read_bench_file(file_path, kind:str=None, use_cache:bool=True):
+    '''
+    To read the data file 'file_path' of kind 'kind' (given by the name of the file by default),
+    from the cache when the file has already been read.
+    Returns a BenchFile (with read-only arrays when 'use_cache' is True).
+    '''
+    if kind is None: kind = file_kind(file_path)
+    if not use_cache:
+        return parse_bench_file(file_path, kind)
+    arrays, meta = cache.get(file_path, kind, partial(read_arrays, kind=kind))
+    return BenchFile(**dict(meta, path=str(file_path)), **arrays)
+
 def read_file_SIMUL_ROTOR(file_path):
-    
-    with open(file_path, 'r', encoding='utf8') as F:
-        lines = F.readlines()
 
     try:
         # process the name of the file like <Bsimul_r-71_d-1-5-10.txt>
         file_name = Path(file_path).name
         list_dist = file_name.replace('.txt', '').split('d-')[1].split('-')
-        
+
         # now read the sensor data lines:
-        DATA = []
-        for line in lines:
-            # skip comments:
-            if line[0] == "#":
-                continue            
-            # transform strings into numbers:
-            data = [float(x) for x in line.strip().split()]
-            DATA.append(data)
-        DATA = np.array(DATA)
-        
+        DATA = read_bench_file(file_path, 'SIMUL').DATA
+
     except Exception as err:
         print(f"Unexpected error {err=} occurs when reading file <{file_name}>")
         DATA, list_dist = None, None
-    
+
     return DATA, list_dist
-    
+
 def read_file_ROTOR(file_path):
-    
-    with open(file_path, 'r', encoding='utf8') as F:
-        lines = F.readlines()
 
     # process the name of the file <ROTOR_YYYY-MM-DD_hh_mm_ss_ROTSTEP-aa_ZZZ_ZZZ-...txt>
     # Example: <ROTOR_2024-07-09-13-59_WDIST-12_ROTSTEP-4.8_000_030_060_090_1of1.txt
@@ -68,65 +255,33 @@ def read_file_ROTOR(file_path):
     else:
         list_pos = []
         step_angle = '-1'
-        
+
     # now read the sensor data lines:
-    DATA = []
-    for line in lines:
-      # skip comments or empty lines:
-      if line[0] == "#" or line == '\n':
-          continue
-      
-      # transform strings into numbers:
-      data = [float(x) for x in line.strip().split(';')]
-      DATA.append(data)
-    
-    DATA = np.array(DATA)
+    DATA = read_bench_file(file_path, 'ROTOR').DATA
+    if DATA.ndim == 2 and DATA.shape[1] == 9:
+        # averaged "ByAngle" file: only keep the "ZPos#; a[°]; X1; Y1; Z1" columns
+        # (the sX1, sY1, sZ1, nb_read columns are dropped):
+        DATA = DATA[:, :5]
     return DATA, list_pos, float(step_angle)
 
+def read_field_ROTOR(file_path):
+    '''
+    Returns the angles [°] and the magnetic field [mT] of the ROTOR file 'file_path' in the
+    canonical layout (nb_Zpos, nb_angle, 3), memory mapped from the cache (None, None for a
+    file without Zpos, like the FREE files).
+    '''
+    record = read_bench_file(file_path, 'ROTOR')
+    return record.angle, record.magn_field
+
 def read_file_ROTOR_L(file_path):
-    
-    # discover the correct encoding to read the CSV file:
-    for code in ('utf8', 'cp1252'):
-        try:
-            with open(file_path, 'r', encoding=code) as F:
-                lines = F.readlines()
-            break
-        except:
-            pass
 
-    # now read the sensor data lines:
-    DATA = []
-    for line in lines:
-        # skip comments:
-        if line[0] == "#":
-            continue
-        line = line.replace(',','.')
-        try:
-            r, phi, z, Bradial, Btang, Baxial = map(float, line.split(';'))
-            DATA. append([r, phi, z, Bradial, Btang, Baxial])
-        except:
-            continue    
-    DATA = np.array(DATA)
-    return DATA
+    # the encoding of the CSV file is utf8 or cp1252, the lines that are not data are skipped:
+    return read_bench_file(file_path, 'ROTOR_L').DATA
 
 def read_file_FREE(file_path):
-    
-    with open(file_path, 'r', encoding='utf8') as F:
-        lines = F.readlines()
-    
-    # now read the sensor data lines:
-    DATA = []
-    for line in lines:
-      # skip comments:
-      if line == '\n' or line[0] == "#":
-          continue
-      # transform strings into numbers:
-      data = [float(x) for x in line.strip().split(';')]
-      DATA.append(data)
-    
-    DATA = np.array(DATA)
-    return DATA
-    
+
+    return read_bench_file(file_path, 'FREE').DATA
+
 def plot_magField(angle, field, filename, figsize=(8,6), stat=None, show=True, xyz=(1,1,1)):
     '''
         To plot magnetic field versus time (free measurement).
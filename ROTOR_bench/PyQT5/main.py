@@ -159,10 +159,15 @@ class MyApp(QMainWindow):
         b2.setIconSize(QSize(100,100))
         b2.clicked.connect(lambda s, mode='ByZPos': self.RunBench(s, mode))
         
+        b3 = QPushButton(text='RUN continuous\n(quick check)')
+        b3.setMinimumHeight(50)
+        b3.clicked.connect(lambda s, mode='Continuous': self.RunBench(s, mode))
+
         g.addWidget(w,  1, 1)
         g.addWidget(sb, 1, 2)
         g.addWidget(b1, 1, 4)
         g.addWidget(b2, 1, 5)
+        g.addWidget(b3, 3, 4)
         
         w = QLabel("Rotation step angle ")
         cb = QComboBox()
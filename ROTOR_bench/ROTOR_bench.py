@@ -2,25 +2,56 @@
 # Copyright 2024-2025 Jean-Luc.CHARLES@mailo.com
 #
 
-import os
+import os, re, json, hashlib
 import numpy as np
 import matplotlib.pyplot as plt
 from serial import Serial
-from time import sleep, time
+from time import sleep, time, monotonic
 from datetime import datetime
 import sys, subprocess
+from itertools import repeat
+from threading import Thread, Event
+from concurrent.futures import ThreadPoolExecutor
 
-import gpiod
+try:
+    import gpiod
+except ImportError:
+    gpiod = None    # not on the Raspberry Pi: only the 'sim' backend can be used
 
 from ROTOR_config import StepperMotor, Zaxis, Param
 from Tools import uniq_file_name_ROTOR, uniq_file_name_FREE
+from Motion import PulseScheduler, motion_profile, plan_carriage
+from Acquisition import DataWriter, flush_policy, format_FreeRun, format_ByZPos, format_ByAngle
+from Acquisition import RunningStats, averaging_policy, decode_frame, format_ByAngle_avg, refine_intervals
+from Acquisition import settle_policy
+from Telemetry import Telemetry, timed
+from Acquisition import save_checkpoint, load_checkpoint, remove_checkpoint, recover_data_file
+from Acquisition import LivePublisher
+
+# The reply of the sensor to the 'RM' command: 'RD x,y,z' followed by the line terminator:
+RD_FRAME = re.compile(rb'RD\s*([-+.\deE]+)\s*,\s*([-+.\deE]+)\s*,\s*([-+.\deE]+)\s*[\r\n]')
+
+# The end of the reply of the sensor to the 'PC' command: the line of '*' closing the calibration block:
+PC_BLOCK_END = re.compile(rb'\n\*+\r?\n')
 
 class ROTOR_bench():
 
-    def __init__(self, stepper1, stepper2, init_serial=True):
+    def __init__(self, stepper1, stepper2, init_serial=True, backend='rpi', time_scale=1., sim_sensor=None):
+        '''
+        backend: 'rpi' to drive the real bench (gpiod + USB serial link), 'sim' to use the
+                 emulated hardware of the ROTOR_emulator module.
+        time_scale: the emulated hardware runs time_scale times faster than real time.
+        sim_sensor: with backend 'sim', the class of the emulated sensor (default: ROTOR_emulator.USB25103,
+                    see Replay.ReplayUSB25103 to replay a recorded data file).
+        '''
+        assert backend in ('rpi', 'sim')
 
         self.stepper1 = stepper1    # the stepper motor for rotating the shaft
         self.stepper2 = stepper2    # the stepper motor for the sensorZ motion
+        self.backend  = backend
+        self.time_scale = time_scale if backend == 'sim' else 1.
+        self.sim_sensor = sim_sensor
+        self.telemetry  = Telemetry(self.time_scale)   # the durations of the phases of each pose
         
         # GPIO in/out lines are defined in GPIOD_define_line() method:
         self.stepper1_DIR_line  = None
@@ -29,21 +60,46 @@ class ROTOR_bench():
         self.stepper2_DIR_line  = None
         self.stepper2_STEP_line = None
         self.stepper2_ENA_line  = None
+        self.STEP_lines         = None  # the STEP lines of stepper1 & stepper2 requested together (bulk request)
         
         self.emergencyStopRequired = False
         self.serialPort = None      # The serial port connect to the USB link with the magnetic sensor.
-        self.Z_pos_mm = []          # The list of the sensorZ positions, the first one is 0.
+        self.serialPorts = []       # The serial ports of all the sensors (probes), serialPort is the first one.
+        self.banners = []           # The banners of all the probes.
+        self.probe_offsets = [0]    # The Z offsets [mm] of the probes below the first one.
+        self.probe_pool = None      # The threads reading the probes concurrently (with several probes).
+        self.Z_pos_mm = []          # The list of the sensor (carriage) Z positions, the first one is 0.
+        self.read_latency = []      # The measured latencies [s] of the sensor reads ('RM' -> 'RD x,y,z').
+        self.settle_times = []      # The settle times [s] after the moves, None when not settled within SETTLE_MAX_S.
+        self.Z_steps = None         # The Z position of the carriage [steps] below the limit switch, None if unknown.
+        self.shaft_steps = 0        # The absolute number of steps done by the shaft stepper motor.
+        self.Z_steps_since_ref = 0  # The number of steps done by the Z stepper motor since the last Z verification.
+        self.banner = b''           # The banner sent by the sensor when the serial port is opened.
+        self.sensor_config = {}     # The NS/PG settings of the sensor (see config_USBsensor).
+        self.keep_open = False      # True to keep the serial port open at the end of the runs (ROTOR_daemon).
+        self.keep_torque = False    # True to keep the motor torques at the end of the runs (Campaign).
+        self.progress = {}          # The progress of the current run: mode, file, repet, poses done/total...
+        self.scheduler = PulseScheduler(time_scale=self.time_scale) # To emit the STEP pulses of the stepper motors
+        # To publish the measurements for the "Live" tab of the Processing app:
+        self.live = LivePublisher(Param['LIVE_PORT']) if Param['LIVE_PORT'] else None
         
-        # Instanciate the RPi GPIO driver with the 'gpiod' module:
-        self.gpio_chip = gpiod.Chip('gpiochip4')
+        # Instanciate the RPi GPIO driver with the 'gpiod' module, or the emulated one:
+        if backend == 'sim':
+            import ROTOR_emulator
+            self.gpiod = ROTOR_emulator
+            self.gpio_chip = ROTOR_emulator.Chip('gpiochip4', stepper1, stepper2, time_scale=self.time_scale)
+        else:
+            self.gpiod = gpiod
+            self.gpio_chip = gpiod.Chip('gpiochip4')
 
         self.GPIOD_define_lines()
         self.GPIOD_config_lines()
         self.GPIOD_init_lines()
 
         if init_serial:
+            t0 = monotonic()
             # open the seriallink with the sensor:
-            self.open_Serial(5)
+            self.open_Serial(Param['SENSOR_READ_TIMEOUT'])
             if self.serialPort is None:
                 print('[ERROR] cannot open any USB port, tchao!')
                 sys.exit()
@@ -56,79 +112,188 @@ class ROTOR_bench():
             else:
                 print('[INFO] Sensor configuration OK')
 
-            # Send someunused command to clean the serial buffer:
-            self.serialPort.write(b'HI')
-            sleep(1)
-            self.serialPort.read_all()
-
             # Now get the sensor calibration data after the sensor calibration:
-            self.serialPort.write(b'PC')
-            sleep(1)
-            data = self.serialPort.read_all().decode().replace('\r', '')
+            self.calibration_data = self.get_calibration_header()
             print('[INFO] Configuration of the sensor USB25103:')
-            print(data)
-            self.calibration_data = '# ' + data.replace('\n', '\n# ') +'\n'
+            print(self.calibration_data)
+            print(f"[INFO] sensor ready in {(monotonic() - t0) * self.time_scale:.2f} s")
+
+    def wait(self, duration:float):
+        '''
+        To wait for 'duration' seconds (scaled by time_scale with the emulated hardware).
+        '''
+        sleep(duration / self.time_scale)
+
+    def read_until_quiet(self, timeout:float, quiet:float = 0.1, until:re.Pattern = None, port = None):
+        '''
+        To read the replies of the sensor: returns as soon as 'until' matches the received data or,
+        without 'until', when no byte is received during 'quiet' seconds once the reply has started;
+        and at most after 'timeout' seconds.
+        port: the serial port of the probe, default: self.serialPort.
+        Returns the bytes received.
+        '''
+        if port is None: port = self.serialPort
+        data, t_last = b'', None
+        deadline = monotonic() + timeout / self.time_scale
+        while True:
+            nb = port.in_waiting
+            if nb:
+                data  += port.read(nb)
+                t_last = monotonic()
+            now = monotonic()
+            if until is not None and until.search(data): break
+            if until is None and t_last is not None and now - t_last >= quiet / self.time_scale: break
+            if now >= deadline: break
+            sleep(0.005 / self.time_scale)
+        return data
+
+    def get_calibration_block(self, port = None, banner:bytes = None):
+        '''
+        Returns the calibration block of the sensor (reply to the 'PC' command).
+        The block is cached in Param['CALIB_CACHE_DIR'], keyed by the banner of the sensor (with
+        its ID) and the NS/PG settings: the 'PC' command is only sent on a cache miss.
+        Without banner the sensor cannot be identified and the cache is not used.
+        port, banner: the serial port and the banner of the probe, default: the first probe.
+        '''
+        if port is None: port, banner = self.serialPort, self.banner
+        config = self.sensor_config
+        key = hashlib.sha1(banner + f"|NS {config['SENSOR_NB_SAMPLE']}|PG {config['SENSOR_GAIN']}".encode()).hexdigest()
+        cacheName = os.path.join(os.path.expanduser(Param['CALIB_CACHE_DIR']), f'PC_{key}.txt')
+        if banner and os.path.exists(cacheName):
+            with open(cacheName, "r", encoding="utf8") as f:
+                print(f"[INFO] calibration block read from the cache <{cacheName}>")
+                return f.read()
+
+        port.reset_input_buffer()
+        port.write(b'PC')
+        data = self.read_until_quiet(1, until=PC_BLOCK_END, port=port).decode().replace('\r', '')
+        if banner and PC_BLOCK_END.search(data.encode()):
+            os.makedirs(os.path.dirname(cacheName), exist_ok=True)
+            with open(cacheName, "w", encoding="utf8") as f:
+                f.write(data)
+        return data
+
+    def get_calibration_header(self):
+        '''
+        Returns the calibration blocks of the probes, as the comment lines of the data file header.
+        '''
+        header = ''
+        for k, (port, banner) in enumerate(zip(self.serialPorts, self.banners)):
+            data = self.get_calibration_block(port, banner)
+            if len(self.serialPorts) > 1:
+                data = f"Probe #{k+1}, Z offset: {self.probe_offsets[k]} mm\n" + data
+            header += '# ' + data.replace('\n', '\n# ') +'\n'
+        return header
 
     def open_Serial(self, timeout:int = 1):
         '''
-        To open the serial link to the magnetic sensor.
+        To open the serial links to the magnetic sensors (one for each Z offset of the list
+        Param['PROBE_Z_OFFSETS_MM']), and to read their banners.
         '''
-        listUSBports = ["/dev/ttyUSB0", "/dev/ttyUSB1"]
-        serialPort = None
-        for port in listUSBports:
-            try:
-                print(f"[INFO] Trying to open {port}")
-                serialPort = Serial(port, baudrate=115200, timeout=timeout)
-                break
-            except:
-                continue
-        if serialPort is None:
+        nb_probe = len(Param['PROBE_Z_OFFSETS_MM'])
+        if self.backend == 'sim':
+            import ROTOR_emulator
+            sensor = self.sim_sensor or ROTOR_emulator.USB25103
+            self.serialPorts = [sensor(self.gpio_chip, timeout=timeout, time_scale=self.time_scale,
+                                       Z_offset_mm=offset) for offset in Param['PROBE_Z_OFFSETS_MM']]
+        else:
+            self.serialPorts = []
+            for port in Param['PROBE_PORTS']:
+                try:
+                    print(f"[INFO] Trying to open {port}")
+                    self.serialPorts.append(Serial(port, baudrate=115200, timeout=timeout))
+                except:
+                    continue
+                if len(self.serialPorts) == nb_probe: break
+        if not self.serialPorts:
             return
-        self.serialPort = serialPort
-        
-        # read the magnetic sensor banner:
-        sleep(3)
-        data = self.serialPort.read_all().decode().strip()            
-        print(f"[INFO] Found:\n{data}\n[INFO] Sound good !")
+        if len(self.serialPorts) < nb_probe:
+            print(f"[WARNING] {len(self.serialPorts)} probe(s) found instead of {nb_probe}")
+        self.serialPort = self.serialPorts[0]
+        self.probe_offsets = Param['PROBE_Z_OFFSETS_MM'][:len(self.serialPorts)]
+
+        # the probes are read concurrently, one thread for each probe:
+        if len(self.serialPorts) > 1:
+            self.probe_pool = ThreadPoolExecutor(len(self.serialPorts), thread_name_prefix='probe')
+            self.banners = list(self.probe_pool.map(self.read_banner, self.serialPorts))
+        else:
+            self.banners = [self.read_banner(self.serialPort)]
+        self.banner = self.banners[0]
+
+    def close_Serial(self):
+        '''
+        To close the serial links to the magnetic sensors.
+        '''
+        for port in self.serialPorts: port.close()
+
+    def read_banner(self, port = None):
+        '''
+        To read the banner of the magnetic sensor, sent when the serial port is opened.
+        Returns the banner.
+        '''
+        banner = self.read_until_quiet(Param['BANNER_TIMEOUT'], port=port).strip()
+        print(f"[INFO] Found:\n{banner.decode()}\n[INFO] Sound good !")
+        return banner
 
-    def config_USBsensor(self):
+    def config_USBsensor(self, nb_sample:int = None, gain:int = None):
+        '''
+        To set the number of samples (NS) and the gain (PG) of the sensor, default: the Param values.
+        '''
         if self.serialPort is None:
             print('[ERROR] SeialPort is not opened, cannot configure the USBsensor')
             return -1
-        self.serialPort.write(f"NS {Param['SENSOR_NB_SAMPLE']}".encode('ascii'))
-        sleep(0.5)
-        self.serialPort.write(f"PG {Param['SENSOR_GAIN']}".encode('ascii'))
+        if nb_sample is None: nb_sample = Param['SENSOR_NB_SAMPLE']
+        if gain is None: gain = Param['SENSOR_GAIN']
+        for port in self.serialPorts:
+            # each command is sent once the reply to the previous one is complete:
+            port.write(f"NS {nb_sample}".encode('ascii'))
+            self.read_until_quiet(0.5, quiet=0.05, port=port)
+            port.write(f"PG {gain}".encode('ascii'))
+            self.read_until_quiet(0.5, quiet=0.05, port=port)
+            port.reset_input_buffer()
+        self.sensor_config = {'SENSOR_NB_SAMPLE': nb_sample, 'SENSOR_GAIN': gain}
         return 0
             
+    def set_sensor_config(self, nb_sample:int = None, gain:int = None):
+        '''
+        To change the NS/PG settings of the sensor, and to get the matching calibration block.
+        '''
+        self.config_USBsensor(nb_sample, gain)
+        self.calibration_data = self.get_calibration_header()
+            
     def GPIOD_define_lines(self):
         ''' To define the needed RPi GPIO in/out lines.'''
         
         self.stepper1_DIR_line  = self.gpio_chip.get_line(self.stepper1.GPIO_DIR)
-        self.stepper1_STEP_line = self.gpio_chip.get_line(self.stepper1.GPIO_STEP)
         self.stepper1_ENA_line  = self.gpio_chip.get_line(self.stepper1.GPIO_ENA)
 
         self.stepper2_DIR_line  = self.gpio_chip.get_line(self.stepper2.GPIO_DIR)
-        self.stepper2_STEP_line = self.gpio_chip.get_line(self.stepper2.GPIO_STEP)
         self.stepper2_ENA_line  = self.gpio_chip.get_line(self.stepper2.GPIO_ENA)
 
+        # The 2 STEP lines are requested together to drive the 2 stepper motors simultaneously:
+        self.STEP_lines = self.gpio_chip.get_lines([self.stepper1.GPIO_STEP, self.stepper2.GPIO_STEP])
+        self.stepper1_STEP_line, self.stepper2_STEP_line = self.STEP_lines.to_list()
+
         self.limit_switch_line  = self.gpio_chip.get_line(Zaxis.GPIO_LimitSwitch.value)
         
     def GPIOD_config_lines(self):
         ''' To parameter RPi GPIO lines as Input or Ouput.'''
         # set the stepper1 lines as Outputs:
-        self.stepper1_DIR_line.request(consumer="stepper1_DIR",  type=gpiod.LINE_REQ_DIR_OUT)
-        self.stepper1_STEP_line.request(consumer="stepper1_STEP", type=gpiod.LINE_REQ_DIR_OUT)
-        self.stepper1_ENA_line.request(consumer="stepper1_ENA",  type=gpiod.LINE_REQ_DIR_OUT)
+        self.stepper1_DIR_line.request(consumer="stepper1_DIR",  type=self.gpiod.LINE_REQ_DIR_OUT)
+        self.stepper1_ENA_line.request(consumer="stepper1_ENA",  type=self.gpiod.LINE_REQ_DIR_OUT)
         
         # set the stepper2 lines as Outputs:
-        self.stepper2_DIR_line.request(consumer="stepper2_DIR",  type=gpiod.LINE_REQ_DIR_OUT)
-        self.stepper2_STEP_line.request(consumer="stepper2_STEP", type=gpiod.LINE_REQ_DIR_OUT)
-        self.stepper2_ENA_line.request(consumer="stepper2_ENA",  type=gpiod.LINE_REQ_DIR_OUT)
+        self.stepper2_DIR_line.request(consumer="stepper2_DIR",  type=self.gpiod.LINE_REQ_DIR_OUT)
+        self.stepper2_ENA_line.request(consumer="stepper2_ENA",  type=self.gpiod.LINE_REQ_DIR_OUT)
+
+        # set the 2 STEP lines as Outputs with one bulk request:
+        self.STEP_lines.request(consumer="stepper_STEP", type=self.gpiod.LINE_REQ_DIR_OUT)
         
         # The limit switch sensor is normally closed, connected between GND and RPi pinLimitSwitch.
         # pinLimitSwitch is set as INPUT pulled up to tge 5V. Normally the input is connected to GND
         # du to the limit switch; and when the switch is pressed the input goes to 5V (HIGH).
-        self.limit_switch_line.request(consumer="Limit Switch",  type=gpiod.LINE_REQ_DIR_IN, flags=gpiod.LINE_REQ_FLAG_BIAS_PULL_UP)
+        # The line is requested for edge events, to detect the limit switch without polling it:
+        self.limit_switch_line.request(consumer="Limit Switch",  type=self.gpiod.LINE_REQ_EV_BOTH_EDGES, flags=self.gpiod.LINE_REQ_FLAG_BIAS_PULL_UP)
 
     def GPIOD_init_lines(self):
         ''' To initialize the RPi GPIO output lines.'''
@@ -147,26 +312,34 @@ class ROTOR_bench():
                      work_dist:float=None,
                      rot_step:float=None,
                      NBSTEP1:int=None,
-                     Zpos:list=None):
+                     Zpos:list=None,
+                     averaging:dict=None,
+                     adaptive:dict=None,
+                     settle:dict=None):
 
-        assert MODE in ("ByZPos", "FreeRun", "ByAngle")
+        assert MODE in ("ByZPos", "FreeRun", "ByAngle", "Continuous", "Adaptive")
+        if self.live is not None: self.live.start(MODE, file_name, Zpos, rot_step)
         
         with open(file_name, "w", encoding="utf8") as fOut:
 
             # write calibration data:
             fOut.write(self.calibration_data)
 
-            # write sensorparameters
+            # write sensorparameters (with the current NS/PG settings of the sensor)
             for k in Param.keys():
-                if'SENSOR' in k: fOut.write(f'# {k}: {Param[k]} \n')
+                if'SENSOR' in k: fOut.write(f'# {k}: {self.sensor_config.get(k, Param[k])} \n')
 
-            if MODE in ("ByZPos", "ByAngle"):
+            if MODE in ("ByZPos", "ByAngle", "Continuous", "Adaptive"):
                 # Write header for a "by Zpos" measurement strategy:
                 fOut.write(f'# working dist: {work_dist} mm\n')
                 fOut.write(f'# Rotation step angle: {rot_step}°\n')
                 nb_pos = len(Zpos)                    
                 for n, p in enumerate(Zpos, 1):
                     fOut.write(f"# sensor pos #{n}: {p} mm\n")                
+                if settle is not None:
+                    fOut.write(f"# Settling: 2 consecutive reads within {settle['tol_mT']} mT, max wait {settle['max_s']} s\n")
+                if len(self.probe_offsets) > 1 and MODE in ("ByZPos", "ByAngle"):
+                    fOut.write(f"# probe Z offsets: {self.probe_offsets} mm, carriage pos: {self.Z_pos_mm} mm\n")
             
             if MODE == "ByZPos":
                 # Write specific columns header:
@@ -175,9 +348,18 @@ class ROTOR_bench():
                     line += f"; X{n}_magn [mT]; Y{n}_magn [mT]; Z{n}_magn [mT]"
                 fOut.write(line + '\n')
 
-            elif MODE == "ByAngle":
-                # Write specific columns header:
+            elif MODE in ("ByAngle", "Continuous", "Adaptive"):
+                # Write specific columns header (the "Continuous" and "Adaptive" modes use the "ByAngle" layout):
                 line  = "# ByAngle\n# ZPos#; a[°]; X1_magn[mT]; Y1_magn[mT]; Z1_magn[mT]"
+                if averaging is not None:
+                    # mean and standard deviation of the reads at each pose:
+                    line  = f"# Averaging: {averaging['min_reads']} to {averaging['max_reads']} reads, SEM < {averaging['sem_mT']} mT\n" + line
+                    line += "; sX1[mT]; sY1[mT]; sZ1[mT]; nb_read"
+                if MODE == "Continuous":
+                    line = "# Continuous rotation, data resampled on the rotation step angle\n" + line
+                elif MODE == "Adaptive":
+                    line = (f"# Adaptive angular sampling: coarse step {adaptive['coarse_step']}°, refined to the rotation step angle "
+                            f"where |dB/da| > {adaptive['grad_max']} mT/° or |d2B/da2| > {adaptive['curv_max']} mT/°2\n") + line
                 fOut.write(line + '\n')
     
             elif MODE == "FreeRun":
@@ -185,34 +367,38 @@ class ROTOR_bench():
                 fOut.write('\n# Time[s]; Xmagn [mT]; Ymagn [mT]; Zmagn [mT];\n')            
 
 
+    @timed('Zref')
     def Zref_sensor(self, hold_torque:bool = False, verbose:bool = False):
         '''
-        To make the stepper motor move the sensor until it reaches the limit switch sensor
+        To make the stepper motor move the sensor until it reaches the limit switch sensor, in 2 phases:
+        1/ fast travel upward at Zaxis.Zref_fast_velocity, stopped by the rising edge event of the
+           limit switch, then a back-off of Zaxis.Zref_backoff mm.
+           When the Z position is known (self.Z_steps) the carriage moves directly (with the motion
+           profile) to Zaxis.Zref_backoff mm below the switch,
+        2/ slow re-approach at Zaxis.Zref_velocity until the limit switch is pressed.
         '''
         print("[INFO] Stepper motor Z referencing...");
 
-        # move upward:
-        self.stepper2_DIR_line.set_value(0)
-
         # apply the motor holding torque:
         self.stepper2_ENA_line.set_value(0)
 
-        #  the required revolution speed [revol/sec] and corresponding period:
-        N_Hz  = 2 * Zaxis.Zref_velocity.value / (np.pi * self.stepper2.DIAM_MM
-                                                 )
-        T_sec = 1 / (N_Hz * self.stepper2.NB_STEP_PER_REVOL)
-        if verbose: print(f"[INFO] N_Hz: {N_Hz:.2f}, T_ms: {T_sec*1e3:.2f}")
-
-        limit_state = self.limit_switch_line.get_value()
-        print(f'{limit_state=}')
-        while limit_state != 1:
-            # Send a pulse with period equals to Tms:
-            t0 = time()
-            self.stepper2_STEP_line.set_value(1)
-            limit_state = self.limit_switch_line.get_value()
-            self.stepper2_STEP_line.set_value(0)
-            while True:
-                if time() - t0 > T_sec: break
+        backoff_step = self.Z_nb_step(Zaxis.Zref_backoff.value)
+        if self.limit_switch_line.get_value() == 1:
+            # the switch is already pressed: only back off
+            self.Z_steps = 0
+        elif self.Z_steps is None:
+            self.Zref_fast_travel(verbose)
+        elif self.Z_steps > backoff_step:
+            # the position is known: skip the fast phase
+            if verbose: print(f"[INFO] Z position known: {self.Z_steps} steps, skipping the fast phase")
+            self.Zmove_steps(backoff_step - self.Z_steps, Zaxis.Zref_fast_velocity.value)
+
+        # back-off (when the switch is pressed), then the slow re-approach:
+        if self.limit_switch_line.get_value() == 1:
+            self.Zref_release_switch(verbose)
+            self.Zmove_steps(backoff_step, Zaxis.Zref_velocity.value)
+        self.Zref_slow_approach(verbose)
+        self.Z_steps_since_ref = 0
 
         if hold_torque == False: 
             # disable the motor holding torque:
@@ -221,6 +407,172 @@ class ROTOR_bench():
         if verbose: print("[INFO] OK !")
         return 0
 
+    def Zref_fast_travel(self, verbose:bool = False):
+        '''
+        The fast phase of the Z referencing: the STEP pulses are emitted in a thread, while
+        the main thread waits for the rising edge event of the limit switch to stop them.
+        '''
+        # discard the old edge events:
+        while self.limit_switch_line.event_wait(sec=0): self.limit_switch_line.event_read()
+
+        # the max number of steps: the whole Z stroke + 20 mm:
+        max_step = self.Z_nb_step(Param['ZPOS_MAX'] + 20)
+        N_Hz     = self.Z_revol_per_sec(Zaxis.Zref_fast_velocity.value)
+        T_sec    = 1 / (N_Hz * self.stepper2.NB_STEP_PER_REVOL)
+
+        # move upward:
+        self.stepper2_DIR_line.set_value(0)
+
+        switch = Event()
+        travel = Thread(target=self.scheduler.run,
+                        args=(self.stepper2_STEP_line, repeat(T_sec, max_step)),
+                        kwargs={'stop': switch.is_set})
+        travel.start()
+        while travel.is_alive():
+            if self.limit_switch_line.event_wait(nsec=10_000_000) and \
+               self.limit_switch_line.event_read().type == self.gpiod.LineEvent.RISING_EDGE:
+                switch.set()
+                break
+        travel.join()
+        if verbose: print(f"[INFO] fast phase: {self.scheduler.step_count} steps")
+
+        if not switch.is_set():
+            print(f"[WARNING] limit switch not reached after {max_step} steps")
+
+    def Zref_release_switch(self, verbose:bool = False):
+        '''
+        To move the sensor carriage downward until the limit switch is released (after the
+        overshoot of the fast phase).
+        '''
+        # move downward:
+        self.stepper2_DIR_line.set_value(1)
+
+        N_Hz  = self.Z_revol_per_sec(Zaxis.Zref_velocity.value)
+        T_sec = 1 / (N_Hz * self.stepper2.NB_STEP_PER_REVOL)
+        max_step = self.Z_nb_step(Zaxis.Zref_backoff.value + Zaxis.Zref_margin.value)
+        self.scheduler.run(self.stepper2_STEP_line, repeat(T_sec, max_step),
+                           stop=lambda: self.limit_switch_line.get_value() == 0)
+        if verbose: print(f"[INFO] limit switch released after {self.scheduler.step_count} steps")
+
+    def Zref_slow_approach(self, verbose:bool = False):
+        '''
+        The slow phase of the Z referencing: constant crawl upward until the limit switch is pressed
+        (the switch state is read after each step).
+        '''
+        # move upward:
+        self.stepper2_DIR_line.set_value(0)
+
+        N_Hz  = self.Z_revol_per_sec(Zaxis.Zref_velocity.value)
+        T_sec = 1 / (N_Hz * self.stepper2.NB_STEP_PER_REVOL)
+        if verbose: print(f"[INFO] N_Hz: {N_Hz:.2f}, T_ms: {T_sec*1e3:.2f}")
+
+        # the max number of steps: twice the back-off distance + the Z reference margin:
+        max_step = self.Z_nb_step(2*Zaxis.Zref_backoff.value + Zaxis.Zref_margin.value)
+
+        if self.Zcrawl_to_switch(max_step) is None:
+            print(f"[WARNING] limit switch not reached after {max_step} steps")
+            self.Z_steps = None
+        else:
+            self.Z_steps = 0
+        if verbose: print(f"[INFO] slow phase: {self.scheduler.step_count} steps")
+
+    def Zcrawl_to_switch(self, max_step:int):
+        '''
+        To move the sensor carriage upward at Zaxis.Zref_velocity until the limit switch is pressed
+        (the switch state is read after each step), doing at most 'max_step' steps.
+        Returns the number of steps done, or None if the limit switch is not reached.
+        '''
+        # move upward:
+        self.stepper2_DIR_line.set_value(0)
+
+        N_Hz  = self.Z_revol_per_sec(Zaxis.Zref_velocity.value)
+        T_sec = 1 / (N_Hz * self.stepper2.NB_STEP_PER_REVOL)
+
+        self.scheduler.step_count = 0
+        if self.limit_switch_line.get_value() != 1:
+            # Send pulses with period equals to T_sec until the limit switch is pressed:
+            self.scheduler.run(self.stepper2_STEP_line, repeat(T_sec, max_step),
+                               stop=lambda: self.limit_switch_line.get_value() == 1)
+
+        if self.limit_switch_line.get_value() != 1: return None
+        return self.scheduler.step_count
+
+    @timed('Zref')
+    def Zref_verify(self, hold_torque:bool = False, verbose:bool = False):
+        '''
+        Cheap verification of the tracked Z position (self.Z_steps) instead of a full Z referencing:
+        the carriage moves to Param['ZREF_PROBE_MM'] below the limit switch, then crawls upward to
+        the switch. If the switch is pressed at the expected step (+/- Param['ZREF_TOL_MM']) the
+        position is confirmed, else a full Z referencing is done.
+        The outcome is logged in Param['ZREF_LOG_FILE'] (see log_Zref).
+        '''
+        if self.Z_steps is None: return self.Zref_sensor(hold_torque, verbose)
+
+        probe_step = self.Z_nb_step(Param['ZREF_PROBE_MM'])
+        tol_step   = self.Z_nb_step(Param['ZREF_TOL_MM'])
+        Z_tracked  = self.Z_steps
+        Z_steps_since_ref = self.Z_steps_since_ref
+
+        # apply the motor holding torque, and go to the probe position:
+        self.stepper2_ENA_line.set_value(0)
+        self.Zmove_steps(probe_step - self.Z_steps, Zaxis.Zref_fast_velocity.value)
+
+        # the switch must be released at the probe position, and pressed after probe_step steps
+        # (the crawl goes on up to Zaxis.Zref_margin beyond, to measure the larger errors):
+        error_step = None
+        if self.limit_switch_line.get_value() == 0:
+            nb_step = self.Zcrawl_to_switch(probe_step + self.Z_nb_step(Zaxis.Zref_margin.value))
+            if nb_step is not None: error_step = nb_step - probe_step
+
+        if error_step is not None and abs(error_step) <= tol_step:
+            self.Z_steps = 0
+            outcome = "OK"
+            if hold_torque == False: self.stepper2_ENA_line.set_value(1)
+        else:
+            print(f"[WARNING] Z position error: {error_step} steps (tolerance: {tol_step} steps), Z referencing...")
+            self.Z_steps = None
+            outcome = "REHOME"
+            self.Zref_sensor(hold_torque, verbose)
+        if verbose: print(f"[INFO] Z position verification: {outcome}, error: {error_step} steps")
+
+        self.log_Zref(Z_steps_since_ref, Z_tracked, error_step, outcome)
+        return 0
+
+    def log_Zref(self, Z_steps_since_ref:int, Z_tracked:int, error_step:int, outcome:str):
+        '''
+        To append the outcome of a Z position verification to Param['ZREF_LOG_FILE'], with the
+        absolute step counters of the 2 axes (to tune Zaxis.ZREF_EVERY_ROTSTEP with data).
+        '''
+        logName = Param['ZREF_LOG_FILE']
+        new_log = not os.path.exists(logName)
+        mm_per_step = Param['ZREF_PROBE_MM'] / self.Z_nb_step(Param['ZREF_PROBE_MM'])
+        error_mm = "" if error_step is None else f"{error_step*mm_per_step:.3f}"
+        try:
+            # the log is only diagnostic: a failure to write it must not stop the run
+            if os.path.dirname(logName): os.makedirs(os.path.dirname(logName), exist_ok=True)
+            with open(logName, "a", encoding="utf8") as fLog:
+                if new_log:
+                    fLog.write("# date; shaft steps; Z steps since last Zref; Z tracked [steps]; error [steps]; error [mm]; outcome\n")
+                fLog.write(f"{datetime.now().isoformat(timespec='seconds')}; {self.shaft_steps}; {Z_steps_since_ref}; "
+                           f"{Z_tracked}; {'' if error_step is None else error_step}; {error_mm}; {outcome}\n")
+        except OSError as err:
+            print(f"[WARNING] cannot write the Z position verification in <{logName}>: {err}")
+        self.Z_steps_since_ref = 0
+
+    @timed('Z')
+    def Zmove_steps(self, nb_step:int, speed_mm_per_sec:float):
+        '''
+        To move the sensor carriage of 'nb_step' steps (upward if < 0, downward if > 0),
+        with the motion profile of the Z stepper motor, and to track its position.
+        '''
+        if nb_step == 0: return
+        self.stepper2_DIR_line.set_value(1 if nb_step > 0 else 0)
+        N_Hz = self.Z_revol_per_sec(speed_mm_per_sec)
+        self.scheduler.run(self.stepper2_STEP_line, motion_profile(self.stepper2, abs(nb_step), N_Hz))
+        self.Z_steps_since_ref += self.scheduler.step_count
+        if self.Z_steps is not None:
+            self.Z_steps += self.scheduler.step_count if nb_step > 0 else -self.scheduler.step_count
+
     def Do_Zmove_sensor(self, curr_pos_mm:float, n:int, hold_torque:bool = False, verbose:bool = False):
         '''
         To move the sensor carriage along the Z axis.
@@ -247,6 +599,7 @@ class ROTOR_bench():
         # return the new value of the Z position
         return target_Z_pos
 
+    @timed('Z')
     def Zmove_sensor(self, dist_mm: int, speed_mm_per_sec:int, hold_torque:bool = False, verbose:bool = False):
         '''    
         To make the sensor cart move of 'dist_mm' upward if 'dist_mm' < 0, 
@@ -259,6 +612,7 @@ class ROTOR_bench():
         if dist_mm == 0: return
 
         # Set the direction of move:
+        downward = dist_mm > 0
         if dist_mm > 0:
             self.stepper2_DIR_line.set_value(1)  # direction of move is downward:
         elif dist_mm < 0:
@@ -266,12 +620,12 @@ class ROTOR_bench():
             dist_mm = -dist_mm
             
         # the required revolution speed [revol/sec] and corresponding period:
-        N_Hz  = 2. * speed_mm_per_sec / (np.pi *  self.stepper2.DIAM_MM)
+        N_Hz  = self.Z_revol_per_sec(speed_mm_per_sec)
         T_sec = 1 / (N_Hz * self.stepper2.NB_STEP_PER_REVOL)
         if verbose: print(f"[INFO] N_Hz: {N_Hz:.2f}, T_ms: {T_sec*1e3:.2f}")
 
         # the required number of steps: 
-        nb_step = int(2. * 180 * dist_mm / (self.stepper2.STEPPER_ANGLE * np.pi * self.stepper2.DIAM_MM))
+        nb_step = self.Z_nb_step(dist_mm)
 
         # Let's do the job:
 
@@ -279,19 +633,230 @@ class ROTOR_bench():
         self.stepper2_ENA_line.set_value(0)
 
         self.stepper2_STEP_line.set_value(0)
-        for n in range(nb_step):
-            t0 = time()
-            # Send a pulse with period equals to Tms:
-            self.stepper2_STEP_line.set_value(1)
-            sleep(20e-6)
-            self.stepper2_STEP_line.set_value(0)
-            while True:
-                if time() - t0 > T_sec: break
+        # Send the pulses, starting and ending with the period T_sec:
+        self.scheduler.run(self.stepper2_STEP_line, motion_profile(self.stepper2, nb_step, N_Hz))
+        self.Z_steps_since_ref += self.scheduler.step_count
+        if self.Z_steps is not None:
+            self.Z_steps += self.scheduler.step_count if downward else -self.scheduler.step_count
 
         if hold_torque == False: 
             # disable the motor holding torque:
             self.stepper2_ENA_line.set_value(1)       
 
+    def read_sensor_frame(self, timeout:float = None, raw:bool = False, port = None):
+        '''
+        Send a 'Read Manual' (RM) command to the sensor and wait for the complete
+        'RD x,y,z' reply: returns as soon as the line terminator of the reply is received,
+        'timeout' [s] is only a safety net (default: Param['SENSOR_READ_TIMEOUT']).
+        port: the serial port of the probe, default: self.serialPort.
+        The latency of the read is appended to self.read_latency.
+        Returns the values X, Y, Z given by the sensor (Oe), or the raw values (bytes)
+        if raw is True (to be decoded by Acquisition.decode_frame).
+        '''
+        if timeout is None: timeout = Param['SENSOR_READ_TIMEOUT']
+        if port is None: port = self.serialPort
+
+        with self.telemetry.phase('serial_write'):
+            # drop any unread data so as not to decode an old reply:
+            port.reset_input_buffer()
+            port.write(b'RM')
+
+        t0 = monotonic()
+        deadline = t0 + timeout / self.time_scale
+        buffer = b''
+        with self.telemetry.phase('serial_wait'):
+            while True:
+                # read what is available, or block until at least one byte arrives:
+                buffer += port.read(max(1, port.in_waiting))
+                frame = RD_FRAME.search(buffer)
+                if frame is not None:
+                    break
+                if monotonic() > deadline:
+                    raise TimeoutError(f"no 'RD x,y,z' reply from the sensor after {timeout} s, got: {buffer}")
+
+        self.read_latency.append((monotonic() - t0) * self.time_scale)
+        if raw: return frame.groups()
+        X, Y, Z = map(float, frame.groups())
+        return X, Y, Z
+
+    def read_sensor_average(self, averaging:dict, port = None, first:bytes = None):
+        '''
+        To repeat the sensor reads at the current pose, until the standard error of the mean
+        of the 3 components is below averaging['sem_mT'] (with at least averaging['min_reads']
+        reads), or averaging['max_reads'] reads are done.
+        first: the raw frame of a read already done at this pose (the settled read).
+        Returns the RunningStats of the X, Y, Z values [mT].
+        '''
+        stats = RunningStats()
+        if first is not None: stats.add(decode_frame(first))
+        while True:
+            stats.add(decode_frame(self.read_sensor_frame(raw=True, port=port)))
+            if stats.n >= averaging['max_reads']: break
+            if stats.n >= averaging['min_reads'] and max(stats.sem()) <= averaging['sem_mT']: break
+        return stats
+
+    def read_settled(self, settle:dict, port = None):
+        '''
+        To read the sensor just after a move: the reads are repeated until 2 consecutive reads agree
+        within settle['tol_mT'] on the 3 components, or at most during settle['max_s'] seconds.
+        The settle time, from the first read to the acceptance of the pose (None if not settled),
+        is appended to self.settle_times.
+        Returns the raw frame of the last read.
+        '''
+        t0 = monotonic()
+        raw = self.read_sensor_frame(raw=True, port=port)
+        prev = decode_frame(raw)
+        while True:
+            raw = self.read_sensor_frame(raw=True, port=port)
+            values = decode_frame(raw)
+            settle_s = (monotonic() - t0) * self.time_scale
+            if max(abs(v - p) for v, p in zip(values, prev)) <= settle['tol_mT']:
+                self.settle_times.append(settle_s)
+                return raw
+            if settle_s >= settle['max_s'] or self.emergencyStopRequired:
+                self.settle_times.append(None)
+                return raw
+            prev = values
+
+    def read_probes(self, averaging:dict = None, settle:dict = None):
+        '''
+        To read all the probes at the current pose, concurrently (one thread for each probe),
+        after the settling of the pose if settle is not None (see read_settled).
+        Returns the list (one item for each probe) of the raw frames, or of the RunningStats
+        of the reads with averaging (see read_sensor_average).
+        '''
+        def read(port):
+            raw = None if settle is None else self.read_settled(settle, port)
+            if averaging is not None: return self.read_sensor_average(averaging, port, raw)
+            return raw if raw is not None else self.read_sensor_frame(raw=True, port=port)
+
+        if self.probe_pool is None: return [read(self.serialPort)]
+        return list(self.probe_pool.map(read, self.serialPorts))
+
+    def print_read_latency(self):
+        '''
+        To display some statistics on the latencies of the sensor reads.
+        '''
+        if not self.read_latency: return
+        latency = np.array(self.read_latency)*1e3
+        mess  = f"[INFO] {len(latency)} sensor reads, latency [ms] mean: {latency.mean():.1f}, "
+        mess += f"min: {latency.min():.1f}, max: {latency.max():.1f}, "
+        mess += f"total wait: {latency.sum()*1e-3:.1f} s "
+        mess += f"(vs {len(latency)*Param['SENSOR_READ_DELAY']:.1f} s with a fixed SENSOR_READ_DELAY)"
+        print(mess)
+
+    def print_settle_times(self):
+        '''
+        To display some statistics on the settle times after the moves.
+        '''
+        if not self.settle_times: return
+        settled = np.array([t for t in self.settle_times if t is not None])
+        nb_fail = len(self.settle_times) - len(settled)
+        mess = f"[INFO] {len(self.settle_times)} settled reads"
+        if len(settled):
+            mess += f", settle time [ms] median: {np.median(settled)*1e3:.0f}, "
+            mess += f"p95: {np.percentile(settled, 95)*1e3:.0f}, max: {settled.max()*1e3:.0f}"
+        if nb_fail: mess += f", {nb_fail} not settled within SETTLE_MAX_S"
+        print(mess)
+
+    def Z_revol_per_sec(self, speed_mm_per_sec:float):
+        '''
+        Returns the revolution speed [revol/sec] of the Z stepper motor to move the sensor at 'speed_mm_per_sec'.
+        '''
+        return 2. * speed_mm_per_sec / (np.pi * self.stepper2.DIAM_MM)
+
+    def Z_nb_step(self, dist_mm:float):
+        '''
+        Returns the number of steps of the Z stepper motor to move the sensor of 'dist_mm'.
+        '''
+        return int(2. * 180 * dist_mm / (self.stepper2.STEPPER_ANGLE * np.pi * self.stepper2.DIAM_MM))
+
+    @timed('shaft')
+    def Do_shaft_rotation(self, nb_step:int):
+        '''
+        To make the shaft stepper motor do 'nb_step' steps to turn the ROTOR.
+        '''
+        self.scheduler.run(self.stepper1_STEP_line, motion_profile(self.stepper1, nb_step), pulse_width=0.001)
+        self.shaft_steps += nb_step
+
+    def Do_coordinated_move(self, nb_shaft_step:int, Z_dist_mm:float, hold_torque:bool = False, verbose:bool = False):
+        '''
+        To turn the ROTOR of 'nb_shaft_step' steps and to move the sensor carriage of 'Z_dist_mm'
+        (upward if < 0, downward if > 0) at the same time: the STEP pulses of the 2 stepper motors
+        are emitted together through the bulk request of the STEP lines, each motor with its own
+        motion profile.
+        '''
+        if verbose: print(f"[INFO] Coordinated move, shaft: {nb_shaft_step} steps, Z dist: {Z_dist_mm} mm")
+
+        # Set the direction of the Z move:
+        downward = Z_dist_mm > 0
+        if Z_dist_mm > 0:
+            self.stepper2_DIR_line.set_value(1)   # direction of move is downward
+        elif Z_dist_mm < 0:
+            self.stepper2_DIR_line.set_value(0)   # direction of move is upward
+            Z_dist_mm = -Z_dist_mm
+        nb_Z_step = self.Z_nb_step(Z_dist_mm)
+
+        # apply the motors holding torque:
+        self.stepper1_ENA_line.set_value(0)
+        self.stepper2_ENA_line.set_value(0)
+
+        N_Hz = self.Z_revol_per_sec(Zaxis.Z_velocity.value)
+        with self.telemetry.phase('Z' if nb_Z_step else 'shaft'):
+            self.scheduler.run_bulk(self.STEP_lines, [motion_profile(self.stepper1, nb_shaft_step),
+                                                      motion_profile(self.stepper2, nb_Z_step, N_Hz)])
+        self.shaft_steps       += nb_shaft_step
+        self.Z_steps_since_ref += nb_Z_step
+        if self.Z_steps is not None:
+            self.Z_steps += nb_Z_step if downward else -nb_Z_step
+        if hold_torque == False:
+            # disable the Z motor holding torque:
+            self.stepper2_ENA_line.set_value(1)
+
+    def Do_partial_revolution(self, list_k:list, nb_angle_pos:int, NBSTEP1:int,
+                              curr_Zpos_mm:float, next_Zpos_mm:float = None, settle:dict = None):
+        '''
+        To read the sensor at the angles of ranks 'list_k' (sorted, in rotation steps) during a
+        rotation of the ROTOR starting at its angle 0, then to complete the rotation back to the
+        angle 0 while moving the sensor to next_Zpos_mm (if not None).
+        settle: the settle detection of the reads (see read_settled), None for a single read.
+        Returns the raw frames {k: raw} and the new Z position.
+        '''
+        frames, k_curr = {}, 0
+        for k in list_k:
+            if self.emergencyStopRequired: break
+            if k > k_curr: self.Do_shaft_rotation(NBSTEP1 * (k - k_curr))
+            k_curr = k
+            frames[k] = self.read_probes(settle=settle)[0]
+            self.telemetry.end_pose(angle=360 * k / nb_angle_pos)
+            self.progress['done'] += 1
+
+        nb_step = NBSTEP1 * (nb_angle_pos - k_curr)
+        if next_Zpos_mm is None:
+            self.Do_shaft_rotation(nb_step)
+        else:
+            self.Do_coordinated_move(nb_step, next_Zpos_mm - curr_Zpos_mm, hold_torque=True)
+            curr_Zpos_mm = next_Zpos_mm
+        return frames, curr_Zpos_mm
+
+    def Do_adaptive_pass(self, list_n:list, list_k:list, nb_angle_pos:int, NBSTEP1:int, curr_Zpos_mm:float,
+                         settle:dict = None):
+        '''
+        To read the sensor at the angles of ranks 'list_k' for the Z positions of ranks 'list_n'.
+        Returns the raw frames {(n, k): raw} and the new Z position.
+        '''
+        frames = {}
+        for i, n in enumerate(list_n):
+            if self.emergencyStopRequired: break
+            # Move the sensor to the right Z position (if not done with the end of the previous rotation):
+            if curr_Zpos_mm != self.Z_pos_mm[n]:
+                curr_Zpos_mm = self.Do_Zmove_sensor(curr_Zpos_mm, n, hold_torque=True)
+            next_Zpos_mm = self.Z_pos_mm[list_n[i+1]] if i+1 < len(list_n) else None
+            frames_n, curr_Zpos_mm = self.Do_partial_revolution(list_k, nb_angle_pos, NBSTEP1,
+                                                                curr_Zpos_mm, next_Zpos_mm, settle)
+            frames.update({(n, k): raw for k, raw in frames_n.items()})
+        return frames, curr_Zpos_mm
+
     def Do_sensor_measurement(self, fake=False):
         '''
         Do the measurement of the magnetic field. If fake is True, randomvalues are returned
@@ -304,20 +869,56 @@ class ROTOR_bench():
             Y = np.random.randint(1, 2000)/1.2
             Z = np.random.randint(1, 2000)/1.2
         else:
-            # send a 'Read Manual' (RM) command to the sensor:
-            self.serialPort.write(b'RM')
-            sleep(Param['SENSOR_READ_DELAY'])
-            data = self.serialPort.read_all()
-            data = data.decode().replace('\r','').split('RD')[-1].strip()
-            X, Y, Z = map(float, data.split(','))
+            X, Y, Z = self.read_sensor_frame()
             
         return X, Y, Z
 
     def EmergencyStop(self): 
         print("[INFO] EMERGENCY-STOP required")
         self.emergencyStopRequired = True
+        self.scheduler.abort = True             # stop the pulse train in progress
+        self.Stop_ROTOR_Bench()
+
+    def start_run(self, MODE:str, nb_repet:int, nb_pose:int, rot_step:float = None, nb_Z:int = None):
+        '''
+        To reset the emergency stop and the progress at the start of a run;
+        'nb_pose' is the number of measurement poses of each repetition, 'rot_step' and 'nb_Z'
+        (the number of Z positions of the carriage) are used for the projections of the telemetry.
+        '''
+        self.emergencyStopRequired = False
+        self.scheduler.abort = False
+        # the statistics of the run:
+        self.read_latency = []
+        self.settle_times = []
+        self.telemetry.reset(MODE, rot_step, nb_Z)
+        self.scheduler.jitter.clear()
+        self.scheduler.nb_pulse = 0
+        self.progress = {'MODE': MODE, 'repet': 0, 'nb_repet': nb_repet, 'fileName': None,
+                         'done': 0, 'total': nb_pose, 'files': []}
+
+    def release_after_run(self):
+        '''
+        To release the motor torques at the end of a run, unless keep_torque is set (the next run
+        of a campaign then starts with the Z position of the carriage known).
+        '''
+        if self.keep_torque and not self.emergencyStopRequired: return
         self.Stop_ROTOR_Bench()
 
+    def end_run(self, message:str):
+        '''
+        To display the statistics of the run, and to close the serial link (unless keep_open).
+        Returns the list of the data files written by the run.
+        '''
+        self.telemetry.close()
+        self.print_read_latency()
+        self.print_settle_times()
+        self.telemetry.print_summary()
+        self.scheduler.print_jitter()
+        if self.emergencyStopRequired: message += " (stopped)"
+        print(message)
+        if not self.keep_open: self.close_Serial()
+        return self.progress['files']
+
     def Stop_ROTOR_Bench(self, verbose=True):
         '''
         This function is called when the emergency-stop button is pressed.
@@ -325,6 +926,7 @@ class ROTOR_bench():
         '''
         self.stepper1_ENA_line.set_value(1)     # release the torque of the shaft stepper motor
         self.stepper2_ENA_line.set_value(1)     # release the torque of the Z stepper motor
+        self.Z_steps = None                     # the carriage may move without torque
         if verbose: print("[INFO] All motor released")
         
     def run_free(self, params):
@@ -336,67 +938,146 @@ class ROTOR_bench():
         duration = params["DURATION"]
         sampling = params['SAMPLING']
         
-        SAMPLE = params.get('SENSOR_NB_SAMPLE', params['SENSOR_NB_SAMPLE'])
-        GAIN = params.get('SENSOR_GAIN', params['SENSOR_GAIN'])
-        SENSOR_READ_DELAY = params.get('SENSOR_READ_DELAY', params['SENSOR_READ_DELAY'])
+        SAMPLE = params.get('SENSOR_NB_SAMPLE', Param['SENSOR_NB_SAMPLE'])
+        GAIN = params.get('SENSOR_GAIN', Param['SENSOR_GAIN'])
+        SENSOR_READ_DELAY = params.get('SENSOR_READ_DELAY', Param['SENSOR_READ_DELAY'])
         
         nb_repet  = params['NB_REPET']
+        data_dir  = params.get('DATA_DIR', 'TXT')
+        write_policy = flush_policy(params)
+        self.start_run(MODE, nb_repet, None)
         
         # release motors:
         self.Stop_ROTOR_Bench()
+
+        # the sensor settings of the run:
+        if (SAMPLE, GAIN) != (self.sensor_config['SENSOR_NB_SAMPLE'], self.sensor_config['SENSOR_GAIN']):
+            self.set_sensor_config(SAMPLE, GAIN)
         
         now = datetime.now() # current date and time
 
         for repet in range(1, nb_repet+1):
+            if self.emergencyStopRequired: break
 
             # Define the unique file name for the data
-            fileName = uniq_file_name_FREE(now, duration, sampling, SAMPLE, GAIN, SENSOR_READ_DELAY,  (repet, nb_repet))
+            fileName = uniq_file_name_FREE(now, duration, sampling, SAMPLE, GAIN, SENSOR_READ_DELAY,  (repet, nb_repet), data_dir)
+            self.progress['files'].append(fileName)
+            self.progress.update(repet=repet, fileName=fileName, done=0)
+            self.telemetry.open(fileName)
           
             # write the header lines in the data rotor file
             self.write_header(MODE, fileName)
           
-            # write the header lines in the data file
-            with open(fileName, "a", encoding="utf8") as fOut:
+            # the writer thread decodes, formats and writes the data:
+            writer = DataWriter(open(fileName, "a", encoding="utf8"), format_FreeRun, **write_policy, live=self.live,
+                                telemetry=self.telemetry)
               
-                # Send unused command to clean the buhher:
-                self.serialPort.write(b'HI')
-                sleep(1)
-                self.serialPort.read_all()
-                  
-                t0 = time()
-                while True:
-                    t1 = time()
-
-                    # send a 'Read Manual' (RM) command to the sensor:
-                    self.serialPort.write(b'RM')
-                    sleep(SENSOR_READ_DELAY)
-                    data = self.serialPort.read_all().decode().replace('\r','')
-                    t_read = time()- t0
-                    data = data.split('RD')[-1].strip()
-                    X, Y, Z = map(float, data.split(','))
-                    coeff = Param['SENSOR_Oe_mT']
-                    X *= coeff
-                    Y *= coeff
-                    Z *= coeff
-
-                    line = f'{t_read:5.2f};{X:12.6f};{Y:12.6f};{Z:12.6f}\n'
-                    fOut.write(line)
-                    fOut.flush()
-                    print(f'[DATA] {line}', end="")
-
-                    # set measurement time period to 1 sec:
-                    while True:
-                        if time() - t1 >= sampling: break
-
-                    # quit the loop when the elapsed time reaches duration:
-                    if time() - t0 >= duration: break
+            # Clean the serial buffer:
+            self.serialPort.reset_input_buffer()
+              
+            t0 = time()
+            while True:
+                t1 = time()
+
+                # send a 'Read Manual' (RM) command to the sensor and wait for the reply:
+                raw = self.read_sensor_frame(raw=True)
+                t_read = (time()- t0) * self.time_scale
+                writer.put((t_read, raw))
+                self.telemetry.end_pose()
+                self.progress['done'] += 1
+
+                # set measurement time period to 'sampling':
+                self.wait(max(0, sampling - (time() - t1) * self.time_scale))
+
+                # quit the loop when the elapsed time reaches duration:
+                if time() - t0 >= duration / self.time_scale: break
+                if self.emergencyStopRequired: break
+
+            writer.close()
             
-        print("[INFO] end run_free")  
-        self.serialPort.close()
+        return self.end_run("[INFO] end run_free")
         
-    def run_by_ZPos(self, parameters:dict, verbose:bool =False):
+    def run_tune(self, params:dict):
+        '''
+        To benchmark the sensor settings: for each (SENSOR_NB_SAMPLE, SENSOR_GAIN) of the lists
+        TUNE_NB_SAMPLE x TUNE_GAIN, a run_free of TUNE_DURATION_S seconds measures the latency of
+        the reads and the standard deviation of the 3 components of the (static) field.
+        The time to reach the standard error TUNE_TARGET_MT by averaging N reads is N times the
+        latency, with N = (sigma / TUNE_TARGET_MT)², for the worst component: the settings with
+        the shortest time are written in the sensor profile Param['TUNE_PROFILE_FILE'].
+        The free run of a setting lasts longer than TUNE_DURATION_S if needed to get TUNE_MIN_READS reads.
+        Returns the list of the data files written.
+        '''
+        list_NS   = params.get('TUNE_NB_SAMPLE', Param['TUNE_NB_SAMPLE'])
+        list_GAIN = params.get('TUNE_GAIN', Param['TUNE_GAIN'])
+        target    = params.get('TUNE_TARGET_MT', Param['TUNE_TARGET_MT'])
+        min_reads = params.get('TUNE_MIN_READS', Param['TUNE_MIN_READS'])
+        data_dir  = params.get('DATA_DIR', 'TXT')
+        keep_open, self.keep_open = self.keep_open, True
+
+        results, files = [], []
+        for NS in list_NS:
+            for GAIN in list_GAIN:
+                if self.emergencyStopRequired: break
+                # the latency of the reads with these settings gives the duration of the free run:
+                self.set_sensor_config(NS, GAIN)
+                t0 = monotonic()
+                for _ in range(2): self.read_sensor_frame(raw=True)
+                latency = (monotonic() - t0) * self.time_scale / 2
+                duration = max(params.get('TUNE_DURATION_S', Param['TUNE_DURATION_S']), min_reads * latency)
+
+                free_params = {'DURATION': round(duration, 1),
+                               'SAMPLING': 0., 'NB_REPET': 1, 'DATA_DIR': data_dir,
+                               'SENSOR_NB_SAMPLE': NS, 'SENSOR_GAIN': GAIN, 'FILE_FLUSH_POLICY': 'time'}
+                fileName = self.run_free(free_params)[0]
+                files.append(fileName)
+
+                XYZ = np.loadtxt(fileName, comments='#', delimiter=';', ndmin=2)[:, 1:4]
+                latency = float(np.mean(self.read_latency))
+                sigma   = XYZ.std(axis=0, ddof=1)
+                nb_avg  = max(1, int(np.ceil((sigma.max() / target)**2)))
+                results.append({'SENSOR_NB_SAMPLE': NS, 'SENSOR_GAIN': GAIN, 'nb_read': len(XYZ),
+                                'latency_s': round(latency, 4), 'sigma_mT': [round(s, 5) for s in sigma],
+                                'nb_avg': nb_avg, 'time_to_target_s': round(nb_avg * latency, 3)})
+
+        # the report, sorted by time to reach the target:
+        results.sort(key=lambda r: (r['time_to_target_s'], r['SENSOR_NB_SAMPLE']))
+        fileName = f'{data_dir}/TUNE_{datetime.now().strftime("%Y-%m-%d-%H-%M")}.txt'
+        with open(fileName, "w", encoding="utf8") as fOut:
+            fOut.write(f"# Sensor settings benchmark, target standard error: {target} mT\n")
+            fOut.write("# NS; GAIN; nb_read; latency[ms]; sX[mT]; sY[mT]; sZ[mT]; nb_avg; time_to_target[s]\n")
+            for r in results:
+                line  = f"{r['SENSOR_NB_SAMPLE']:3d};{r['SENSOR_GAIN']:2d};{r['nb_read']:5d};{r['latency_s']*1e3:8.1f}"
+                line += ''.join(f';{s:9.5f}' for s in r['sigma_mT'])
+                line += f";{r['nb_avg']:5d};{r['time_to_target_s']:8.2f}"
+                fOut.write(line + '\n')
+                print("[INFO] " + line)
+        files.append(fileName)
+
+        if results and not self.emergencyStopRequired:
+            best = results[0]
+            profile = {'SENSOR_NB_SAMPLE': best['SENSOR_NB_SAMPLE'], 'SENSOR_GAIN': best['SENSOR_GAIN'],
+                       'SENSOR_READ_DELAY': round(best['latency_s'], 2),
+                       'date': datetime.now().isoformat(timespec='seconds'), 'TUNE_TARGET_MT': target,
+                       'banner': self.banner.decode(errors='replace'), 'results': results}
+            profileName = os.path.expanduser(Param['TUNE_PROFILE_FILE'])
+            os.makedirs(os.path.dirname(profileName), exist_ok=True)
+            with open(profileName, "w", encoding="utf8") as f:
+                json.dump(profile, f, indent=2)
+            print(f"[INFO] best settings NS {best['SENSOR_NB_SAMPLE']}, GAIN {best['SENSOR_GAIN']}: "
+                  f"{best['nb_avg']} reads of {best['latency_s']*1e3:.0f} ms to reach {target} mT, "
+                  f"written in <{profileName}>")
+
+        # back to the settings of Param:
+        self.set_sensor_config()
+        self.keep_open = keep_open
+        if not self.keep_open: self.close_Serial()
+        return files
+
+    def run_by_ZPos(self, parameters:dict, verbose:bool =False, resume:dict = None):
         '''Make the measurement: for each angle position the magnetic sensor is moved
            vertically along the Z axis to explore the magnetic field at the different Zpos.
+           resume: the position where an interrupted run restarts (see resume_run).
         '''
         MODE = "ByZPos"
         
@@ -404,9 +1085,15 @@ class ROTOR_bench():
         rot_step  = parameters['ROT_STEP_DEG']
         Zpos_mm   = parameters['Z_POS_MM']
         nb_repet  = parameters['NB_REPET']
+        data_dir  = parameters.get('DATA_DIR', 'TXT')
 
         nb_sensor_pos = len(Zpos_mm)
-        self.Z_pos_mm = parameters["Z_POS_MM"]
+        # the carriage positions, and the Z positions measured by the probes at each of them:
+        plan = plan_carriage(Zpos_mm, self.probe_offsets)
+        nb_carriage   = len(plan)
+        self.Z_pos_mm = [carriage for carriage, _ in plan]
+        write_policy  = flush_policy(parameters)
+        settle        = settle_policy(parameters)
         
         NBSTEP1  = round(rot_step * self.stepper1.RATIO / self.stepper1.STEPPER_ANGLE)    
         T_stepper1_sec = 1 / (self.stepper1.NB_REVOL_PER_SEC * self.stepper1.NB_STEP_PER_REVOL);
@@ -414,100 +1101,121 @@ class ROTOR_bench():
             print(f'[INFO] ROT_STEP_DEG: {rot_step}, NBSTEP1: {NBSTEP1}, T_stepper1_sec:{T_stepper1_sec:.3f}')
         
         now = datetime.now() # current date and time
+        start_repet, start_count = 1, 0
+        if resume is not None:
+            now = datetime.fromisoformat(resume['now'])
+            start_repet, start_count = resume['repet'], resume['count']
 
         print(f'{Zpos_mm=}')
+        self.start_run(MODE, nb_repet, int(round(360 / rot_step)) * nb_sensor_pos, rot_step, nb_carriage)
 
-        for repet in range(1, nb_repet+1):
+        for repet in range(start_repet, nb_repet+1):
+            if self.emergencyStopRequired: break
           
             # Define the unique file name for the data
-            fileName = uniq_file_name_ROTOR(now, work_dist, rot_step, Zpos_mm, (repet, nb_repet), MODE)
-
-            # write the header lines in the datarotor file
-            self.write_header(MODE, fileName, work_dist, rot_step, NBSTEP1, Zpos_mm)
+            fileName = uniq_file_name_ROTOR(now, work_dist, rot_step, Zpos_mm, (repet, nb_repet), MODE, data_dir)
+            self.progress['files'].append(fileName)
+            self.progress.update(repet=repet, fileName=fileName, done=0)
+            self.telemetry.open(fileName)
+            save_checkpoint({'MODE': MODE, 'params': parameters, 'now': now.isoformat(),
+                             'repet': repet, 'fileName': fileName})
+
+            # the resumed run appends the data to the existing file:
+            count, progress = 0, None
+            if repet == start_repet and start_count > 0:
+                count, progress = start_count, {'count': start_count - 1}
+            else:
+                # write the header lines in the datarotor file
+                self.write_header(MODE, fileName, work_dist, rot_step, NBSTEP1, Zpos_mm, settle=settle)
 
             # Enable the shaft stepper motor torque:
             self.stepper1_ENA_line.set_value(0) 
 
-            # open the data file with the uniq name:
-            fOut = open(fileName, "a", encoding="utf8")
+            # open the data file with the uniq name, the writer thread decodes, formats and writes the data:
+            writer = DataWriter(open(fileName, "a", encoding="utf8"), format_ByZPos, progress=progress, **write_policy, live=self.live,
+                                telemetry=self.telemetry)
 
-            # scan angle from 0 to 360°:
-            count = 0
             curr_Zpos_mm = 0
+            if count > 0:
+                # resumed run: Z referencing, then turn the ROTOR from its angle 0 to the next angle:
+                print(f"[INFO] resuming <{fileName}> at angle {rot_step*count:.1f}°")
+                curr_Zpos_mm = self.Zref_sensor(hold_torque=True)
+                self.Do_shaft_rotation(NBSTEP1 * count)
 
-            # Send unused command to clean the buffer:
-            self.serialPort.write(b'HI')
-            sleep(1)
-            self.serialPort.read_all()
+            # Clean the serial buffer:
+            self.serialPort.reset_input_buffer()
 
             while True:
                 t0 = time()
                 angle = rot_step*count
-                if angle >= 360: break
+                if angle >= 360 or self.emergencyStopRequired: break
 
                 # Now make the mmagnetic field measurement for all the positions of the sensor:
-                line = f'{angle:5.1f}'
+                list_raw = [None] * nb_sensor_pos
 
                 Zpos_move_required = count % Zaxis.ZREF_EVERY_ROTSTEP.value
 
-                if Zpos_move_required == 0: curr_Zpos_mm = self.Zref_sensor(hold_torque=True)
+                if Zpos_move_required == 0:
+                    # Z referencing at the first angle, then only a verification of the Z position:
+                    if count == 0: curr_Zpos_mm = self.Zref_sensor(hold_torque=True)
+                    else:          curr_Zpos_mm = self.Zref_verify(hold_torque=True)
 
                 go = count % 2
                 if go == 0:
-                    start, stop, step = 0, nb_sensor_pos, 1
+                    start, stop, step = 0, nb_carriage, 1
                 else:
-                    start, stop, step = nb_sensor_pos-1, -1, -1
+                    start, stop, step = nb_carriage-1, -1, -1
 
                 # Move the sensor donward along Z axis:
-                for n in range(start, stop, step):
+                for m in range(start, stop, step):
 
-                    # Move the sensor to the right Z position:
-                    curr_Zpos_mm = self.Do_Zmove_sensor(curr_Zpos_mm, n, hold_torque=True)
+                    # Move the sensor carriage to the right Z position:
+                    curr_Zpos_mm = self.Do_Zmove_sensor(curr_Zpos_mm, m, hold_torque=True)
 
-                    # Make the sensor measuremnts:
-                    X, Y, Z = self.Do_sensor_measurement();
-                    coeff = Param['SENSOR_Oe_mT']
-                    X *= coeff
-                    Y *= coeff
-                    Z *= coeff
-                    line += f';{X:12.6f};{Y:12.6f};{Z:12.6f}'
+                    # Make the sensor measuremnts, all the probes at once:
+                    frames = self.read_probes(settle=settle)
+                    for k, n in plan[m][1]: list_raw[n] = frames[k]
+                    self.telemetry.end_pose(m, angle)
 
-                # Write data:
-                fOut.write(line + '\n')
-                fOut.flush()
-                print("[DATA] " + line)
+                # Write data, the Z scan of this angle is complete:
+                writer.put((angle, list_raw), {'count': count})
+                self.progress['done'] = (count + 1) * nb_sensor_pos
+                writer.boundary()
                 
-                # Make the stepper motor do the steps to turn the ROTOR of the 'rotor_step' value:
-                for i in range(0, NBSTEP1):
-                    top = time()
-                    self.stepper1_STEP_line.set_value(1)
-                    sleep(0.001)
-                    self.stepper1_STEP_line.set_value(0)
-                    while True:
-                        if time() - top > T_stepper1_sec: break
+                if (count + 1) % Zaxis.ZREF_EVERY_ROTSTEP.value == 0 and rot_step*(count + 1) < 360:
+                    # A Z referencing is required at the next angle: bring the sensor close to the
+                    # limit switch while turning the ROTOR of the 'rotor_step' value:
+                    target_Zpos_mm = min(curr_Zpos_mm, Zaxis.Zref_margin.value)
+                    self.Do_coordinated_move(NBSTEP1, target_Zpos_mm - curr_Zpos_mm, hold_torque=True)
+                    curr_Zpos_mm = target_Zpos_mm
+                else:
+                    # Make the stepper motor do the steps to turn the ROTOR of the 'rotor_step' value:
+                    self.Do_shaft_rotation(NBSTEP1)
               
-                # If there is only one Z position for the sensor, wait 1 seconde:
-                if nb_sensor_pos == 1:
-                    t1 = time();
-                    while t1 - t0 < 1:
-                        t1 = time()
+                # If there is only one Z position for the sensor, wait 1 seconde (without settle
+                # detection, which waits for the end of the vibrations after the rotation):
+                if nb_carriage == 1 and settle is None:
+                    self.wait(max(0, 1 - (time() - t0) * self.time_scale))
 
                 count += 1;
 
-        # release all motor torques:
-        self.Stop_ROTOR_Bench()
+            # close the data file:
+            writer.close()
 
-        # close the data file:
-        fOut.close();
+        # the run is complete (else the checkpoint is kept for MODE 'Resume'):
+        if not self.emergencyStopRequired: remove_checkpoint()
+
+        # release all motor torques:
+        self.release_after_run()
         
-        print("[INFO] end of Run_by_ZPos")    
-        self.serialPort.close()
+        return self.end_run("[INFO] end of Run_by_ZPos")
 
-    def run_by_Angle(self, parameters:dict, verbose:bool =False):
+    def run_by_Angle(self, parameters:dict, verbose:bool =False, resume:dict = None):
         '''Make the measurements: for each Zpos the rotor is rotated by a step angle
            to explore the magnetic field at the different angle positions.
            Once a full rotation is achieved, the sensor moves to the next Zpos
            and the rotor is rotated again...
+           resume: the position where an interrupted run restarts (see resume_run).
         '''
 
         MODE = "ByAngle"
@@ -516,10 +1224,16 @@ class ROTOR_bench():
         rot_step  = parameters['ROT_STEP_DEG']
         Zpos_mm   = parameters['Z_POS_MM']
         nb_repet  = parameters['NB_REPET']
+        data_dir  = parameters.get('DATA_DIR', 'TXT')
 
-        nb_sensor_pos = len(Zpos_mm)
         nb_angle_pos  = int(360 / rot_step)
-        self.Z_pos_mm = parameters["Z_POS_MM"]
+        # the carriage positions, and the Z positions measured by the probes at each of them:
+        plan = plan_carriage(Zpos_mm, self.probe_offsets)
+        nb_carriage   = len(plan)
+        self.Z_pos_mm = [carriage for carriage, _ in plan]
+        write_policy  = flush_policy(parameters)
+        averaging     = averaging_policy(parameters)
+        settle        = settle_policy(parameters)
         
         NBSTEP1  = round(rot_step * self.stepper1.RATIO / self.stepper1.STEPPER_ANGLE)    
         T_stepper1_sec = 1 / (self.stepper1.NB_REVOL_PER_SEC * self.stepper1.NB_STEP_PER_REVOL);
@@ -527,83 +1241,337 @@ class ROTOR_bench():
             print(f'[INFO] ROT_STEP_DEG: {rot_step}, NBSTEP1: {NBSTEP1}, T_stepper1_sec:{T_stepper1_sec:.3f}')
         
         now = datetime.now() # current date and time
-
-        for repet in range(1, nb_repet+1):
+        start_repet, start_n, start_count = 1, 0, 0
+        if resume is not None:
+            now = datetime.fromisoformat(resume['now'])
+            start_repet, start_n, start_count = resume['repet'], resume['n'], resume['count']
+        self.start_run(MODE, nb_repet, nb_angle_pos * nb_carriage, rot_step, nb_carriage)
+
+        for repet in range(start_repet, nb_repet+1):
+            if self.emergencyStopRequired: break
           
             # Define the unique file name for the data
-            fileName = uniq_file_name_ROTOR(now, work_dist, rot_step, Zpos_mm, (repet, nb_repet), MODE)
-
-            # write the header lines in the data rotor file
-            self.write_header(MODE, fileName, work_dist, rot_step, NBSTEP1, Zpos_mm)
+            fileName = uniq_file_name_ROTOR(now, work_dist, rot_step, Zpos_mm, (repet, nb_repet), MODE, data_dir)
+            self.progress['files'].append(fileName)
+            self.progress.update(repet=repet, fileName=fileName, done=0)
+            self.telemetry.open(fileName)
+            save_checkpoint({'MODE': MODE, 'params': parameters, 'now': now.isoformat(),
+                             'repet': repet, 'fileName': fileName})
+
+            # the resumed run appends the data to the existing file:
+            n0, count0, progress = 0, 0, None
+            if repet == start_repet and (start_n, start_count) != (0, 0):
+                n0, count0, progress = start_n, start_count, resume['progress']
+            else:
+                # write the header lines in the data rotor file
+                self.write_header(MODE, fileName, work_dist, rot_step, NBSTEP1, Zpos_mm, averaging, settle=settle)
           
             # Enable the shaft stepper motor torque:
             self.stepper1_ENA_line.set_value(0) 
 
-            # open the data file with the uniq name:
-            fOut = open(fileName, "a", encoding="utf8")
+            # open the data file with the uniq name, the writer thread decodes, formats and writes the data:
+            format_record = format_ByAngle if averaging is None else format_ByAngle_avg
+            writer = DataWriter(open(fileName, "a", encoding="utf8"), format_record, progress=progress, **write_policy, live=self.live,
+                                telemetry=self.telemetry)
 
             # Start the sensor position at top:
             curr_Zpos_mm = 0
 
-            # Send unused command to clean the buffer:
-            self.serialPort.write(b'HI')
-            sleep(1)
-            self.serialPort.read_all()
+            # Clean the serial buffer:
+            self.serialPort.reset_input_buffer()
 
             self.Zref_sensor(hold_torque=True)
+
+            if count0 > 0:
+                # resumed run: turn the ROTOR from its angle 0 to the next angle:
+                self.Do_shaft_rotation(NBSTEP1 * count0)
+            if progress is not None:
+                print(f"[INFO] resuming <{fileName}> at Zpos #{n0}, angle {rot_step*count0:.1f}°")
             
-            # Loop on the sensor Zpos:
-            for n in range(0, nb_sensor_pos):         
+            # Loop on the carriage Zpos (the Zpos of the sensor with one probe):
+            for m in range(n0, nb_carriage):         
                   
-                # Move the sensor to the right Z position:
-                curr_Zpos_mm = self.Do_Zmove_sensor(curr_Zpos_mm, n, hold_torque=True)
+                # Move the sensor carriage to the right Z position:
+                curr_Zpos_mm = self.Do_Zmove_sensor(curr_Zpos_mm, m, hold_torque=True)
 
                 # scan angle from 0 to 360°:
-                count = 0
+                count = count0 if m == n0 else 0
 
                 # The loop on the rotor angle (make a complete rotation)
                 while True:
 
-                    # Now make the magnetic field measurement for all the positions of the sensor:
-                    line = f'{n:2d};'
-
                     angle = rot_step*count
-                    if angle >= 360: break
+                    if angle >= 360 or self.emergencyStopRequired: break
                   
-                    # Make the sensor measuremnts:
-                    X, Y, Z = self.Do_sensor_measurement();
-                    coeff = Param['SENSOR_Oe_mT']
-                    X *= coeff
-                    Y *= coeff
-                    Z *= coeff
-                    values = f'{angle:5.1f};{X:12.6f};{Y:12.6f};{Z:12.6f}'
-                    line += values
+                    # Make the sensor measuremnts (all the probes at once, the raw frames or the
+                    # RunningStats with averaging), and write data:
+                    results = self.read_probes(averaging, settle)
+                    for k, n in plan[m][1]:
+                        writer.put((n, angle, results[k]), {'n': m, 'count': count})
+                    self.telemetry.end_pose(m, angle)
+                    self.progress['done'] = m * nb_angle_pos + count + 1
+
+                    if rot_step*(count + 1) >= 360:
+                        # the rotation at this Z position is complete:
+                        writer.boundary()
+
+                    if rot_step*(count + 1) >= 360 and m < nb_carriage - 1:
+                        # Last angle: move the sensor to the next Z position while turning the ROTOR
+                        # of the 'rotor_step' value:
+                        self.Do_coordinated_move(NBSTEP1, self.Z_pos_mm[m+1] - curr_Zpos_mm, hold_torque=True)
+                        curr_Zpos_mm = self.Z_pos_mm[m+1]
+                    else:
+                        # Make the stepper motor do the steps to turn the ROTOR of the 'rotor_step' value:
+                        self.Do_shaft_rotation(NBSTEP1)
 
-                    print("[DATA] " + values)
+                    count += 1
 
-                    # Make the stepper motor do the steps to turn the ROTOR of the 'rotor_step' value:
-                    for i in range(0, NBSTEP1):
-                        top = time()
-                        self.stepper1_STEP_line.set_value(1)
-                        sleep(0.001)
-                        self.stepper1_STEP_line.set_value(0)
-                        while True:
-                            if time() - top > T_stepper1_sec: break
+            # close the data file:
+            writer.close()
 
-                    count += 1
+        # the run is complete (else the checkpoint is kept for MODE 'Resume'):
+        if not self.emergencyStopRequired: remove_checkpoint()
+                  
+        # release all motor torques:
+        self.release_after_run()
+
+        return self.end_run("END of Run_by_Angle")
+
+    def resume_run(self, verbose:bool =False):
+        '''
+        To resume the run interrupted (emergency stop, serial link, reboot...) whose checkpoint
+        is Param['CHECKPOINT_FILE']: the data file is truncated to its last flushed line, then
+        the run restarts at the next position, appending the data to the file.
+        The ROTOR must be at its angle 0, as for the start of a new run: the shaft stepper motor
+        is turned from this position to the angle where the run restarts.
+        '''
+        checkpoint = load_checkpoint()
+        if checkpoint is None:
+            print(f"[WARNING] no checkpoint <{Param['CHECKPOINT_FILE']}>: nothing to resume")
+            return
+
+        MODE, params, fileName = checkpoint['MODE'], checkpoint['params'], checkpoint['fileName']
+        rot_step = params['ROT_STEP_DEG']
+        # the 'n' of the progress of a ByAngle run is the rank of the carriage position:
+        nb_sensor_pos = len(plan_carriage(params['Z_POS_MM'], self.probe_offsets))
+        resume = {'now': checkpoint['now'], 'repet': checkpoint['repet'], 'n': 0, 'count': 0, 'progress': None}
+
+        # without journal the data file was complete, or not created:
+        journal = recover_data_file(fileName) if os.path.exists(fileName) else None
+        if os.path.exists(fileName) and journal is None:
+            resume['repet'] += 1
+        elif journal is not None and journal['progress'] is not None:
+            # the next position after the last line on the disk:
+            progress = journal['progress']
+            n, count = progress.get('n', 0), progress['count'] + 1
+            if rot_step*count >= 360: n, count = n + 1, 0
+            if MODE == "ByZPos" or n >= nb_sensor_pos:
+                n = 0
+                if count == 0: resume['repet'] += 1
+            resume.update({'n': n, 'count': count, 'progress': progress})
+
+        if resume['repet'] > params['NB_REPET']:
+            print(f"[INFO] the run of <{fileName}> is complete")
+            remove_checkpoint()
+            return
+
+        print(f"[INFO] resuming the {MODE} run, repet: {resume['repet']}, Zpos #{resume['n']}, angle: {rot_step*resume['count']:.1f}°")
+        match MODE:
+            case "ByAngle": return self.run_by_Angle(params, verbose, resume)
+            case "ByZPos":  return self.run_by_ZPos(params, verbose, resume)
+
+    def run_adaptive(self, parameters:dict, verbose:bool =False):
+        '''Make the measurements with an adaptive angular sampling:
+           - a coarse pass measures the field every ADAPT_COARSE_STEP_DEG for all the Zpos,
+           - the intervals where the gradient or the curvature of Bx or Bz is above the thresholds
+             (for one of the Zpos) are refined to the rotation step angle, for all the Zpos.
+           The data are written sorted, with the layout of the "ByAngle" files (non-uniform angles).
+        '''
+        MODE = "Adaptive"
 
-                    # Write data:
+        work_dist = parameters["WORK_DIST"]
+        rot_step  = parameters['ROT_STEP_DEG']
+        Zpos_mm   = parameters['Z_POS_MM']
+        nb_repet  = parameters['NB_REPET']
+        data_dir  = parameters.get('DATA_DIR', 'TXT')
+
+        nb_sensor_pos = len(Zpos_mm)
+        nb_angle_pos  = int(round(360 / rot_step))
+        self.Z_pos_mm = parameters["Z_POS_MM"]
+        write_policy  = flush_policy(parameters)
+        settle        = settle_policy(parameters)
+
+        # the coarse step is a multiple of the rotation step angle:
+        m = max(1, round(parameters.get('ADAPT_COARSE_STEP_DEG', Param['ADAPT_COARSE_STEP_DEG']) / rot_step))
+        adaptive = {'coarse_step': round(m * rot_step, 1),
+                    'grad_max':    parameters.get('ADAPT_GRAD_MT_DEG', Param['ADAPT_GRAD_MT_DEG']),
+                    'curv_max':    parameters.get('ADAPT_CURV_MT_DEG2', Param['ADAPT_CURV_MT_DEG2'])}
+        coarse_k = list(range(0, nb_angle_pos, m))
+        self.start_run(MODE, nb_repet, len(coarse_k) * nb_sensor_pos, rot_step, nb_sensor_pos)
+
+        NBSTEP1  = round(rot_step * self.stepper1.RATIO / self.stepper1.STEPPER_ANGLE)
+        if verbose:
+            print(f"[INFO] ROT_STEP_DEG: {rot_step}, NBSTEP1: {NBSTEP1}, coarse step: {adaptive['coarse_step']}°")
+
+        now = datetime.now() # current date and time
+
+        for repet in range(1, nb_repet+1):
+            if self.emergencyStopRequired: break
+
+            # Define the unique file name for the data
+            fileName = uniq_file_name_ROTOR(now, work_dist, rot_step, Zpos_mm, (repet, nb_repet), "ByAngle", data_dir)
+            self.progress['files'].append(fileName)
+            self.progress.update(repet=repet, fileName=fileName, done=0, total=len(coarse_k) * nb_sensor_pos)
+            self.telemetry.open(fileName)
+
+            # write the header lines in the data rotor file
+            self.write_header(MODE, fileName, work_dist, rot_step, NBSTEP1, Zpos_mm, adaptive=adaptive, settle=settle)
+
+            # Enable the shaft stepper motor torque:
+            self.stepper1_ENA_line.set_value(0)
+
+            curr_Zpos_mm = 0
+            self.Zref_sensor(hold_torque=True)
+
+            # the coarse pass:
+            frames, curr_Zpos_mm = self.Do_adaptive_pass(range(nb_sensor_pos), coarse_k, nb_angle_pos,
+                                                         NBSTEP1, curr_Zpos_mm, settle)
+            if self.emergencyStopRequired: break
+
+            # the intervals to refine:
+            fields = [[decode_frame(frames[(n, k)]) for k in coarse_k] for n in range(nb_sensor_pos)]
+            intervals = refine_intervals(fields, adaptive['coarse_step'], adaptive['grad_max'], adaptive['curv_max'])
+            refine_k  = [k for i in intervals for k in range(coarse_k[i] + 1, min(coarse_k[i] + m, nb_angle_pos))]
+            if verbose:
+                print(f"[INFO] coarse pass: {len(coarse_k)} angles, {len(intervals)} intervals to refine "
+                      f"({len(refine_k)} angles)")
+
+            # the refine pass, visiting the Z positions backward:
+            self.progress['total'] += len(refine_k) * nb_sensor_pos
+            if refine_k:
+                frames_refine, curr_Zpos_mm = self.Do_adaptive_pass(range(nb_sensor_pos-1, -1, -1), refine_k,
+                                                                    nb_angle_pos, NBSTEP1, curr_Zpos_mm, settle)
+                frames.update(frames_refine)
+
+            # write the merged data, sorted by Zpos and angle:
+            writer = DataWriter(open(fileName, "a", encoding="utf8"), format_ByAngle, **write_policy, live=self.live,
+                                telemetry=self.telemetry)
+            k_last = max(k for _, k in frames)
+            for (n, k) in sorted(frames):
+                writer.put((n, round(k*rot_step, 1), frames[(n, k)]))
+                if k == k_last: writer.boundary()
+            writer.close()
+
+            nb_read = len(frames)
+            print(f"[INFO] {nb_read} sensor reads instead of {nb_sensor_pos*nb_angle_pos} "
+                  f"with a uniform sampling every {rot_step}°")
+
+        # release all motor torques:
+        self.release_after_run()
+
+        return self.end_run("END of Run_adaptive")
+
+    def run_continuous(self, parameters:dict, verbose:bool =False):
+        '''Make the measurements with a continuous rotation of the ROTOR: for each Zpos the ROTOR
+           does a full rotation at constant speed while the sensor is read as fast as possible.
+           Each sample gets a monotonic timestamp and the shaft step count at the middle of the read;
+           the samples are resampled on the regular grid of the rotation step angle and written
+           with the layout of the "ByAngle" files. The raw samples are written in a *.raw file.
+        '''
+        MODE = "Continuous"
+
+        work_dist = parameters["WORK_DIST"]
+        rot_step  = parameters['ROT_STEP_DEG']
+        Zpos_mm   = parameters['Z_POS_MM']
+        nb_repet  = parameters['NB_REPET']
+        data_dir  = parameters.get('DATA_DIR', 'TXT')
+        # the revolution speed of the shaft stepper motor:
+        revol_per_sec = parameters.get('ROT_REVOL_PER_SEC', self.stepper1.NB_REVOL_PER_SEC)
+
+        nb_sensor_pos = len(Zpos_mm)
+        self.Z_pos_mm = parameters["Z_POS_MM"]
+
+        # the number of shaft steps for a full rotation of the ROTOR, and the angle of one step:
+        nb_step_revol = round(360 * self.stepper1.RATIO / self.stepper1.STEPPER_ANGLE)
+        step_angle    = 360 / nb_step_revol
+        T_stepper1_sec = 1 / (revol_per_sec * self.stepper1.NB_STEP_PER_REVOL)
+        angles = rot_step * np.arange(int(round(360 / rot_step)))
+        if verbose:
+            print(f'[INFO] ROT_STEP_DEG: {rot_step}, steps per rotation: {nb_step_revol}, '
+                  f'rotation time: {nb_step_revol * T_stepper1_sec:.1f} s')
+
+        now = datetime.now() # current date and time
+        self.start_run(MODE, nb_repet, nb_sensor_pos, rot_step, nb_sensor_pos)
+
+        for repet in range(1, nb_repet+1):
+            if self.emergencyStopRequired: break
+
+            # Define the unique file name for the data
+            fileName = uniq_file_name_ROTOR(now, work_dist, rot_step, Zpos_mm, (repet, nb_repet), "ByAngle", data_dir)
+            self.progress['files'].append(fileName)
+            self.progress.update(repet=repet, fileName=fileName, done=0)
+            self.telemetry.open(fileName)
+
+            # write the header lines in the data rotor file
+            self.write_header(MODE, fileName, work_dist, rot_step, None, Zpos_mm)
+
+            # Enable the shaft stepper motor torque:
+            self.stepper1_ENA_line.set_value(0)
+
+            fOut = open(fileName, "a", encoding="utf8")
+            fRaw = open(fileName.replace('.txt', '.raw'), "w", encoding="utf8")
+            fRaw.write("# ZPos#; t[s]; shaft step; X_magn[mT]; Y_magn[mT]; Z_magn[mT]\n")
+
+            curr_Zpos_mm = 0
+            self.Zref_sensor(hold_torque=True)
+            coeff = Param['SENSOR_Oe_mT']
+
+            # Loop on the sensor Zpos:
+            for n in range(0, nb_sensor_pos):
+                if self.emergencyStopRequired: break
+
+                # Move the sensor to the right Z position:
+                curr_Zpos_mm = self.Do_Zmove_sensor(curr_Zpos_mm, n, hold_torque=True)
+
+                # Start the rotation of the ROTOR in a thread, and read the sensor until it ends:
+                self.scheduler.step_count = 0
+                rotation = Thread(target=self.scheduler.run,
+                                  args=(self.stepper1_STEP_line, repeat(T_stepper1_sec, nb_step_revol)))
+                samples = []
+                t0 = monotonic()
+                rotation.start()
+                while rotation.is_alive():
+                    step_before = self.scheduler.step_count
+                    X, Y, Z = self.read_sensor_frame()
+                    t, step = monotonic(), 0.5*(step_before + self.scheduler.step_count)
+                    samples.append(((t - t0) * self.time_scale, step, X*coeff, Y*coeff, Z*coeff))
+                rotation.join()
+                self.shaft_steps += nb_step_revol
+
+                samples = np.array(samples)
+                for t, step, X, Y, Z in samples:
+                    fRaw.write(f'{n:2d};{t:9.4f};{step:7.1f};{X:12.6f};{Y:12.6f};{Z:12.6f}\n')
+
+                # resample the field on the regular grid of the rotation step angle:
+                a = samples[:, 1] * step_angle
+                field = [np.interp(angles, a, samples[:, i], period=360) for i in (2, 3, 4)]
+                for angle, X, Y, Z in zip(angles, *field):
+                    line = f'{n:2d};{angle:5.1f};{X:12.6f};{Y:12.6f};{Z:12.6f}'
                     fOut.write(line + '\n')
-                    fOut.flush()
-                  
+                    if self.live is not None: self.live.publish(line)
+                fOut.flush()
+                print(f"[INFO] Zpos #{n}: {len(samples)} samples during the rotation, "
+                      f"i.e. one sample every {360/len(samples):.2f}°")
+                self.telemetry.end_pose(n)
+                self.progress['done'] = n + 1
+
+            fRaw.close()
+            fOut.close()
+
         # release all motor torques:
-        self.Stop_ROTOR_Bench()
-          
-        # close the data file:
-        fOut.close();
+        self.release_after_run()
 
-        print("END of Run_by_Angle")  
-        self.serialPort.close()
+        return self.end_run("END of Run_continuous")
 
 if __name__ == "__main__":
 
@@ -2,6 +2,7 @@
 # Copyright 2024-2025 Jean-Luc.CHARLES@mailo.com
 #
 
+import os, json
 from dataclasses import dataclass
 from enum import Enum
 
@@ -17,6 +18,8 @@ class StepperMotor:
     GPIO_STEP:int           # the pin numberfor the Step signal
     GPIO_ENA:int            # the pin numberfor the Enable signal
     DIAM_MM:float = None    # The diameter of the pulley if any 
+    MAX_REVOL_PER_SEC:float = None     # the max (cruise) number of revolution per seconde, NB_REVOL_PER_SEC if None
+    ACCEL_REVOL_PER_SEC2:float = None  # the acceleration/deceleration [revol/s²] of the moves, no ramp if None
 
     def time_delay_ms(self):
         return 1.e3 / (self.NB_REVOL_PER_SEC * self.NBSTEP_PER_REVOL)
@@ -31,11 +34,67 @@ Param = {
     'SENSOR_NB_SAMPLE': 10,   # the number of samples the sensor will get to give an average
     'SENSOR_GAIN':      1,    # the sensor gain: can be 1,2,4 or 8
     'SENSOR_READ_DELAY':0.7,
+    'SENSOR_READ_TIMEOUT': 2.0,  # safety timeout [s] when waiting for the 'RD x,y,z' reply of the sensor
     'SENSOR_Oe_mT':     0.1,  # multiplicative coeff to convert sensor Oe unit to milli-Tesla [mT]
+    'BANNER_TIMEOUT':   3.0,  # max time [s] to wait for the banner of the sensor after opening the serial port
+    'CALIB_CACHE_DIR':  '~/.cache/ROTOR_bench', # the cache of the 'PC' calibration blocks of the sensors
+    'PROBE_PORTS':      ['/dev/ttyUSB0', '/dev/ttyUSB1'], # the serial ports where the probes are searched
+    'PROBE_Z_OFFSETS_MM': [0],  # the Z offsets [mm] of the probes on the carriage, below the first one
+
+    'FILE_FLUSH_POLICY':    'lines', # when the data are written on the disk: 'lines', 'time' or 'zpos'
+    'FILE_FLUSH_EVERY_N':   10,      # 'lines' policy: flush every FILE_FLUSH_EVERY_N lines
+    'FILE_FLUSH_EVERY_SEC': 5.0,     # 'time' policy: flush every FILE_FLUSH_EVERY_SEC seconds
+    'CHECKPOINT_FILE':      'TXT/ROTOR_checkpoint.json', # the checkpoint of the current run, for MODE 'Resume'
+
+    'AVG_MAX_READS':    1,     # ByAngle: max number of sensor reads averaged at each pose (1: no averaging)
+    'AVG_MIN_READS':    3,     # ByAngle: min number of sensor reads averaged at each pose
+    'AVG_SEM_MT':       0.02,  # ByAngle: the reads stop when the standard error of the mean is below AVG_SEM_MT [mT]
+
+    'SETTLE_TOL_MT':    0.2,   # after a move, the pose is settled when 2 consecutive reads agree within SETTLE_TOL_MT [mT]
+    'SETTLE_MAX_S':     1.0,   # the max wait [s] for the settling after a move (0: no settle detection, one read)
+
+    'METRICS_PROJ_ROT_STEPS': [1, 2, 3, 6, 12],  # the ROT_STEP_DEG of the projections displayed at the end of a run
+    'METRICS_PROJ_NB_Z':      [1, 3, 5, 10],     # the numbers of Zpos of the projections displayed at the end of a run
+
+    'ADAPT_COARSE_STEP_DEG': 6.0,  # Adaptive: the rotation step angle [°] of the coarse pass
+    'ADAPT_GRAD_MT_DEG':     8.0,  # Adaptive: refine where the gradient of Bx or Bz is above [mT/°]
+    'ADAPT_CURV_MT_DEG2':    1.0,  # Adaptive: refine where the curvature of Bx or Bz is above [mT/°²]
+
+    'ZREF_PROBE_MM':    1.0,    # the distance [mm] below the limit switch where the Z position is verified
+    'ZREF_TOL_MM':      0.5,    # a full Z referencing is done when the Z position error is above [mm]
+    'ZREF_LOG_FILE':    'TXT/ROTOR_Zref_log.csv',  # the log of the Z position verifications
+
+    'CAMPAIGN_READ_S':  0.3,    # Campaign: the predicted duration [s] of a sensor read (before the measured ones)
+    'TUNE_NB_SAMPLE':   [1, 2, 5, 10, 20, 50], # Tune: the SENSOR_NB_SAMPLE values benchmarked
+    'TUNE_GAIN':        [1, 2, 4, 8],   # Tune: the SENSOR_GAIN values benchmarked
+    'TUNE_DURATION_S':  10,     # Tune: the duration [s] of the free run for each setting
+    'TUNE_MIN_READS':   20,     # Tune: the min number of reads of the free run for each setting
+    'TUNE_TARGET_MT':   0.02,   # Tune: the standard error [mT] to reach by averaging the reads
+    'TUNE_PROFILE_FILE': '~/.config/ROTOR_bench/sensor_profile.json', # the best settings found by MODE 'Tune'
+
+    'LIVE_PORT':        27140,  # the local UDP port where the measurements are published (None: no publication)
+    'DAEMON_SOCKET':    '/tmp/ROTOR_bench.sock',  # the local (unix) socket of the bench daemon ROTOR_daemon.py
     }
+
+def load_tune_profile(Param:dict):
+    '''
+    The sensor settings recommended by the MODE 'Tune' (Param['TUNE_PROFILE_FILE'])
+    replace the default ones in 'Param'.
+    '''
+    profileName = os.path.expanduser(Param['TUNE_PROFILE_FILE'])
+    if not os.path.exists(profileName): return
+    with open(profileName, "r", encoding="utf8") as f:
+        profile = json.load(f)
+    for k in ('SENSOR_NB_SAMPLE', 'SENSOR_GAIN', 'SENSOR_READ_DELAY'):
+        if k in profile: Param[k] = profile[k]
+
+load_tune_profile(Param)
     
 class Zaxis(Enum):
     ZREF_EVERY_ROTSTEP  = 10    # make a Z referencing every ZMOVE_EVERY_ROTATIONSTEP rotations of the ROTOR
-    Zref_velocity       = 5     # the velocity [mm/s] for reaching the limit switch sensor
+    Zref_velocity       = 5     # the velocity [mm/s] for the slow re-approach of the limit switch sensor
+    Zref_fast_velocity  = 20    # the velocity [mm/s] for the fast travel to the limit switch sensor
+    Zref_backoff        = 1     # the distance [mm] of the back-off before the slow re-approach
     Z_velocity          = 15    # the velocity [mm/s] for reaching the limit switch sensor
+    Zref_margin         = 2     # the distance [mm] to the limit switch where a Z move ends before a Z referencing
     GPIO_LimitSwitch    = 8     # The GPIO pin number of the limit switch on the Z axis
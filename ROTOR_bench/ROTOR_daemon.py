@@ -0,0 +1,175 @@
+#
+# Copyright 2024-2025 Jean-Luc.CHARLES@mailo.com
+#
+
+#
+# The bench daemon: a long-lived process that initializes the ROTOR bench once (GPIO lines,
+# serial link, sensor configuration and calibration block) and then runs the jobs submitted
+# on a local unix socket, so that each run does not pay for the bench initialization and
+# the tracked Z position of the carriage is kept from one run to the next.
+#
+# The protocol: one JSON object per line, each request gets one JSON reply line:
+#  {"cmd": "run", "params": {...}} -> {"ok": true} or {"ok": false, "error": "busy"}
+#  {"cmd": "status"}               -> {"ok": true, "state": "idle"|"running", "job": {...},
+#                                      "progress": {...}, "error": null|"..."}
+#  {"cmd": "stop"}                 -> emergency stop of the running job
+#  {"cmd": "shutdown"}             -> stop the daemon (after the running job is stopped)
+#
+# Usage: python ROTOR_daemon.py [--backend rpi|sim] [--time_scale X]
+#
+
+import os, sys, json, socket, socketserver, traceback
+from threading import Thread, Lock
+from time import sleep
+
+from ROTOR_config import Param
+
+def send_request(request:dict, timeout:float = 5.):
+    '''
+    To send a request to the bench daemon, returns the reply (dict) or None when the
+    daemon is not running.
+    '''
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.settimeout(timeout)
+            s.connect(Param['DAEMON_SOCKET'])
+            s.sendall((json.dumps(request) + '\n').encode())
+            reply = s.makefile('rb').readline()
+    except (FileNotFoundError, ConnectionRefusedError):
+        return None
+    return json.loads(reply) if reply else None
+
+def submit_job(params:dict, poll:float = 1.):
+    '''
+    To submit the job 'params' to the bench daemon and to display its progress until it ends.
+    Returns False when the daemon is not running (the caller runs the job itself).
+    '''
+    reply = send_request({'cmd': 'run', 'params': params})
+    if reply is None: return False
+    if not reply['ok']:
+        print(f"[ERROR] the bench daemon refused the job: {reply['error']}")
+        return True
+
+    print(f"[INFO] job {params['MODE']} submitted to the bench daemon")
+    last = None
+    try:
+        while True:
+            sleep(poll)
+            status = send_request({'cmd': 'status'})
+            if status is None:
+                print("[ERROR] the bench daemon is no longer running")
+                break
+            p = status['progress']
+            if p and p != last:
+                total = '?' if p.get('total') is None else p['total']
+                print(f"[INFO] {p['MODE']} repet {p['repet']}/{p['nb_repet']}: {p['done']}/{total} <{p['fileName']}>")
+                last = p
+            if status['state'] == 'idle': break
+    except KeyboardInterrupt:
+        # CTRL-C stops the job, not only the client:
+        send_request({'cmd': 'stop'})
+        print("[INFO] stop requested")
+        return True
+
+    if status is not None and status['error']:
+        print(f"[ERROR] the job failed: {status['error']}")
+    else:
+        print("[INFO] job done")
+    return True
+
+class BenchDaemon(socketserver.ThreadingUnixStreamServer):
+    '''
+    The unix socket server that owns the ROTOR_bench object and runs the jobs, one at a time,
+    in a worker thread.
+    '''
+    daemon_threads = True
+
+    def __init__(self, bench, run_job):
+        if os.path.exists(Param['DAEMON_SOCKET']): os.remove(Param['DAEMON_SOCKET'])
+        super().__init__(Param['DAEMON_SOCKET'], DaemonHandler)
+        self.bench   = bench
+        self.run_job = run_job
+        self.lock    = Lock()
+        self.worker  = None     # the thread running the current job
+        self.job     = None     # the params of the current (or last) job
+        self.error   = None     # the error of the last job
+
+    def state(self):
+        return 'running' if self.worker is not None and self.worker.is_alive() else 'idle'
+
+    def start_job(self, params:dict):
+        with self.lock:
+            if self.state() == 'running': return {'ok': False, 'error': 'busy'}
+            self.job, self.error = params, None
+            self.worker = Thread(target=self.do_job, args=(params,), daemon=True)
+            self.worker.start()
+        return {'ok': True}
+
+    def do_job(self, params:dict):
+        print(f"[INFO] daemon: starting job {params}")
+        try:
+            self.run_job(self.bench, params)
+        except Exception as e:
+            traceback.print_exc()
+            self.error = f"{type(e).__name__}: {e}"
+            self.bench.Stop_ROTOR_Bench()
+        print(f"[INFO] daemon: end of job {params['MODE']}")
+
+    def handle_request_dict(self, request:dict):
+        match(request.get('cmd')):
+            case 'run':
+                return self.start_job(request['params'])
+            case 'status':
+                return {'ok': True, 'state': self.state(), 'job': self.job,
+                        'progress': self.bench.progress, 'error': self.error}
+            case 'stop':
+                if self.state() == 'running': self.bench.EmergencyStop()
+                return {'ok': True}
+            case 'shutdown':
+                if self.state() == 'running': self.bench.EmergencyStop()
+                Thread(target=self.shutdown).start()
+                return {'ok': True}
+            case cmd:
+                return {'ok': False, 'error': f"unknown command <{cmd}>"}
+
+class DaemonHandler(socketserver.StreamRequestHandler):
+    '''
+    Handles the requests of one client connection (one JSON request per line).
+    '''
+    def handle(self):
+        for line in self.rfile:
+            try:
+                reply = self.server.handle_request_dict(json.loads(line))
+            except (ValueError, KeyError) as e:
+                reply = {'ok': False, 'error': f"bad request: {e}"}
+            self.wfile.write((json.dumps(reply) + '\n').encode())
+
+if __name__ == "__main__":
+    import argparse
+    from ROTOR_bench import ROTOR_bench
+    from strike import Stepper1, Stepper2, run_job
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--backend', choices=('rpi', 'sim'), default='rpi')
+    parser.add_argument('--time_scale', type=float, default=1, help='> 1 to run faster than real time (sim)')
+    args = parser.parse_args()
+
+    # initialize the bench once, the serial link stays open between the jobs:
+    R = ROTOR_bench(Stepper1, Stepper2, backend=args.backend, time_scale=args.time_scale)
+    R.keep_open = True
+
+    server = BenchDaemon(R, run_job)
+    print(f"[INFO] bench daemon listening on <{Param['DAEMON_SOCKET']}>")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if server.state() == 'running':
+            R.EmergencyStop()
+            server.worker.join()
+        server.server_close()
+        os.remove(Param['DAEMON_SOCKET'])
+        R.Stop_ROTOR_Bench()
+        R.close_Serial()
+        print("[INFO] bench daemon stopped")
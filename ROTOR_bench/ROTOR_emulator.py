@@ -0,0 +1,421 @@
+#
+# Copyright 2024-2025 Jean-Luc.CHARLES@mailo.com
+#
+
+#
+# Emulation of the ROTOR bench hardware, to run the ROTOR_bench acquisition
+# loops off the Raspberry Pi (backend='sim' of the ROTOR_bench class):
+#  - Chip: mimics the 'gpiod' (v1) Chip/Line API, counts the STEP pulses of the 2 stepper
+#          motors, drives the limit switch at Z=0 (with its edge events) and logs the pulse timing,
+#  - USB25103: mimics the serial link with the USB25103 magnetic sensor, answers the
+#          HI/PC/NS/PG/RM commands with a configurable latency and a synthetic magnetic field.
+# This module also exposes the gpiod constants used by ROTOR_bench, so that it can be used
+# in place of the 'gpiod' module.
+#
+
+import numpy as np
+from time import sleep, monotonic, time_ns
+from collections import deque
+from threading import Condition
+
+from ROTOR_config import Zaxis, Param
+
+# the gpiod (v1) constants used by ROTOR_bench:
+LINE_REQ_DIR_AS_IS        = 1
+LINE_REQ_DIR_IN           = 2
+LINE_REQ_DIR_OUT          = 3
+LINE_REQ_EV_FALLING_EDGE  = 4
+LINE_REQ_EV_RISING_EDGE   = 5
+LINE_REQ_EV_BOTH_EDGES    = 6
+LINE_REQ_FLAG_BIAS_PULL_UP = 64
+
+class LineEvent():
+    '''
+    An emulated edge event of a GPIO line.
+    '''
+    RISING_EDGE  = 1
+    FALLING_EDGE = 2
+
+    def __init__(self, type:int, source):
+        self.type   = type
+        self.source = source
+        self.sec, self.nsec = divmod(time_ns(), 1_000_000_000)
+
+class Line():
+    '''
+    An emulated GPIO line.
+    '''
+    def __init__(self, chip, offset:int):
+        self.chip     = chip
+        self.offset   = offset
+        self.consumer = None
+        self.type     = None
+        self.value    = 0
+        self.events   = deque()     # the pending edge events (input lines requested for events)
+        self.event_cond = Condition()
+
+    def request(self, consumer:str = None, type:int = LINE_REQ_DIR_AS_IS, flags:int = 0, default_val:int = 0):
+        if self.consumer is not None:
+            raise OSError(f"line {self.offset} already requested by <{self.consumer}>")
+        self.consumer = consumer
+        self.type     = type
+        self.value    = default_val
+
+    def release(self):
+        self.consumer = None
+
+    def push_event(self, rising:bool):
+        '''
+        Called by the chip when the input value of the line changes.
+        '''
+        wanted = {LINE_REQ_EV_BOTH_EDGES: True, LINE_REQ_EV_RISING_EDGE: rising,
+                  LINE_REQ_EV_FALLING_EDGE: not rising}
+        if not wanted.get(self.type, False): return
+        with self.event_cond:
+            self.events.append(LineEvent(LineEvent.RISING_EDGE if rising else LineEvent.FALLING_EDGE, self))
+            self.event_cond.notify_all()
+
+    def event_wait(self, sec:int = 0, nsec:int = 0):
+        '''
+        Returns True if an event is pending, after waiting at most sec + nsec (emulated time).
+        '''
+        with self.event_cond:
+            return self.event_cond.wait_for(lambda: len(self.events) > 0,
+                                            (sec + nsec*1e-9) / self.chip.time_scale)
+
+    def event_read(self):
+        with self.event_cond:
+            self.event_cond.wait_for(lambda: len(self.events) > 0)
+            return self.events.popleft()
+
+    def set_value(self, value:int):
+        if self.type != LINE_REQ_DIR_OUT:
+            raise OSError(f"line {self.offset} is not an output line")
+        rising = (self.value == 0 and value == 1)
+        self.value = value
+        if rising: self.chip.on_rising_edge(self.offset)
+
+    def get_value(self):
+        if self.offset == self.chip.limit_switch:
+            return self.chip.limit_switch_value()
+        return self.value
+
+
+class LineBulk():
+    '''
+    An emulated set of GPIO lines requested together.
+    '''
+    def __init__(self, lines:list):
+        self.lines = lines
+
+    def to_list(self):
+        return list(self.lines)
+
+    def request(self, consumer:str = None, type:int = LINE_REQ_DIR_AS_IS, flags:int = 0, default_vals:list = None):
+        if default_vals is None: default_vals = [0] * len(self.lines)
+        for line, value in zip(self.lines, default_vals):
+            line.request(consumer, type, flags, value)
+
+    def release(self):
+        for line in self.lines: line.release()
+
+    def set_values(self, values:list):
+        for line, value in zip(self.lines, values):
+            line.set_value(value)
+
+    def get_values(self):
+        return [line.get_value() for line in self.lines]
+
+
+class Chip():
+    '''
+    An emulated 'gpiochip' wired like the ROTOR bench:
+    - the shaft stepper motor (stepper1) turns the rotor,
+    - the Z stepper motor (stepper2) moves the sensor carriage, the limit switch
+      is pressed when the carriage reaches Z = 0 (the top).
+    '''
+    def __init__(self, name:str, stepper1, stepper2, Z_start_mm:float = 40, time_scale:float = 1.):
+        self.name       = name
+        self.stepper1   = stepper1
+        self.stepper2   = stepper2
+        self.time_scale = time_scale
+        self.lines      = {}
+        self.limit_switch = Zaxis.GPIO_LimitSwitch.value
+
+        # the mechanical state of the bench:
+        self.shaft_steps = 0        # the number of steps done by the shaft stepper motor
+        self.Z_steps     = round(Z_start_mm / self.Z_mm_per_step())
+        self.Z_stop      = -round(2 / self.Z_mm_per_step()) # the mechanical stop, 2 mm above the limit switch
+        self.lost_steps  = 0        # the Z steps lost against the mechanical stop
+        self.Z_miss_rate = 0.       # the probability for the Z stepper motor to miss a step
+        self.missed_steps = 0       # the Z steps missed (step loss injected with Z_miss_rate)
+        self.last_step_time = monotonic()   # the time of the last step done (for the vibrations after the moves)
+        self.rng = np.random.default_rng()
+
+        # the timing log: the times of the STEP pulses for each stepper motor:
+        self.pulse_times = {stepper1.GPIO_STEP: [], stepper2.GPIO_STEP: []}
+        self.ignored_pulses = 0     # the STEP pulses sent while the motor torque is disabled
+
+    def get_line(self, offset:int):
+        if offset not in self.lines:
+            self.lines[offset] = Line(self, offset)
+        return self.lines[offset]
+
+    def get_lines(self, offsets:list):
+        return LineBulk([self.get_line(offset) for offset in offsets])
+
+    def close(self):
+        pass
+
+    def Z_mm_per_step(self):
+        # inverse of the number of steps computed in ROTOR_bench.Zmove_sensor:
+        return self.stepper2.STEPPER_ANGLE * np.pi * self.stepper2.DIAM_MM / (2. * 180)
+
+    def line_value(self, offset:int):
+        line = self.lines.get(offset)
+        return 0 if line is None else line.value
+
+    def on_rising_edge(self, offset:int):
+        if offset not in self.pulse_times: return
+
+        self.pulse_times[offset].append(monotonic())
+
+        stepper = self.stepper1 if offset == self.stepper1.GPIO_STEP else self.stepper2
+        if self.line_value(stepper.GPIO_ENA) == 1:
+            # the motor torque is disabled: the step is not done
+            self.ignored_pulses += 1
+            return
+
+        self.last_step_time = monotonic()
+        if stepper is self.stepper1:
+            self.shaft_steps += 1
+        else:
+            if self.Z_miss_rate and self.rng.random() < self.Z_miss_rate:
+                self.missed_steps += 1
+                return
+            switch_before = self.limit_switch_value()
+            # DIR = 1: downward, DIR = 0: upward
+            if self.line_value(stepper.GPIO_DIR) == 1:
+                self.Z_steps += 1
+            elif self.Z_steps > self.Z_stop:
+                self.Z_steps -= 1
+            else:
+                self.lost_steps += 1
+            switch_after = self.limit_switch_value()
+            if switch_after != switch_before and self.limit_switch in self.lines:
+                self.lines[self.limit_switch].push_event(rising=(switch_after == 1))
+
+    def limit_switch_value(self):
+        # the limit switch is pressed (HIGH) when the carriage is at Z <= 0:
+        return 1 if self.Z_steps <= 0 else 0
+
+    def shaft_angle_deg(self):
+        return self.shaft_steps * self.stepper1.STEPPER_ANGLE / (self.stepper1.RATIO * self.stepper1.STEP_MODE)
+
+    def Z_mm(self):
+        return self.Z_steps * self.Z_mm_per_step()
+
+    def report(self):
+        '''
+        To display the motion and timing log of the emulated chip.
+        '''
+        print(f"[SIM] shaft: {self.shaft_steps} steps ({self.shaft_angle_deg():.1f}°), "
+              f"Z: {self.Z_steps} steps ({self.Z_mm():.2f} mm), lost Z steps: {self.lost_steps}, "
+              f"missed Z steps: {self.missed_steps}, pulses without torque: {self.ignored_pulses}")
+        for name, stepper in (('shaft', self.stepper1), ('Z', self.stepper2)):
+            times = np.array(self.pulse_times[stepper.GPIO_STEP])
+            if len(times) < 2: continue
+            period = np.diff(times)
+            # only keep the periods inside a pulse train:
+            period = period[period < 10*np.median(period)]*1e3*self.time_scale
+            print(f"[SIM] {name} STEP pulses: {len(times)}, period [ms] mean: {period.mean():.3f}, "
+                  f"std: {period.std():.3f}, min: {period.min():.3f}, max: {period.max():.3f}")
+
+
+class USB25103():
+    '''
+    An emulated USB25103 magnetic sensor behind its serial link (pyserial Serial API).
+    The synthetic field is the one of a rotor with 'pole_pairs' pole pairs, seen by the sensor
+    at the angle and Z position given by the emulated chip, plus 'Z_offset_mm' for a probe
+    mounted below the first one on the sensor carriage.
+    After each move the bench vibrates: a damped oscillation of amplitude 'ring_Oe', time
+    constant 'ring_tau' [s] and frequency 'ring_Hz' is added to the field.
+    '''
+    banner = b"MDT USB25103 3D magnetometer (emulated)\r\nSensor ID:   USB25103-EMULATED\r\n"
+
+    def __init__(self, chip, port:str = '/dev/ttySIM0', timeout:float = 1., time_scale:float = 1.,
+                 base_latency:float = 0.015, sample_time:float = 0.025, pole_pairs:int = 4,
+                 noise_Oe:float = 0.5, quant_Oe:float = 0.8, seed:int = None, boot_time:float = 0.4,
+                 Z_offset_mm:float = 0, ring_Oe:float = 10., ring_tau:float = 0.1, ring_Hz:float = 8.):
+        self.chip         = chip
+        self.port         = port
+        self.timeout      = timeout
+        self.time_scale   = time_scale
+        self.base_latency = base_latency  # latency [s] of a reply
+        self.sample_time  = sample_time   # duration [s] of one ADC sample for the 'RM' command
+        self.pole_pairs   = pole_pairs
+        self.noise_Oe     = noise_Oe      # the std dev [Oe] of the noise for 10 samples
+        self.quant_Oe     = quant_Oe      # the std dev [Oe] of the quantization noise with gain 1, for 10 samples
+        self.Z_offset_mm  = Z_offset_mm   # the Z offset [mm] of the probe below the first one
+        self.ring_Oe      = ring_Oe       # the amplitude [Oe] of the vibrations just after a move
+        self.ring_tau     = ring_tau      # the time constant [s] of the damping of the vibrations
+        self.ring_Hz      = ring_Hz       # the frequency [Hz] of the vibrations
+        self.rng          = np.random.default_rng(seed)
+        self.is_open      = True
+
+        self.nb_sample = Param['SENSOR_NB_SAMPLE']
+        self.gain      = Param['SENSOR_GAIN']
+        self.nb_RM     = 0                # number of 'RM' commands received
+
+        # the pending replies: list of (time when available, bytes), the banner is sent
+        # 'boot_time' [s] after the port is opened:
+        self.pending = [(monotonic() + boot_time/time_scale, self.banner)]
+        self.buffer  = b''
+
+    def _reply(self, data:bytes, latency:float):
+        # the sensor processes the commands one after the other:
+        start = monotonic()
+        if self.pending: start = max(start, self.pending[-1][0])
+        self.pending.append((start + latency/self.time_scale, data))
+
+    def _collect(self):
+        now = monotonic()
+        while self.pending and self.pending[0][0] <= now:
+            self.buffer += self.pending.pop(0)[1]
+
+    def field_Oe(self):
+        '''The synthetic magnetic field [Oe] at the current position of the sensor.'''
+        a = np.radians(self.chip.shaft_angle_deg()) * self.pole_pairs
+        z = self.chip.Z_mm() + self.Z_offset_mm
+        envelope = np.exp(-((z - 60) / 90)**2)
+        X = 1100 * np.cos(a) * envelope
+        Y = -300 * np.cos(a + 0.4) * envelope
+        Z =  450 * np.sin(a) * envelope
+        # the noise of the sensor and the quantization noise of the ADC (lower with a higher gain):
+        noise_Oe = np.hypot(self.noise_Oe, self.quant_Oe / self.gain) * np.sqrt(10 / self.nb_sample)
+        noise = noise_Oe * self.rng.standard_normal(3)
+        # the vibrations of the bench after the last move:
+        dt = (monotonic() - self.chip.last_step_time) * self.time_scale
+        ring = self.ring_Oe * np.exp(-dt / self.ring_tau) * np.cos(2*np.pi*self.ring_Hz*dt)
+        return X + noise[0] + ring, Y + noise[1] + 0.3*ring, Z + noise[2] + 0.5*ring
+
+    def write(self, data:bytes):
+        command = data.decode('ascii').strip()
+        if command == 'HI':
+            self._reply(b'HI\r\nUSB25103 ready\r\n', self.base_latency)
+        elif command == 'PC':
+            calib  = "*CALIBRATION************\r\n"
+            calib += f"ADC samples:  {self.nb_sample}\r\n"
+            calib += f"Gain:  {self.gain}\r\n"
+            calib += "Sensor ID:   USB25103-EMULATED\r\n"
+            calib += "Software Version:  EMULATOR\r\n"
+            calib += "************************\r\n"
+            self._reply(calib.encode(), self.base_latency)
+        elif command.startswith('NS'):
+            self.nb_sample = int(command.split()[1])
+            self._reply(f'{command}\r\n'.encode(), self.base_latency)
+        elif command.startswith('PG'):
+            self.gain = int(command.split()[1])
+            self._reply(f'{command}\r\n'.encode(), self.base_latency)
+        elif command == 'RM':
+            self.nb_RM += 1
+            X, Y, Z = self.field_Oe()
+            latency = self.base_latency + self.nb_sample * self.sample_time
+            self._reply(f'RD {X:.6f}, {Y:.6f}, {Z:.6f}\r\n'.encode(), latency)
+        else:
+            self._reply(b'?\r\n', self.base_latency)
+        return len(data)
+
+    @property
+    def in_waiting(self):
+        self._collect()
+        return len(self.buffer)
+
+    def read(self, size:int = 1):
+        deadline = monotonic() + (self.timeout / self.time_scale if self.timeout is not None else 1e9)
+        while True:
+            self._collect()
+            if len(self.buffer) >= size or monotonic() >= deadline: break
+            next_time = self.pending[0][0] if self.pending else deadline
+            sleep(max(0, min(next_time, deadline) - monotonic()))
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def read_all(self):
+        self._collect()
+        data, self.buffer = self.buffer, b''
+        return data
+
+    def read_until(self, expected:bytes = b'\n', size:int = None):
+        data = b''
+        while not data.endswith(expected) and (size is None or len(data) < size):
+            c = self.read(1)
+            if not c: break
+            data += c
+        return data
+
+    def reset_input_buffer(self):
+        self._collect()
+        self.buffer = b''
+
+    def close(self):
+        self.is_open = False
+
+
+if __name__ == "__main__":
+
+    #
+    # Run a full acquisition on the emulated hardware and display its timing:
+    #
+    import argparse, os
+    from ROTOR_bench import ROTOR_bench
+    from strike import Stepper1, Stepper2
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', choices=('ByAngle', 'ByZPos', 'Continuous', 'Adaptive', 'Free', 'Resume', 'Tune'), default='ByAngle')
+    parser.add_argument('--wdist', type=int, default=1)
+    parser.add_argument('--rot_step', type=float, default=12)
+    parser.add_argument('--zpos', type=int, nargs='+', default=[0, 60])
+    parser.add_argument('--duration', type=float, default=10, help='duration [s] for the Free mode')
+    parser.add_argument('--time_scale', type=float, default=10, help='> 1 to run faster than real time')
+    parser.add_argument('--flush', choices=('lines', 'time', 'zpos'), default=Param['FILE_FLUSH_POLICY'],
+                        help='the flush policy of the data file')
+    parser.add_argument('--avg', type=int, default=Param['AVG_MAX_READS'],
+                        help='ByAngle: max number of sensor reads averaged at each pose')
+    parser.add_argument('--Z_miss_rate', type=float, default=0., help='the probability to miss a Z step')
+    parser.add_argument('--probes', type=float, nargs='+', default=Param['PROBE_Z_OFFSETS_MM'],
+                        help='the Z offsets [mm] of the probes below the first one')
+    args = parser.parse_args()
+    Param['PROBE_Z_OFFSETS_MM'] = args.probes
+
+    params = {'MODE': args.mode,
+              'WORK_DIST': args.wdist,
+              'ROT_STEP_DEG': args.rot_step,
+              'Z_POS_MM': args.zpos,
+              'NB_REPET': 1,
+              'DURATION': args.duration,
+              'SAMPLING': 0.,
+              'SENSOR_NB_SAMPLE': Param['SENSOR_NB_SAMPLE'],
+              'SENSOR_GAIN': Param['SENSOR_GAIN'],
+              'SENSOR_READ_DELAY': Param['SENSOR_READ_DELAY'],
+              'FILE_FLUSH_POLICY': args.flush,
+              'AVG_MAX_READS': args.avg}
+
+    os.makedirs('TXT', exist_ok=True)
+    t0 = monotonic()
+    R = ROTOR_bench(Stepper1, Stepper2, backend='sim', time_scale=args.time_scale)
+    R.gpio_chip.Z_miss_rate = args.Z_miss_rate
+    t1 = monotonic()
+    match(args.mode):
+        case 'ByAngle': R.run_by_Angle(params, verbose=True)
+        case 'ByZPos':  R.run_by_ZPos(params, verbose=True)
+        case 'Continuous': R.run_continuous(params, verbose=True)
+        case 'Adaptive': R.run_adaptive(params, verbose=True)
+        case 'Free':    R.run_free(params)
+        case 'Resume':  R.resume_run(verbose=True)
+        case 'Tune':    R.run_tune({'TUNE_DURATION_S': args.duration})
+    t2 = monotonic()
+
+    R.gpio_chip.report()
+    print(f"[SIM] bench init: {(t1-t0)*args.time_scale:.1f} s, run: {(t2-t1)*args.time_scale:.1f} s "
+          f"(emulated time, x{args.time_scale} => wall clock: {t2-t0:.1f} s)")
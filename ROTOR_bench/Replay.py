@@ -0,0 +1,223 @@
+#
+# Copyright 2024-2025 Jean-Luc.CHARLES@mailo.com
+#
+
+#
+# Replay of a recorded data file (ROTOR_*-a.txt, ROTOR_*-z.txt or FREE_*.txt) through the real
+# acquisition code paths (run_by_Angle, run_by_ZPos, run_free) of ROTOR_bench, on the emulated
+# hardware (backend 'sim'): the sensor answers the values of the recorded file instead of the
+# synthetic field of ROTOR_emulator:
+#  - ByAngle/ByZPos: the value of the pose (Zpos, angle) given by the emulated chip,
+#  - FreeRun: the recorded values one after the other.
+# The run uses the parameters found in the header of the recorded file; it runs at real speed
+# (--time_scale 1) or faster, the telemetry of the run gives the throughput of the software
+# part of the acquisition.
+# At the end, the data of the new file are compared with the recorded data, and the new file
+# can be compared byte for byte with the file of a previous replay (--compare), to check that
+# an optimisation does not change the results.
+#
+# Usage:  python Replay.py ../avril2025/ROTOR_2024-11-07-17-33_WDIST-01_ROTSTEP-001.2_000_060_1of1-a.txt --time_scale 50
+#
+
+import os, re, sys, filecmp
+import numpy as np
+from functools import partial
+from time import monotonic
+
+from ROTOR_config import Param
+from ROTOR_emulator import USB25103
+
+
+class Recording():
+    '''
+    A recorded data file: its MODE, the parameters of the run found in its header, its
+    calibration blocks and its data, indexed by pose.
+    '''
+    def __init__(self, fileName:str):
+        self.fileName    = fileName
+        self.params      = {'NB_REPET': 1}
+        self.calibration = []       # the calibration blocks of the probes ('PC' replies)
+        self.offsets     = [0]      # the Z offsets [mm] of the probes
+        self.fields      = {}       # ByAngle/ByZPos: {(Zpos rank, angle rank): (X, Y, Z) [mT]}
+        self.samples     = []       # FreeRun: the (X, Y, Z) [mT] of the reads
+        self.read_header()
+        self.read_data()
+
+    def read_header(self):
+        '''
+        To read the MODE, the parameters and the calibration blocks in the header of the file.
+        '''
+        name = os.path.basename(self.fileName)
+        self.MODE = 'Free' if name.startswith('FREE') else 'ByZPos' if name.endswith('-z.txt') else 'ByAngle'
+        Zpos, block, settled = {}, None, False
+        with open(self.fileName, "r", encoding="utf8") as f:
+            for line in f:
+                if not line.startswith('#'): break
+                line = line[1:].strip()
+                if line.startswith('*CALIBRATION'):
+                    block = [line]
+                elif block is not None:
+                    block.append(line)
+                    if line.startswith('****'):
+                        self.calibration.append('\r\n'.join(block) + '\r\n')
+                        block = None
+                elif m := re.match(r'(SENSOR_NB_SAMPLE|SENSOR_GAIN): (\d+)', line):
+                    self.params[m[1]] = int(m[2])
+                elif m := re.match(r'working dist: (\S+) mm', line):
+                    self.params['WORK_DIST'] = int(float(m[1]))
+                elif m := re.match(r'Rotation step angle: (\S+)°', line):
+                    self.params['ROT_STEP_DEG'] = float(m[1])
+                elif m := re.match(r'sensor pos #(\d+): (\S+) mm', line):
+                    Zpos[int(m[1])] = int(float(m[2]))
+                elif m := re.match(r'Averaging: (\d+) to (\d+) reads, SEM < (\S+) mT', line):
+                    self.params.update(AVG_MIN_READS=int(m[1]), AVG_MAX_READS=int(m[2]), AVG_SEM_MT=float(m[3]))
+                elif m := re.match(r'Settling: 2 consecutive reads within (\S+) mT, max wait (\S+) s', line):
+                    self.params.update(SETTLE_TOL_MT=float(m[1]), SETTLE_MAX_S=float(m[2]))
+                    settled = True
+                elif m := re.match(r'probe Z offsets: \[([^\]]*)\] mm', line):
+                    self.offsets = [float(o) for o in m[1].split(',')]
+                elif line == 'byPos':
+                    self.MODE = 'ByZPos'
+
+        # the files recorded without settle detection are replayed without settle detection:
+        if not settled: self.params['SETTLE_MAX_S'] = 0
+        self.params['MODE'] = self.MODE
+        if self.MODE != 'Free':
+            self.params['Z_POS_MM'] = [Zpos[n] for n in sorted(Zpos)]
+
+    def read_data(self):
+        '''
+        To read the data of the file, indexed by pose (Zpos rank, angle rank).
+        '''
+        DATA = np.loadtxt(self.fileName, delimiter=';', comments='#', ndmin=2)
+        if self.MODE == 'Free':
+            self.samples = [tuple(row[1:4]) for row in DATA]
+            # the duration of the run: the time of the last read plus one read:
+            t = DATA[:, 0]
+            self.params.update(DURATION=float(t[-1] + (np.median(np.diff(t)) if len(t) > 1 else 0)), SAMPLING=0.)
+            return
+
+        rot_step = self.params['ROT_STEP_DEG']
+        if self.MODE == 'ByZPos':
+            # angle; X1; Y1; Z1; X2; Y2; Z2...
+            for row in DATA:
+                k = self.angle_rank(row[0])
+                for n in range((len(row) - 1) // 3):
+                    self.fields[(n, k)] = tuple(row[1+3*n:4+3*n])
+        else:
+            # ZPos#; angle; X; Y; Z (the old files number the Zpos from 1, and the averaged
+            # files have the sigmas and the number of reads after X, Y, Z):
+            ranks = {z: n for n, z in enumerate(sorted(set(DATA[:, 0])))}
+            for row in DATA:
+                self.fields[(ranks[row[0]], self.angle_rank(row[1]))] = tuple(row[2:5])
+
+    def angle_rank(self, angle:float):
+        '''
+        Returns the rank of 'angle' [°] in the rotation steps of the run.
+        '''
+        nb_angle = int(round(360 / self.params['ROT_STEP_DEG']))
+        return int(round(angle / self.params['ROT_STEP_DEG'])) % nb_angle
+
+    def field_mT(self, angle:float, Z_mm:float, nb_read:int):
+        '''
+        Returns the recorded X, Y, Z values [mT] at the rotor angle 'angle' [°] and the Z position
+        'Z_mm' [mm] of the sensor (the nearest recorded Z position), or of the read 'nb_read' for
+        the FreeRun mode.
+        '''
+        if self.MODE == 'Free':
+            return self.samples[nb_read % len(self.samples)]
+        Zpos = self.params['Z_POS_MM']
+        n = int(np.argmin([abs(Z_mm - z) for z in Zpos]))
+        return self.fields.get((n, self.angle_rank(angle)), (0., 0., 0.))
+
+
+class ReplayUSB25103(USB25103):
+    '''
+    An emulated USB25103 sensor answering the values of a Recording (no noise, no vibrations),
+    and its calibration block.
+    '''
+    banner = b"MDT USB25103 3D magnetometer (replay)\r\nSensor ID:   USB25103-REPLAY\r\n"
+
+    def __init__(self, chip, recording:Recording, **kwargs):
+        super().__init__(chip, noise_Oe=0., quant_Oe=0., ring_Oe=0., **kwargs)
+        self.recording = recording
+        self.probe = recording.offsets.index(self.Z_offset_mm) if self.Z_offset_mm in recording.offsets else 0
+
+    def field_Oe(self):
+        '''The recorded magnetic field [Oe] at the current position of the sensor.'''
+        values = self.recording.field_mT(self.chip.shaft_angle_deg(), self.chip.Z_mm() + self.Z_offset_mm,
+                                         self.nb_RM - 1)
+        return tuple(v / Param['SENSOR_Oe_mT'] for v in values)
+
+    def write(self, data:bytes):
+        if data.decode('ascii').strip() == 'PC' and self.recording.calibration:
+            # the recorded calibration block of the probe:
+            blocks = self.recording.calibration
+            self._reply(blocks[min(self.probe, len(blocks) - 1)].encode(), self.base_latency)
+            return len(data)
+        return super().write(data)
+
+
+def compare_data(recording:Recording, fileName:str):
+    '''
+    To compare the data of the file 'fileName' with the recorded data.
+    Returns the number of values compared, the number of poses missing, and the max difference [mT].
+    '''
+    replay = Recording(fileName)
+    if recording.MODE == 'Free':
+        nb = min(len(recording.samples), len(replay.samples))
+        ref, new = np.array(recording.samples[:nb]), np.array(replay.samples[:nb])
+        nb_missing = len(recording.samples) - nb
+    else:
+        poses = [pose for pose in recording.fields if pose in replay.fields]
+        ref = np.array([recording.fields[pose] for pose in poses])
+        new = np.array([replay.fields[pose] for pose in poses])
+        nb_missing = len(recording.fields) - len(poses)
+    diff = float(np.max(np.abs(new - ref))) if ref.size else 0.
+    return ref.size, nb_missing, diff
+
+
+if __name__ == "__main__":
+
+    import argparse
+    from ROTOR_bench import ROTOR_bench
+    from strike import Stepper1, Stepper2, run_job
+
+    parser = argparse.ArgumentParser(description="Replay of a recorded data file through the acquisition code")
+    parser.add_argument('fileName', help='the recorded ROTOR_*-a.txt, ROTOR_*-z.txt or FREE_*.txt file')
+    parser.add_argument('--time_scale', type=float, default=1, help='> 1 to run faster than real time')
+    parser.add_argument('--data_dir', default='TXT/REPLAY', help='the directory of the replayed data file')
+    parser.add_argument('--compare', help='a previous replayed file to compare byte for byte with the new one')
+    args = parser.parse_args()
+
+    recording = Recording(args.fileName)
+    params = dict(recording.params, DATA_DIR=args.data_dir)
+    print(f"[INFO] replay of <{args.fileName}>: {params}")
+
+    # the sensor settings and the probes of the recorded run:
+    for k in ('SENSOR_NB_SAMPLE', 'SENSOR_GAIN'):
+        if k in params: Param[k] = params[k]
+    Param['PROBE_Z_OFFSETS_MM'] = recording.offsets
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    # the checkpoint and the Z verification log of the replay are written next to the replayed
+    # data file, not in place of (or in) those of the real bench:
+    Param['CHECKPOINT_FILE'] = os.path.join(args.data_dir, 'ROTOR_checkpoint.json')
+    Param['ZREF_LOG_FILE']   = os.path.join(args.data_dir, 'ROTOR_Zref_log.csv')
+    R = ROTOR_bench(Stepper1, Stepper2, backend='sim', time_scale=args.time_scale,
+                    sim_sensor=partial(ReplayUSB25103, recording=recording))
+    t0 = monotonic()
+    files = run_job(R, params)
+    t_run = monotonic() - t0
+    if not files: sys.exit(1)
+
+    fileName = files[0]
+    nb_value, nb_missing, diff = compare_data(recording, fileName)
+    print(f"[INFO] replay done in {t_run:.1f} s (wall clock, x{args.time_scale}), {len(R.read_latency)} sensor reads")
+    print(f"[INFO] <{fileName}> vs recorded data: {nb_value} values compared, max difference: {diff:.6f} mT, "
+          f"{nb_missing} recorded poses missing")
+
+    if args.compare:
+        same = filecmp.cmp(fileName, args.compare, shallow=False)
+        print(f"[INFO] <{fileName}> and <{args.compare}> are {'identical' if same else 'DIFFERENT'}")
+        if not same: sys.exit(1)
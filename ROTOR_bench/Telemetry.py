@@ -0,0 +1,213 @@
+#
+# Copyright 2024-2025 Jean-Luc.CHARLES@mailo.com
+#
+
+#
+# The per-pose telemetry of the acquisition runs: the durations of the phases of each
+# measurement pose are recorded with the monotonic clock:
+#  - shaft       : the rotation of the ROTOR (Do_shaft_rotation, Do_coordinated_move without Z move),
+#  - Z           : the moves of the sensor carriage (Zmove_sensor, Do_coordinated_move with a Z move),
+#  - Zref        : the Z referencing and the Z position verifications,
+#  - serial_write: the 'RM' command sent to the sensor,
+#  - serial_wait : the wait for the 'RD x,y,z' reply of the sensor,
+#  - decode      : the decoding and the formatting of the data lines,
+#  - file_write  : the writing (and flushing) of the data file.
+# The 'decode' and 'file_write' phases are mostly done by the DataWriter thread, in parallel
+# to the acquisition: they are counted in the pose being acquired when they occur.
+# With several probes the serial phases are summed over the probes (read concurrently).
+# A pose includes the moves that lead to it (and the settle reads): a new pose starts when
+# the data of the previous one are sent to the DataWriter (see end_pose).
+# Each data file gets a sidecar '<data file>.metrics' (like the '.raw' and '.journal' files,
+# semicolon separated like the data files), one line for each pose, and the
+# summary of the run (share of each phase, projected durations for other ROT_STEP_DEG and
+# numbers of Z positions) is displayed at the end of the run.
+#
+
+import numpy as np
+from time import monotonic
+from threading import Lock, local
+from contextlib import contextmanager
+from functools import wraps
+
+from ROTOR_config import Param
+
+PHASES = ('shaft', 'Z', 'Zref', 'serial_write', 'serial_wait', 'decode', 'file_write')
+
+# the phases done by the hardware thread (the other ones overlap the acquisition):
+MAIN_PHASES = ('shaft', 'Z', 'Zref', 'serial_write', 'serial_wait')
+
+# how the total duration of each phase scales with the number of Z positions and the number of
+# angles, for the projections: {MODE: {phase: (exponent of nb_Z, exponent of nb_angle)}}, the
+# phases not listed scale with the number of poses (1, 1):
+SCALING = {'ByAngle': {'shaft': (1, 0), 'Z': (1, 0), 'Zref': (0, 0)},   # one rotation for each Zpos
+           'ByZPos':  {'shaft': (0, 0), 'Z': (0, 1), 'Zref': (0, 1)}}   # one Z scan for each angle
+
+def timed(phase:str):
+    '''
+    Decorator of the methods of ROTOR_bench: the duration of the method is counted in 'phase'.
+    '''
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.telemetry.phase(phase):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+def metrics_name(fileName:str):
+    '''
+    Returns the name of the sidecar metrics file of the data file 'fileName'.
+    '''
+    return fileName.rsplit('.', 1)[0] + '.metrics'
+
+
+class Telemetry():
+    '''
+    To record the durations of the phases of each measurement pose, see the module comment.
+    The durations are in seconds of bench time (the monotonic clock times time_scale).
+    '''
+    def __init__(self, time_scale:float = 1.):
+        self.time_scale = time_scale
+        self.lock    = Lock()
+        self.local   = local()  # the phase in progress in each thread (the nested phases are not counted)
+        self.fOut    = None     # the sidecar metrics file of the current data file
+        self.reset()
+
+    def reset(self, MODE:str = None, rot_step:float = None, nb_Z:int = None):
+        '''
+        To start the telemetry of a new run.
+        '''
+        self.MODE     = MODE
+        self.rot_step = rot_step
+        self.nb_Z     = nb_Z
+        self.rows     = []      # the rows of all the poses of the run: (durations of PHASES..., wall)
+        self.nb_file  = 0
+        self.pose     = 0
+        self.t_start  = monotonic()
+        self.t_pose   = self.t_start
+        self.current  = dict.fromkeys(PHASES, 0.)
+
+    def open(self, fileName:str):
+        '''
+        To open the sidecar metrics file of the data file 'fileName' (appended for a resumed run).
+        '''
+        self.close()
+        name = metrics_name(fileName)
+        self.fOut = open(name, "a", encoding="utf8")
+        if self.fOut.tell() == 0:
+            self.fOut.write("# pose; ZPos#; angle[°]; t[s]; " + "; ".join(f"{p}[ms]" for p in PHASES)
+                            + "; other[ms]\n")
+        self.nb_file += 1
+        self.pose = 0
+
+    def close(self):
+        '''
+        To record the phases since the last pose (end of the file), and to close the sidecar file.
+        '''
+        if self.fOut is None: return
+        if any(self.current.values()): self.end_pose()
+        self.fOut.close()
+        self.fOut = None
+
+    @contextmanager
+    def phase(self, name:str):
+        '''
+        The context of a phase: 'with telemetry.phase("Z"): ...'.
+        '''
+        if getattr(self.local, 'phase', None) is not None:
+            # a phase nested in another one (a Z move of the Z referencing...):
+            yield
+            return
+        self.local.phase = name
+        t0 = monotonic()
+        try:
+            yield
+        finally:
+            self.local.phase = None
+            self.add(name, monotonic() - t0)
+
+    def add(self, name:str, duration:float):
+        '''
+        To add 'duration' [s] (monotonic clock) to the phase 'name' of the current pose.
+        '''
+        with self.lock:
+            self.current[name] += duration * self.time_scale
+
+    def end_pose(self, n:int = None, angle:float = None):
+        '''
+        The measurement of the pose (Zpos #n, angle) is done: to record its phases.
+        '''
+        t = monotonic()
+        with self.lock:
+            durations = [self.current[p] for p in PHASES]
+            self.current = dict.fromkeys(PHASES, 0.)
+        wall  = (t - self.t_pose) * self.time_scale
+        other = max(0., wall - sum(self.current_main(durations)))
+        self.rows.append(durations + [wall])
+        if self.fOut is not None:
+            self.fOut.write(f"{self.pose}; {'' if n is None else n}; {'' if angle is None else f'{angle:.1f}'}; "
+                            f"{(self.t_pose - self.t_start)*self.time_scale:.3f}; "
+                            + "; ".join(f"{d*1e3:.1f}" for d in durations) + f"; {other*1e3:.1f}\n")
+        self.pose  += 1
+        self.t_pose = t
+
+    @staticmethod
+    def current_main(durations:list):
+        '''
+        Returns the durations of the phases done by the hardware thread, among 'durations' (PHASES order).
+        '''
+        return [d for p, d in zip(PHASES, durations) if p in MAIN_PHASES]
+
+    def totals(self):
+        '''
+        Returns the total durations [s] of the run: {phase: total}, with the 'other' phase (the time
+        of the hardware thread out of the recorded phases) and the 'wall' time.
+        '''
+        rows = np.array(self.rows).reshape(-1, len(PHASES) + 1)
+        totals = dict(zip(PHASES + ('wall',), rows.sum(axis=0)))
+        totals['other'] = max(0., totals['wall'] - sum(totals[p] for p in MAIN_PHASES))
+        return totals
+
+    def project(self, rot_step:float, nb_Z:int):
+        '''
+        Returns the projected duration [s] of one repetition of the run with the rotation step
+        angle 'rot_step' and 'nb_Z' Z positions, from the phases measured (first order model:
+        each phase scales with the numbers of Z positions and angles as given by SCALING).
+        '''
+        totals  = self.totals()
+        nb_file = max(1, self.nb_file)
+        ratio_Z, ratio_angle = nb_Z / self.nb_Z, self.rot_step / rot_step
+        scaling = SCALING[self.MODE]
+        t = 0.
+        for p in MAIN_PHASES + ('other',):
+            a, b = scaling.get(p, (1, 1))
+            t += totals[p] / nb_file * ratio_Z**a * ratio_angle**b
+        return t
+
+    def print_summary(self, width:int = 40):
+        '''
+        To display the share of each phase in the run, the per-pose median and p95 of each phase
+        and, for the ByAngle and ByZPos modes, the projected durations for other ROT_STEP_DEG
+        and numbers of Z positions.
+        '''
+        if not self.rows: return
+        rows   = np.array(self.rows)
+        totals = self.totals()
+        wall   = totals['wall']
+        print(f"[INFO] telemetry of {len(rows)} poses, {wall:.1f} s:")
+        print(f"[INFO] {'phase':>12s} {'total [s]':>10s} {'share':>6s} {'p50 [ms]':>9s} {'p95 [ms]':>9s}")
+        columns = {p: rows[:, i] for i, p in enumerate(PHASES)}
+        columns['other'] = np.maximum(0., rows[:, -1] - rows[:, [PHASES.index(p) for p in MAIN_PHASES]].sum(axis=1))
+        for p in MAIN_PHASES + ('other',) + tuple(p for p in PHASES if p not in MAIN_PHASES):
+            share = totals[p] / wall if wall > 0 else 0.
+            bar = '#' * round(width * share)
+            print(f"[INFO] {p:>12s} {totals[p]:10.1f} {share:6.1%} {np.median(columns[p])*1e3:9.1f} "
+                  f"{np.percentile(columns[p], 95)*1e3:9.1f} {bar}")
+        print(f"[INFO] ('decode' and 'file_write' are done by the writer thread, in parallel to the acquisition)")
+
+        if self.MODE not in SCALING or not self.rot_step or not self.nb_Z: return
+        list_nb_Z = Param['METRICS_PROJ_NB_Z']
+        print(f"[INFO] projected duration of a {self.MODE} repetition [h] (measured: ROT_STEP_DEG {self.rot_step}, {self.nb_Z} Zpos):")
+        print(f"[INFO] {'ROT_STEP_DEG':>12s} " + " ".join(f"{f'{nb} Zpos':>8s}" for nb in list_nb_Z))
+        for rot_step in Param['METRICS_PROJ_ROT_STEPS']:
+            print(f"[INFO] {rot_step:12.1f} " + " ".join(f"{self.project(rot_step, nb)/3600:8.2f}" for nb in list_nb_Z))
@@ -67,12 +67,12 @@ def get_param_from_user(mess:str,
             break
     return value
 
-def uniq_file_name_ROTOR(now, work_dist, rot_step, Zpos_mm, repet, mode):
+def uniq_file_name_ROTOR(now, work_dist, rot_step, Zpos_mm, repet, mode, data_dir='TXT'):
     '''
-    Defines a uniq file name mixing date info and parameters info.
+    Defines a uniq file name mixing date info and parameters info, in the directory 'data_dir'.
     '''
     assert mode in ("ByAngle", "ByZPos")
-    fileName = f'TXT/ROTOR_{now.strftime("%Y-%m-%d-%H-%M")}'
+    fileName = f'{data_dir}/ROTOR_{now.strftime("%Y-%m-%d-%H-%M")}'
     fileName += f'_WDIST-{work_dist:02d}'
     fileName += f'_ROTSTEP-{rot_step:05.1f}'
     for z in Zpos_mm:
@@ -87,11 +87,11 @@ def uniq_file_name_ROTOR(now, work_dist, rot_step, Zpos_mm, repet, mode):
     
     return fileName
 
-def uniq_file_name_FREE(now, duration, sampling, SAMPLE=None, GAIN=None, DELAY=None, repet=(1,1)):
+def uniq_file_name_FREE(now, duration, sampling, SAMPLE=None, GAIN=None, DELAY=None, repet=(1,1), data_dir='TXT'):
     '''
-    Defines a uniq file name mixing date info and parameters info.
+    Defines a uniq file name mixing date info and parameters info, in the directory 'data_dir'.
     '''
-    fileName = f'TXT/FREE_{now.strftime("%Y-%m-%d-%H-%M")}'
+    fileName = f'{data_dir}/FREE_{now.strftime("%Y-%m-%d-%H-%M")}'
     if SAMPLE is None: SAMPLE = Params['SENSOR_NB_SAMPLE']
     if GAIN is None: GAIN =  Params['SENSOR_GAIN']
     if DELAY is None: DELAY = Params['SENSOR_READ_DELAY']
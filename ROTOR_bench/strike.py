@@ -3,8 +3,8 @@
 #
 
 import sys, os, json
-from ROTOR_bench import ROTOR_bench
 from ROTOR_config import StepperMotor
+from ROTOR_daemon import submit_job
 
 #
 # This is the file that is in charge :
@@ -12,54 +12,90 @@ from ROTOR_config import StepperMotor
 #  2/ to instanciate a ROTOR_bench object, passing the 2 stepper motors as arguments
 #  3/ To read the  paramFile (/tmp/ROTOR_LAUNCH.txt) and to lauch the right ROTOR_bench
 #     method depending on the value of MODE in the paramfile.
+#  4/ If the bench daemon (ROTOR_daemon.py) is running, the run is submitted to the
+#     daemon rather than launched by this process.
 #      
 Stepper1 = StepperMotor("Stepper motor connected to the shaft",
                         STEP_MODE=1, STEPPER_ANGLE=1.8, NB_STEP_PER_REVOL=200,
                         NB_REVOL_PER_SEC=0.3,
                         GPIO_DIR=17, GPIO_STEP=27, GPIO_ENA=22,
-                        RATIO=6)
+                        RATIO=6,
+                        MAX_REVOL_PER_SEC=0.8, ACCEL_REVOL_PER_SEC2=1.)
 
 Stepper2 = StepperMotor("Stepper motor for the sensorZ motion", 
                         STEP_MODE=1, STEPPER_ANGLE=1.8, NB_STEP_PER_REVOL=200,
                         NB_REVOL_PER_SEC=0.5,
                         GPIO_DIR=10, GPIO_STEP=9, GPIO_ENA=11,
                         RATIO=None,
-                        DIAM_MM=10)
-
-paramFile = "/tmp/ROTOR_LAUNCH.txt"
-
-if (os.path.exists(paramFile)):
-    with open(paramFile, "r", encoding="utf8") as f:
-        params = json.loads(f.read())
-    print("params:", params)
-    os.remove(paramFile)
-    print(f"Found file <{paramFile}>, using params: {params}")
-
-else:
-    # If file /tmp/ROTOR_LAUNCH.txt is not found use these parameters:
-    params = {'MODE': 'ByAngle',
-              'WORK_DIST': 12,
-              'ROT_STEP_DEG': 120,
-              'Z_POS_MM':[30],
-              'NB_REPET': 1}
-    print(f"File <{paramFile}> not found... using params:<{params}>")
-
-match(params['MODE']):
+                        DIAM_MM=10,
+                        MAX_REVOL_PER_SEC=2.5, ACCEL_REVOL_PER_SEC2=5.)
+
+def run_job(R, params:dict):
+    '''
+    To launch the right ROTOR_bench method depending on the value of MODE in params.
+    Returns the list of the data files written by the run.
+    '''
+    match(params['MODE']):
     
-    case 'ByZPos':
-        R = ROTOR_bench(Stepper1, Stepper2)
-        R.run_by_ZPos(params, verbose=True)
+        case 'ByZPos':
+            return R.run_by_ZPos(params, verbose=True)
     
-    case 'ByAngle':
-        R = ROTOR_bench(Stepper1, Stepper2)
-        R.run_by_Angle(params, verbose=True)
+        case 'ByAngle':
+            return R.run_by_Angle(params, verbose=True)
 
-    case 'Free':
-        R = ROTOR_bench(Stepper1, Stepper2)
-        R.run_free(params)
-    
-    case 'ReleaseMotors':
-        R = ROTOR_bench(Stepper1, Stepper2, init_serial=False)
-        R.Stop_ROTOR_Bench()
+        case 'Continuous':
+            return R.run_continuous(params, verbose=True)
+
+        case 'Adaptive':
+            return R.run_adaptive(params, verbose=True)
+
+        case 'Free':
+            return R.run_free(params)
+
+        case 'Tune':
+            # benchmark of the sensor settings (see ROTOR_bench.run_tune):
+            return R.run_tune(params)
+
+        case 'Resume':
+            # resume the interrupted run recorded in the checkpoint file:
+            return R.resume_run(verbose=True)
     
+        case 'ReleaseMotors':
+            R.Stop_ROTOR_Bench()
+
+        case _:
+            print(f"[ERROR] unknown MODE <{params['MODE']}>")
+
+if __name__ == "__main__":
+
+    paramFile = "/tmp/ROTOR_LAUNCH.txt"
+
+    if (os.path.exists(paramFile)):
+        with open(paramFile, "r", encoding="utf8") as f:
+            params = json.loads(f.read())
+        print("params:", params)
+        os.remove(paramFile)
+        print(f"Found file <{paramFile}>, using params: {params}")
+
+    else:
+        # If file /tmp/ROTOR_LAUNCH.txt is not found use these parameters:
+        params = {'MODE': 'ByAngle',
+                  'WORK_DIST': 12,
+                  'ROT_STEP_DEG': 120,
+                  'Z_POS_MM':[30],
+                  'NB_REPET': 1}
+        print(f"File <{paramFile}> not found... using params:<{params}>")
+
+    # When the bench daemon is running (see ROTOR_daemon.py), submit the job to it
+    # and follow its progress, instead of initializing the bench again:
+    if submit_job(params): sys.exit()
+
+    # only the local run needs the bench (numpy, matplotlib, gpiod...):
+    from ROTOR_bench import ROTOR_bench
+
+    # The hardware backend: 'rpi' for the real bench, 'sim' for the emulated hardware
+    # (see ROTOR_emulator.py), with the emulated time running TIME_SCALE faster:
+    backend = {'backend': params.get('BACKEND', 'rpi'), 'time_scale': params.get('TIME_SCALE', 1)}
 
+    R = ROTOR_bench(Stepper1, Stepper2, init_serial=(params['MODE'] != 'ReleaseMotors'), **backend)
+    run_job(R, params)